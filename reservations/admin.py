@@ -1,25 +1,138 @@
+from collections import Counter
 from django.contrib import admin
 
-from .models import User, Menu, MenuItem, Order
+from .models import User, Menu, MenuItem, Order, OrderAggregate
+from .caches import bump_menu_version, forget_todays_menu
 
 class MenuItemInline(admin.TabularInline):
     """
     Inline definition of menuItems for the admin interface, allows for easy creation of menus.
+    The order count is shown as its total, see MenuItemManager.
     """
     model = MenuItem
     extra = 2
+    fields = ('item_text', 'total_count')
+    readonly_fields = ('total_count',)
+
+    def get_queryset(self, request):
+        return MenuItem.objects.with_total_count()
+
+    def total_count(self, obj):
+        return getattr(obj, 'total_count', 0)
+    total_count.short_description = 'count'
 
 class MenuAdmin(admin.ModelAdmin):
     """
     Custom menu creation and edit view for the admin panel, used mostly for testing purposes.
     """
     fieldsets = [
-        ('Titulo de menu', {'fields': ['menu_title']}),
+        ('Titulo de menu', {'fields': ['menu_title', 'service_date']}),
+        ('Horario de pedidos', {'fields': ['orders_open_at', 'orders_close_at']}),
     ]
     inlines=[MenuItemInline]
-    list_display = ('menu_title', 'created', 'modified', 'unique_id')
+    list_display = ('menu_title', 'service_date', 'created', 'modified', 'unique_id')
+
+    def save_formset(self, request, form, formset, change):
+        """
+        Saves the menu items of the inline, creating all the new ones with a single insert.
+        """
+        if formset.model is not MenuItem:
+            return super().save_formset(request, form, formset, change)
+        formset.save(commit=False)
+        MenuItem.objects.filter(pk__in=[item.pk for item in formset.deleted_objects]).delete()
+        for item in formset.changed_objects:
+            item[0].save()
+        MenuItem.objects.bulk_create(formset.new_objects)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'service_date' in form.changed_data:
+            forget_todays_menu(form.initial['service_date'], obj.service_date)
+        elif not change:
+            forget_todays_menu(obj.service_date)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        bump_menu_version(form.instance.pk)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_menu_version(obj.pk)
+        forget_todays_menu(obj.service_date)
+
+    def delete_queryset(self, request, queryset):
+        menus = list(queryset.values_list('pk', 'service_date'))
+        super().delete_queryset(request, queryset)
+        for menu_id, _ in menus:
+            bump_menu_version(menu_id)
+        forget_todays_menu(*[service_date for _, service_date in menus])
+
+class MenuItemAdmin(admin.ModelAdmin):
+    """
+    Menu item view for the admin panel, shows the total order count of each item.
+    """
+    fields = ('menu', 'item_text', 'total_count')
+    readonly_fields = ('total_count',)
+    list_display = ('item_text', 'menu', 'total_count')
+
+    def get_queryset(self, request):
+        return MenuItem.objects.with_total_count()
+
+    def total_count(self, obj):
+        return getattr(obj, 'total_count', 0)
+    total_count.short_description = 'count'
+    total_count.admin_order_field = 'total_count'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'menu' in form.changed_data:
+            bump_menu_version(form.initial['menu'])
+        bump_menu_version(obj.menu_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_menu_version(obj.menu_id)
+
+    def delete_queryset(self, request, queryset):
+        menu_ids = set(queryset.values_list('menu_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for menu_id in menu_ids:
+            bump_menu_version(menu_id)
+
+class OrderAdmin(admin.ModelAdmin):
+    """
+    Order view for the admin panel, keeps the order aggregates up to date when orders are
+    changed or deleted, and gives a new version to the menus of changed orders (see
+    api.menu_watermark). Orders deleted along with their user are taken out of the aggregates
+    by signals.remove_user_orders_from_aggregates.
+    """
+    list_display = ('user', 'item_choice', 'size', 'menu', 'created')
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        old_item = MenuItem.objects.get(pk=form.initial['item_choice'])
+        obj.menu_id = obj.item_choice.menu_id
+        super().save_model(request, obj, form, change)
+        if old_item.pk != obj.item_choice_id or form.initial['size'] != obj.size:
+            OrderAggregate.objects.add(old_item.menu_id, old_item.pk, form.initial['size'], -1)
+            OrderAggregate.objects.add(obj.menu_id, obj.item_choice_id, obj.size)
+            # The number of orders of the menu didn't change, so its API watermark wouldn't
+            # either without a new version of the menu
+            bump_menu_version(old_item.menu_id)
+            bump_menu_version(obj.menu_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        OrderAggregate.objects.add(obj.menu_id, obj.item_choice_id, obj.size, -1)
+
+    def delete_queryset(self, request, queryset):
+        counts = Counter(queryset.values_list('menu_id', 'item_choice_id', 'size'))
+        super().delete_queryset(request, queryset)
+        for (menu_id, item_id, size), amount in counts.items():
+            OrderAggregate.objects.add(menu_id, item_id, size, -amount)
 
 admin.site.register(User)
 admin.site.register(Menu, MenuAdmin)
-admin.site.register(MenuItem)
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(MenuItem, MenuItemAdmin)
+admin.site.register(Order, OrderAdmin)
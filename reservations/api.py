@@ -0,0 +1,358 @@
+import json
+import uuid
+from functools import wraps
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.utils.decorators import available_attrs
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST, require_safe
+from django.views.decorators.vary import vary_on_cookie
+from .models import Menu, Order, OrderAggregate, User
+from .caches import get_menu_state, get_menu_version, get_todays_menu
+from .forms import OrderForm
+from .intake import ACCEPTED, REJECTED, save_orders
+from .pagination import CursorPaginator
+
+# Version of the API, part of its URLs and of every ETag it sends.
+API_VERSION = 'v1'
+
+# Number of orders per page of the user orders endpoint.
+API_ORDERS_PER_PAGE = 50
+
+# Maximum number of orders that can be placed with a single request.
+API_MAX_BATCH_SIZE = 200
+
+
+def api_error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def api_login_required(view_func):
+    """
+    Decorator for API views that checks that the user is logged in, answering with a 401 JSON
+    error instead of redirecting to the log-in page.
+    """
+    @wraps(view_func, assigned=available_attrs(view_func))
+    def _wrapped_view(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return api_error('Para continuar debe identificarse.', 401)
+        return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def revalidated(view_func):
+    """
+    Decorator for API views whose responses can be kept by the client (but not by shared
+    caches, since they depend on the user) as long as they are revalidated on every use.
+    """
+    return vary_on_cookie(cache_control(private=True, no_cache=True)(require_safe(view_func)))
+
+
+def memoized_watermark(func):
+    """
+    Decorator for the watermark functions of the API, so their queries run once per request
+    even though both the ETag and the Last-Modified functions of condition use them.
+    """
+    attr = '_nora_%s' % func.__name__
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        if not hasattr(request, attr):
+            setattr(request, attr, func(request, *args, **kwargs))
+        return getattr(request, attr)
+    return wrapper
+
+
+def make_etag(*parts):
+    return '-'.join([API_VERSION] + [str(part) for part in parts])
+
+
+def serialize_menu(menu, items):
+    return {
+        'id': str(menu.pk),
+        'title': menu.menu_title,
+        'service_date': menu.service_date.isoformat(),
+        'orders_open_at': menu.orders_open_at.isoformat(),
+        'orders_close_at': menu.orders_close_at.isoformat(),
+        'modified': menu.modified.isoformat(),
+        'items': [{'id': pk, 'text': text} for pk, text in items],
+    }
+
+
+@memoized_watermark
+def todays_menu_watermark(request):
+    """
+    Returns the ETag and the last modification time of today's menu, taken from the cache (see
+    caches.get_todays_menu) without any query once it's warm.
+    """
+    menu = get_todays_menu()
+    if menu is None:
+        return make_etag('no-menu'), None
+    return make_etag(menu.pk, get_menu_version(menu.pk)), menu.modified
+
+
+@revalidated
+@condition(
+    etag_func=lambda request: todays_menu_watermark(request)[0],
+    last_modified_func=lambda request: todays_menu_watermark(request)[1])
+def todays_menu(request):
+    """
+    API view that returns, as JSON, today's menu along with its items (null if it wasn't
+    published yet). Public, like the menu page.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    """
+    menu = get_todays_menu()
+    if menu is None:
+        return JsonResponse({'menu': None})
+    return JsonResponse({'menu': serialize_menu(menu, get_menu_state(menu.pk)['items'])})
+
+
+@memoized_watermark
+def open_menus_watermark(request):
+    """
+    Returns the menus that can be ordered from right now, soonest to close first, taken with a
+    single query (see MenuQuerySet.open_now), along with the ETag of the list. There's no last
+    modification time, since a menu leaving the list when it closes doesn't modify anything.
+    """
+    menus = list(Menu.objects.open_now().order_by('orders_close_at'))
+    return menus, make_etag('open', *[
+        '%s.%s' % (menu.pk, get_menu_version(menu.pk)) for menu in menus])
+
+
+@revalidated
+@condition(etag_func=lambda request: open_menus_watermark(request)[1])
+def open_menus(request):
+    """
+    API view that returns, as JSON, the menus that can be ordered from right now along with
+    their items (taken from the cache, see caches.get_menu_state). Public, like the menu page.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    """
+    return JsonResponse({
+        'menus': [
+            serialize_menu(menu, get_menu_state(menu.pk)['items'])
+            for menu in open_menus_watermark(request)[0]
+        ],
+    })
+
+
+@memoized_watermark
+def menu_watermark(request, unique_id):
+    """
+    Returns the ETag and the last modification time of a menu as seen by the user: for chefs,
+    who get the order counts, they also depend on the number of orders of the menu and the time
+    of the last one (a single query on the orders' menu index). Returns (None, None) if the menu
+    doesn't exist.
+    """
+    try:
+        menu = get_menu_state(unique_id)['menu']
+    except Menu.DoesNotExist:
+        return None, None
+    version = get_menu_version(unique_id)
+    if not (request.user.is_authenticated and request.user.is_chef):
+        return make_etag(menu.pk, version), menu.modified
+    orders = Order.objects.filter(menu=unique_id).aggregate(
+        last=Max('created'), count=Count('pk'))
+    if orders['last'] is None:
+        return make_etag(menu.pk, version, 0), menu.modified
+    return (
+        make_etag(menu.pk, version, orders['count'], orders['last'].timestamp()),
+        max(menu.modified, orders['last']))
+
+
+@revalidated
+@condition(
+    etag_func=lambda request, unique_id: menu_watermark(request, unique_id)[0],
+    last_modified_func=lambda request, unique_id: menu_watermark(request, unique_id)[1])
+def menu_detail(request, unique_id):
+    """
+    API view that returns, as JSON, a menu along with its items, it returns 404 if the menu does
+    not exist. Public, like the menu page, but chefs also get the number of orders of each item
+    by size (from the order aggregates) under 'counts' and their totals under 'count'.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    **unique_id**
+        The UUID recovered from the URL that is used to retrieve the menu.
+    """
+    try:
+        state = get_menu_state(unique_id)
+    except Menu.DoesNotExist:
+        return api_error('Menú no encontrado', 404)
+    data = serialize_menu(state['menu'], state['items'])
+    if request.user.is_authenticated and request.user.is_chef:
+        counts = {}
+        for item_id, size, count in (
+                OrderAggregate.objects.filter(menu=unique_id)
+                .values_list('item_id', 'size', 'count')):
+            counts.setdefault(item_id, {})[size] = count
+        for item in data['items']:
+            item_counts = counts.get(item['id'], {})
+            item['counts'] = {
+                display: item_counts.get(size, 0) for size, display in Order.MEAL_SIZES}
+            item['count'] = sum(item_counts.values())
+    return JsonResponse(data)
+
+
+@memoized_watermark
+def user_orders_watermark(request, user_id):
+    """
+    Returns the ETag and the last modification time of the orders of a user: the number of
+    orders, the time of the last one and the last time any of their menus was modified, all
+    taken with a single query.
+    """
+    orders = Order.objects.filter(user=user_id).aggregate(
+        last=Max('created'), count=Count('pk'), menus=Max('menu__modified'))
+    times = [time for time in (orders['last'], orders['menus']) if time]
+    return (
+        make_etag('orders', user_id, orders['count'], *[time.timestamp() for time in times]),
+        max(times) if times else None)
+
+
+@api_login_required
+def user_orders(request, user_id):
+    """
+    API view that returns, as JSON, the orders of a user, newest first and paginated by cursor
+    (taken from the 'cursor' GET parameter, the next one is given under 'next_cursor'). Like the
+    user's orders page, only chefs and the user can see them, others get a 403 error.
+
+    Arguments:
+
+    **user_id**
+        A user ID derived from the URL, used to check if the user has access to this view.
+    """
+    if not request.user.is_chef and request.user.pk != user_id:
+        return api_error('Usted no esta autorizado para ver estas órdenes.', 403)
+    if request.user.pk != user_id and not User.objects.filter(pk=user_id).exists():
+        return api_error('Usuario no encontrado', 404)
+    return user_orders_page(request, user_id)
+
+
+@revalidated
+@condition(
+    etag_func=lambda request, user_id: user_orders_watermark(request, user_id)[0],
+    last_modified_func=lambda request, user_id: user_orders_watermark(request, user_id)[1])
+def user_orders_page(request, user_id):
+    paginator = CursorPaginator(
+        Order.objects.filter(user=user_id).as_rows(), API_ORDERS_PER_PAGE)
+    page = paginator.page(request.GET.get('cursor'))
+    return JsonResponse({
+        'orders': [
+            {
+                'id': str(row.unique_id),
+                'created': row.created.isoformat(),
+                'menu': str(row.menu_id),
+                'menu_title': row.menu_title,
+                'item': row.item_text,
+                'size': row.size_display,
+                'comments': row.comments,
+            }
+            for row in page
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+
+def validate_orders(request, menu, items, entries):
+    """
+    Validates a batch of orders for a menu in a single pass: each one with the rules of
+    OrderForm against the cached items of the menu, and the users they are placed for with a
+    single query. Orders for other users need the place_team_orders permission, and can only be
+    placed for active clients. Returns the list of orders to save, as (index, payload) pairs in
+    the format of intake.save_orders, and a dict with the results of the rejected ones by index.
+    """
+    results = {}
+    forms = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            results[index] = {'status': REJECTED, 'reason': 'invalid'}
+            continue
+        form = OrderForm(data=entry)
+        form.use_menu_items(menu, items)
+        if not form.is_valid():
+            results[index] = {
+                'status': REJECTED, 'reason': 'invalid', 'errors': form.errors.get_json_data()}
+            continue
+        user_id = entry.get('user', request.user.pk)
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            results[index] = {'status': REJECTED, 'reason': 'invalid_user'}
+            continue
+        forms.append((index, user_id, form))
+    can_order_for_others = request.user.has_perm('reservations.place_team_orders')
+    clients = set(
+        User.objects.filter(
+            pk__in={user_id for _, user_id, _ in forms if user_id != request.user.pk},
+            is_active=True, is_chef=False)
+        .values_list('pk', flat=True))
+    if not request.user.is_chef:
+        clients.add(request.user.pk)
+    payloads = []
+    for index, user_id, form in forms:
+        if user_id != request.user.pk and not can_order_for_others:
+            results[index] = {'status': REJECTED, 'reason': 'forbidden'}
+        elif user_id not in clients:
+            results[index] = {'status': REJECTED, 'reason': 'invalid_user'}
+        else:
+            payloads.append((index, {
+                'ticket': str(uuid.uuid4()),
+                'user': user_id,
+                'menu': str(menu.pk),
+                'item': form.cleaned_data['item_choice'].pk,
+                'size': form.cleaned_data['size'],
+                'comments': form.cleaned_data['comments'],
+            }))
+    return payloads, results
+
+
+@api_login_required
+@require_POST
+def place_orders(request):
+    """
+    API view that places one or many orders for a menu with a single request. The body is a JSON
+    object with the id of the menu under 'menu' and the orders under 'orders', each one with the
+    fields of OrderForm ('item_choice', 'size' and 'comments') and optionally the id of the user
+    it's for under 'user' (by default the user making the request). Ordering for other users
+    needs the place_team_orders permission.
+    The batch is validated in one pass (see validate_orders) and the valid orders are written
+    together, with a bulk insert and one count update per item (see intake.save_orders). The
+    response has the result of each order, in the same order: its status ('accepted' or
+    'rejected'), the id of the new order or the reason of the rejection. It returns 400 if the
+    body is not valid, 404 if the menu does not exist and 409 if it can't be ordered from anymore.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    """
+    try:
+        data = json.loads(request.body.decode())
+        menu_id = uuid.UUID(data['menu'])
+        entries = data['orders']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return api_error('Formato inválido', 400)
+    if not isinstance(entries, list) or not entries or len(entries) > API_MAX_BATCH_SIZE:
+        return api_error('Debe enviar entre 1 y %d órdenes' % API_MAX_BATCH_SIZE, 400)
+    try:
+        state = get_menu_state(menu_id)
+    except Menu.DoesNotExist:
+        return api_error('Menú no encontrado', 404)
+    if not state['menu'].is_open():
+        return api_error('Ya pasó el tiempo para ordernar de este menú', 409)
+    payloads, results = validate_orders(request, state['menu'], state['items'], entries)
+    statuses = save_orders([payload for _, payload in payloads]) if payloads else {}
+    for index, payload in payloads:
+        status = statuses[uuid.UUID(payload['ticket'])]
+        if status['status'] == ACCEPTED:
+            results[index] = {'status': ACCEPTED, 'id': payload['ticket']}
+        else:
+            results[index] = {'status': REJECTED, 'reason': status['reason']}
+    return JsonResponse({'orders': [results[index] for index in range(len(entries))]})
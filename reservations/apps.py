@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ReservationsConfig(AppConfig):
     name = 'reservations'
+
+    def ready(self):
+        # Registers the system checks and the signal receivers of the app
+        from . import checks, signals
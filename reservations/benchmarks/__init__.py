@@ -0,0 +1,7 @@
+"""
+Benchmarks of the views of the reservations app, kept apart from the tests (their modules don't
+match the test discovery pattern) since building the larger datasets takes a while. Run them
+with::
+
+    python manage.py test reservations.benchmarks.bench_views
+"""
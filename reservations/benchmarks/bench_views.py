@@ -0,0 +1,241 @@
+import json
+import os
+import time
+import tracemalloc
+import uuid
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from .. import intake, urls
+from ..models import Order
+from .datasets import Dataset
+
+# Number of orders of each dataset the views are benchmarked against, can be changed with the
+# NORA_BENCHMARK_SIZES environment variable (e.g: "10,1000").
+BENCHMARK_SIZES = (10, 1000, 100000)
+
+# Stored maximum number of queries of each benchmark, rewritten when the NORA_BENCHMARK_UPDATE
+# environment variable is set.
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+class ViewBenchmark:
+    """
+    A request to a view to be benchmarked.
+
+    Arguments:
+
+    **name**
+        Name of the benchmark, as used in the baselines.
+    **url_name**
+        Name of the URL pattern of the view.
+    **user**
+        Function of the dataset that returns the user the request is made as, None for anonymous
+        requests.
+    **kwargs**
+        Function of the dataset that returns the arguments of the URL.
+    **method**
+        HTTP method of the request, 'get' by default.
+    **data**
+        Function of the dataset that returns the data sent with the request.
+    **content_type**
+        Content type of the data, if it isn't form data.
+    **consume**
+        Whether the content of a streaming response is read as part of the request, True by
+        default.
+    """
+    def __init__(self, name, url_name, user=None, kwargs=None, method='get', data=None,
+                 content_type=None, consume=True):
+        self.name = name
+        self.url_name = url_name
+        self.user = user
+        self.kwargs = kwargs
+        self.method = method
+        self.data = data
+        self.content_type = content_type
+        self.consume = consume
+
+    def request(self, dataset):
+        client = Client()
+        if self.user is not None:
+            client.force_login(self.user(dataset))
+        url = reverse(self.url_name, kwargs=self.kwargs(dataset) if self.kwargs else None)
+        extra = {}
+        if self.data is not None:
+            extra['data'] = self.data(dataset)
+        if self.content_type is not None:
+            extra['content_type'] = self.content_type
+        return lambda: self.consume_response(getattr(client, self.method)(url, **extra))
+
+    def consume_response(self, response):
+        if response.streaming and self.consume:
+            b''.join(response.streaming_content)
+        response.close()
+        return response
+
+
+def chef(dataset):
+    return dataset.chef
+
+
+def client(dataset):
+    return dataset.client
+
+
+def menu_id(dataset):
+    return {'unique_id': dataset.menu.pk}
+
+
+def queued_ticket(dataset):
+    ticket = uuid.uuid4()
+    cache.set(intake.status_key(ticket), {'user': dataset.client.pk, 'status': intake.PENDING})
+    return {'ticket': ticket}
+
+
+BENCHMARKS = [
+    ViewBenchmark('home', 'home'),
+    ViewBenchmark('home_client', 'home', user=client),
+    ViewBenchmark('signup', 'signup'),
+    ViewBenchmark('login', 'login'),
+    ViewBenchmark('logout', 'logout', user=client),
+    ViewBenchmark('menu', 'menu', kwargs=menu_id),
+    ViewBenchmark('menu_client', 'menu', user=client, kwargs=menu_id),
+    ViewBenchmark('edit_menu', 'edit_menu', user=chef, kwargs=menu_id),
+    ViewBenchmark('new_menu', 'new_menu', user=chef),
+    ViewBenchmark('new_order', 'new_order', user=client, kwargs=menu_id),
+    ViewBenchmark(
+        'new_order_post', 'new_order', user=lambda dataset: dataset.new_client(), kwargs=menu_id,
+        method='post', data=lambda dataset: {
+            'item_choice': dataset.menu.menuitem_set.order_by('pk').first().pk,
+            'size': Order.NORMAL,
+            'comments': '',
+        }),
+    ViewBenchmark('menu_orders', 'menu_orders', user=chef, kwargs=menu_id),
+    ViewBenchmark('export_menu_orders', 'export_menu_orders', user=chef, kwargs=menu_id),
+    # The event stream is only opened, it would wait for events otherwise
+    ViewBenchmark(
+        'menu_order_events', 'menu_order_events', user=chef, kwargs=menu_id, consume=False),
+    ViewBenchmark('order_report', 'order_report', user=chef),
+    ViewBenchmark(
+        'user_orders', 'user_orders', user=client,
+        kwargs=lambda dataset: {'user_id': dataset.client.pk}),
+    ViewBenchmark('order_status', 'order_status', user=client, kwargs=queued_ticket),
+    ViewBenchmark('api_todays_menu', 'api_todays_menu'),
+    ViewBenchmark('api_open_menus', 'api_open_menus'),
+    ViewBenchmark('api_menu', 'api_menu', user=chef, kwargs=menu_id),
+    ViewBenchmark(
+        'api_user_orders', 'api_user_orders', user=client,
+        kwargs=lambda dataset: {'user_id': dataset.client.pk}),
+    ViewBenchmark(
+        'api_place_orders', 'api_place_orders', user=lambda dataset: dataset.new_client(),
+        method='post', content_type='application/json', data=lambda dataset: json.dumps({
+            'menu': str(dataset.menu.pk),
+            'orders': [{
+                'item_choice': dataset.menu.menuitem_set.order_by('pk').first().pk,
+                'size': Order.NORMAL,
+            }],
+        })),
+    ViewBenchmark('metrics', 'metrics', user=lambda dataset: dataset.admin),
+]
+
+
+def benchmark_sizes():
+    sizes = os.environ.get('NORA_BENCHMARK_SIZES')
+    if not sizes:
+        return BENCHMARK_SIZES
+    return tuple(int(size) for size in sizes.split(','))
+
+
+def measure(benchmark, dataset):
+    """
+    Returns the number of queries, wall time (in milliseconds) and peak memory allocated (in
+    KiB) of a request to a view, once the caches it uses are warm.
+    """
+    benchmark.request(dataset)()
+    queries = [0]
+
+    def counter(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    send = benchmark.request(dataset)
+    with connection.execute_wrapper(counter):
+        started = time.perf_counter()
+        response = send()
+        elapsed = time.perf_counter() - started
+    send = benchmark.request(dataset)
+    tracemalloc.start()
+    try:
+        send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': queries[0],
+        'time_ms': round(elapsed * 1000, 2),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+class ViewBudgetTests(TestCase):
+    """
+    Benchmarks every view against datasets of increasing size (see BENCHMARK_SIZES), failing
+    when the number of queries of a view grows with the size of the data or goes over its
+    baseline (see baselines.json). The results can be saved as JSON to the file given by the
+    NORA_BENCHMARK_OUTPUT environment variable.
+    """
+    def test_every_url_is_benchmarked(self):
+        """
+        Tests that every URL of the app has a benchmark, so new views can't be left out.
+        """
+        benchmarked = {benchmark.url_name for benchmark in BENCHMARKS}
+        missing = {pattern.name for pattern in urls.urlpatterns} - benchmarked
+        self.assertFalse(missing, 'Views without a benchmark: %s' % ', '.join(sorted(missing)))
+
+    def test_query_budgets(self):
+        """
+        Tests that the number of queries of every view doesn't depend on the size of the data,
+        and is within its baseline.
+        """
+        results = {benchmark.name: {} for benchmark in BENCHMARKS}
+        for size in benchmark_sizes():
+            with transaction.atomic():
+                dataset = Dataset(size)
+                cache.clear()
+                for benchmark in BENCHMARKS:
+                    results[benchmark.name][size] = measure(benchmark, dataset)
+                transaction.set_rollback(True)
+        output = os.environ.get('NORA_BENCHMARK_OUTPUT')
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump({
+                    'date': timezone.now().isoformat(),
+                    'results': results,
+                }, output_file, indent=2)
+        if os.environ.get('NORA_BENCHMARK_UPDATE'):
+            with open(BASELINES_PATH, 'w') as baselines_file:
+                json.dump({
+                    name: max(result['queries'] for result in by_size.values())
+                    for name, by_size in sorted(results.items())
+                }, baselines_file, indent=2, sort_keys=True)
+                baselines_file.write('\n')
+        with open(BASELINES_PATH) as baselines_file:
+            baselines = json.load(baselines_file)
+        failures = []
+        for name, by_size in results.items():
+            sizes = sorted(by_size)
+            queries = [by_size[size]['queries'] for size in sizes]
+            if any(by_size[size]['status'] >= 500 for size in sizes):
+                failures.append('%s: server error' % name)
+            if max(queries) > queries[0]:
+                failures.append('%s: queries grow with the data (%s)' % (
+                    name, ', '.join('%d orders: %d' % pair for pair in zip(sizes, queries))))
+            if name not in baselines:
+                failures.append('%s: no baseline' % name)
+            elif max(queries) > baselines[name]:
+                failures.append('%s: %d queries, over its baseline of %d' % (
+                    name, max(queries), baselines[name]))
+        self.assertFalse(failures, '\n'.join(failures))
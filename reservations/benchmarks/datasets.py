@@ -0,0 +1,91 @@
+import datetime
+import itertools
+from django.db.models import Count
+from django.utils import timezone
+from ..models import Menu, MenuItem, Order, OrderAggregate, User
+
+# Number of items of each menu of a dataset.
+DATASET_ITEMS = 3
+
+# Maximum number of users that place the orders of a dataset, every one of them orders from
+# every menu.
+DATASET_MAX_USERS = 1000
+
+
+class Dataset:
+    """
+    Synthetic data the views are benchmarked against: a chef, a client, past menus, today's
+    menu (open for orders) and the given number of orders, spread over as many menus as needed
+    so no user orders twice from a menu.
+
+    Attributes:
+
+    **orders**
+        Number of orders of the dataset.
+    **chef**
+        A chef user.
+    **admin**
+        A superuser.
+    **client**
+        A client user with orders from every past menu, but not from today's menu.
+    **menu**
+        Today's menu, with orders of other users.
+    **past_menu**
+        The menu served the day before.
+    """
+    def __init__(self, orders):
+        self.orders = orders
+        now = timezone.now()
+        today = timezone.localdate()
+        self.chef = User.objects.create(username='bench_chef', is_chef=True)
+        self.admin = User.objects.create(username='bench_admin', is_superuser=True)
+        self.client = User.objects.create(username='bench_client')
+        user_count = max(1, min(orders, DATASET_MAX_USERS))
+        User.objects.bulk_create(
+            [User(username='bench_user_%d' % idx) for idx in range(user_count - 1)])
+        others = list(
+            User.objects.filter(username__startswith='bench_user_').values_list('pk', flat=True))
+        past_count = max(1, -(-max(0, orders - len(others)) // user_count))
+        menus = [
+            Menu.objects.create(
+                menu_title='Menú %d' % idx,
+                service_date=today - datetime.timedelta(days=idx),
+                orders_open_at=now - datetime.timedelta(days=idx, hours=1),
+                orders_close_at=now - datetime.timedelta(days=idx) + datetime.timedelta(hours=1))
+            for idx in range(past_count + 1)
+        ]
+        MenuItem.objects.bulk_create([
+            MenuItem(menu=menu, item_text='Plato %d' % idx)
+            for menu in menus for idx in range(DATASET_ITEMS)
+        ])
+        items = {}
+        for item_id, menu_id in MenuItem.objects.order_by('pk').values_list('pk', 'menu_id'):
+            items.setdefault(menu_id, []).append(item_id)
+        # Today's menu is ordered from by the other users, leaving it for the client to order
+        slots = itertools.chain(
+            ((menus[0], user_id) for user_id in others),
+            ((menu, user_id) for menu in menus[1:] for user_id in [self.client.pk] + others))
+        rows = [
+            Order(
+                menu_id=menu.pk,
+                item_choice_id=items[menu.pk][idx % DATASET_ITEMS],
+                size=idx % 2,
+                user_id=user_id)
+            for idx, (menu, user_id) in enumerate(itertools.islice(slots, orders))
+        ]
+        Order.objects.bulk_create(rows)
+        OrderAggregate.objects.rebuild()
+        for item_id, count in (
+                Order.objects.order_by().values_list('item_choice_id')
+                .annotate(count=Count('pk'))):
+            MenuItem.objects.filter(pk=item_id).update(count=count)
+        self.menu = menus[0]
+        self.past_menu = menus[1]
+        self.new_clients = 0
+
+    def new_client(self):
+        """
+        Creates a client without any orders, for the views that place them.
+        """
+        self.new_clients += 1
+        return User.objects.create(username='bench_new_client_%d' % self.new_clients)
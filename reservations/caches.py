@@ -0,0 +1,169 @@
+import datetime
+import uuid
+from django.core.cache import cache
+from django.utils import timezone
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Menu, MenuItem
+from .utils import local_datetime, seconds_until
+
+# Time in seconds that the cached data of a menu (and its version) is kept. Since it's keyed by the
+# menu's version it never gets stale, this is only to let old versions go away.
+MENU_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def menu_version_key(menu_id):
+    return 'nora:menu-version:%s' % menu_id
+
+
+def menu_state_key(menu_id, version):
+    return 'nora:menu-state:%s:%s' % (menu_id, version)
+
+
+def menu_page_key(menu_id, version):
+    return 'nora:menu-page:%s:%s' % (menu_id, version)
+
+
+def todays_menu_key(day):
+    return 'nora:todays-menu:%s' % day.isoformat()
+
+
+def get_menu_version(menu_id):
+    """
+    Utility function that returns the current version stamp of a menu, every cached data of the
+    menu is keyed by it. If the menu has no version yet (or it expired or was evicted from the
+    cache) a new one is made, so nothing cached before can be used. Versions are kept as long as
+    the data cached with them, and the version of a menu that turns out not to exist is removed
+    (see load_menu_state), so unknown ids don't fill the cache.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    """
+    key = menu_version_key(menu_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, MENU_CACHE_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_menu_version(menu_id):
+    """
+    Utility function that gives a new version stamp to a menu, discarding everything cached about
+    it. Must be called whenever a menu or its items are changed.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    """
+    cache.set(menu_version_key(menu_id), uuid.uuid4().hex, MENU_CACHE_TIMEOUT)
+
+
+def load_menu_state(menu_id):
+    try:
+        menu = Menu.objects.get(pk=menu_id)
+    except Menu.DoesNotExist:
+        # Don't keep a version for a menu that doesn't exist
+        cache.delete(menu_version_key(menu_id))
+        raise
+    items = list(MenuItem.objects.filter(menu=menu).order_by('pk').values_list('pk', 'item_text'))
+    return {'menu': menu, 'items': items}
+
+
+def get_menu_state(menu_id):
+    """
+    Utility function that returns the cached state of a menu, that is, a dict with the Menu
+    object under 'menu' and a list of (id, item_text) pairs of its items under 'items'. If it
+    isn't in the cache it's loaded from the database, raising Menu.DoesNotExist if the menu
+    doesn't exist.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    """
+    key = menu_state_key(menu_id, get_menu_version(menu_id))
+    state = cache.get(key)
+    if state is None:
+        state = load_menu_state(menu_id)
+        cache.set(key, state, MENU_CACHE_TIMEOUT)
+    return state
+
+
+def get_menu_page(menu_id):
+    """
+    Utility function that returns the Menu object and the rendered part of the menu page that is
+    the same for every user (title, date and items), rendered once per version of the menu.
+    Raises Menu.DoesNotExist if the menu doesn't exist.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    """
+    version = get_menu_version(menu_id)
+    state_key = menu_state_key(menu_id, version)
+    page_key = menu_page_key(menu_id, version)
+    cached = cache.get_many([state_key, page_key])
+    state = cached.get(state_key)
+    if state is None:
+        state = load_menu_state(menu_id)
+        cache.set(state_key, state, MENU_CACHE_TIMEOUT)
+    html = cached.get(page_key)
+    if html is None:
+        html = render_to_string('reservations/menu_items.html', {
+            'menu': state['menu'],
+            'menu_items': [
+                MenuItem(pk=pk, menu_id=menu_id, item_text=text) for pk, text in state['items']
+            ]
+        })
+        cache.set(page_key, html, MENU_CACHE_TIMEOUT)
+    return state['menu'], mark_safe(html)
+
+
+def seconds_until_midnight():
+    """
+    Utility function that returns the number of seconds left until the next local midnight.
+    """
+    return seconds_until(
+        local_datetime(timezone.localdate() + datetime.timedelta(days=1), datetime.time()))
+
+
+def get_todays_menu():
+    """
+    Utility function that returns today's menu (see Menu.todays_menu), or None if it wasn't
+    published yet. Which menu is today's is cached under the local date (as given by the
+    TIME_ZONE setting), so it rolls over at midnight by itself, while the Menu object itself
+    comes from the menu's versioned state (see get_menu_state).
+    """
+    key = todays_menu_key(timezone.localdate())
+    menu_id = cache.get(key)
+    if menu_id is None:
+        menu = Menu.todays_menu.first()
+        # An empty string stands for "no menu yet", None is a cache miss
+        cache.set(key, menu.pk if menu else '', seconds_until_midnight())
+        return menu
+    if not menu_id:
+        return None
+    try:
+        return get_menu_state(menu_id)['menu']
+    except Menu.DoesNotExist:
+        cache.delete(key)
+        return None
+
+
+def forget_todays_menu(*days):
+    """
+    Utility function that discards which menu is cached as today's menu for the given days,
+    today if none is given. Must be called whenever a menu is published or deleted, or its
+    service date changes.
+
+    Arguments:
+
+    **days**
+        The service dates of the menus being changed.
+    """
+    cache.delete_many([todays_menu_key(day) for day in days or (timezone.localdate(),)])
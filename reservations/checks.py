@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from .events import get_event_bus_class
+
+# Cache backends whose entries are only seen by the process that stored them.
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def uses_local_cache():
+    """
+    Utility function that returns True if the default cache is private to each process (or
+    doesn't keep anything), so web processes and Celery workers can't share entries through it.
+    """
+    return settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches)
+def check_order_queue_cache(app_configs, **kwargs):
+    """
+    Check that a shared cache is used when orders are queued: the claims of the users on the
+    menus, the status of the queued orders and the scheduled drain of the queue are kept in the
+    cache, and must be seen by every web process and by the Celery worker.
+    """
+    if settings.NORA_ORDER_INTAKE == 'queue' and uses_local_cache():
+        return [Error(
+            "NORA_ORDER_INTAKE = 'queue' needs a cache shared by every process.",
+            hint="Set CACHES['default'] to a shared backend, e.g. memcached or the database "
+                 "cache.",
+            id='reservations.E001',
+        )]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def check_menu_cache(app_configs, **kwargs):
+    """
+    Check that a shared cache is used in production: the version of each menu is kept in the
+    cache (see caches.get_menu_version), and with a cache private to each process a menu edit
+    only reaches the process that saved it, the others keep showing the old menu.
+    """
+    if uses_local_cache():
+        return [Warning(
+            'Menu edits are only seen by the process that saves them with a cache private to '
+            'each process.',
+            hint="Set CACHES['default'] to a shared backend, e.g. memcached or the database "
+                 "cache, when running more than one process.",
+            id='reservations.W001',
+        )]
+    return []
+
+
+@register()
+def check_order_queue_event_bus(app_configs, **kwargs):
+    """
+    Check that the event bus reaches every process when orders are queued: the orders are saved
+    by the Celery worker, and with an event bus private to each process the chefs listening in
+    the web processes never hear of them.
+    """
+    if settings.NORA_ORDER_INTAKE == 'queue' and not get_event_bus_class().shared:
+        return [Warning(
+            "Orders saved from the queue (NORA_ORDER_INTAKE = 'queue') are not pushed to the "
+            "chefs with an event bus private to each process.",
+            hint="Set NORA_EVENT_BUS to 'reservations.events.KombuEventBus', or to None.",
+            id='reservations.W002',
+        )]
+    return []
+
+
+@register(deploy=True)
+def check_event_bus(app_configs, **kwargs):
+    """
+    Check that the event bus reaches every process in production: with an event bus private to
+    each process, the orders placed through a process are only pushed to the chefs listening in
+    that same process.
+    """
+    if not get_event_bus_class().shared:
+        return [Warning(
+            'Order changes are only pushed to the chefs listening in the process that saves them '
+            'with an event bus private to each process.',
+            hint="Set NORA_EVENT_BUS to 'reservations.events.KombuEventBus' when running more "
+                 "than one process.",
+            id='reservations.W003',
+        )]
+    return []
@@ -1,22 +1,72 @@
+import datetime
+from django.conf import settings
+from django.db.models import Count, Max
 from django.views.generic import ListView
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from ..models import Menu
+from ..pagination import CursorPaginator
+from ..caches import get_todays_menu, seconds_until_midnight
+from ..decorators import conditional_page
+from ..utils import local_datetime
 
 
+def home_watermark(request):
+    """
+    Returns the ETag and the last modification time of the home page as seen by the user, see
+    decorators.conditional_page. They depend on the day, the user and on the number of menus and
+    the last time any of them was modified, taken with a single query.
+    """
+    today = timezone.localdate()
+    menus = Menu.objects.aggregate(last=Max('modified'), count=Count('pk'))
+    user = request.user
+    etag = 'home-%s-%s-%s-%s' % (
+        today.isoformat(), '%s-%d' % (user.pk, user.is_chef) if user.is_authenticated else '',
+        menus['count'], menus['last'] and menus['last'].timestamp())
+    midnight = local_datetime(today, datetime.time())
+    return etag, max(menus['last'], midnight) if menus['last'] else midnight
+
+
+def home_public_max_age(request):
+    """
+    Anonymous home pages are kept by shared caches until midnight at most, when the menu of the
+    day changes.
+    """
+    return min(settings.NORA_PUBLIC_CACHE_MAX_AGE, seconds_until_midnight())
+
+
+@method_decorator(
+    conditional_page(home_watermark, public_max_age=home_public_max_age), name='dispatch')
 class HomeView(ListView):
     """
     Simple ListView that uses the home template, the template itself differentiates
     the content based on whether or not the user is authenticated and/or a chef.
+    Previous menus are paginated by cursor (see CursorPaginator), the template gets the cursors
+    of the pages next to the current one. Unchanged pages are answered with a 304 (see
+    home_watermark).
     """
     model = Menu
     template_name = 'reservations/home.html'
     context_object_name = 'menus'
     paginate_by = 10
-    today_date = timezone.localdate()
-    queryset = Menu.objects.filter(created__date__lt=today_date)
+
+    def get_queryset(self):
+        """
+        Returns the menus served before today, the date is taken on every request.
+        """
+        return Menu.objects.filter(service_date__lt=timezone.localdate())
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates the menus by service date (which is unique) by cursor, taking the cursor from
+        the 'cursor' GET parameter.
+        """
+        paginator = CursorPaginator(queryset, page_size, fields=('service_date',))
+        page = paginator.page(self.request.GET.get('cursor'))
+        return (paginator, page, page.object_list, page.has_other_pages())
 
     def get_context_data(self, **kwargs):
         context = super(HomeView, self).get_context_data(**kwargs)
-        today_menu = Menu.todays_menu.all()
-        context['today_menu'] = today_menu
+        today_menu = get_todays_menu()
+        context['today_menu'] = [today_menu] if today_menu else []
         return context
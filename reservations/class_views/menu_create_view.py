@@ -1,11 +1,15 @@
+from django.db import transaction, IntegrityError
 from django.shortcuts import redirect
 from django.views.generic import CreateView
 from django.utils.decorators import method_decorator
 from django.contrib import messages
+from django.utils import timezone
 from ..forms import MenuForm, MenuItemFormSet
 from ..decorators import chef_required, login_required_message
-from ..models import Menu, MenuItem, User
-from ..utils import send_notification_mails, send_slack_message
+from ..models import Menu, MenuItem
+from ..tasks import queue_menu_publication
+from ..caches import get_menu_page, get_todays_menu, forget_todays_menu
+from ..forecasting import forecast_demand
 
 
 @method_decorator(
@@ -23,7 +27,7 @@ class MenuCreateView(CreateView):
         """
         Called on GET request of this view, shows an empty form to be filled
         """
-        if Menu.todays_menu.all():
+        if get_todays_menu():
             messages.error(request, '¡Ya se publicó el menú de hoy, no puede crear otro!')
             return redirect('home')
         self.object = None
@@ -40,11 +44,9 @@ class MenuCreateView(CreateView):
     def post(self, request, *args, **kwargs):
         """
         called on POST request of this view, takes data from the form, validates it and
-        sends an appropiate response (save and redirect or errors)
+        sends an appropiate response (save and redirect or errors). Publishing a second menu for
+        today is rejected by the database (see Menu.service_date), not checked beforehand.
         """
-        if Menu.todays_menu.all():
-            messages.error(request, '¡Ya se publicó el menú de hoy, no puede crear otro!')
-            return redirect('home')
         self.object = None
         form_class = self.get_form_class()
         form = self.get_form(form_class)
@@ -57,26 +59,50 @@ class MenuCreateView(CreateView):
     def form_valid(self, form, menu_item_form):
         """
         Method called upon a succesful validation of both the menu forms and the menu item forms,
-        adds the menu and the menuitems to the database and redirects to home with a success
-        message.
+        adds the menu and the menuitems (with a single insert) to the database in a single
+        transaction and redirects to home with a success message, or with an error message if
+        today's menu was already published. Once the menu is committed its page is rendered
+        ahead of the first visit and, if the chef asked for notifications by mail and/or Slack,
+        they are left to the publish_menu task (see tasks.queue_menu_publication).
         """
-        self.object = form.save()
-        for item_form in menu_item_form:
-            new_menu_item = MenuItem(
-                menu=self.object,
-                item_text=item_form.cleaned_data['item_text'],
-                count=0)
-            new_menu_item.save()
-        # Notify via Mail
-        if('notify_mail' in self.request.POST and self.request.POST['notify_mail'] == 'on'):
-            users_to_mail = User.objects.all()
-            send_notification_mails(users_to_mail, self.object, self.request)
-        # Notify via Slack
-        if('notify_slack' in self.request.POST and self.request.POST['notify_slack'] == 'on'):
-            send_slack_message(self.request, self.object)
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                MenuItem.objects.bulk_create_for_menu(
+                    self.object,
+                    [item_form.cleaned_data['item_text'] for item_form in menu_item_form])
+                steps = []
+                # Notify via Mail
+                if('notify_mail' in self.request.POST and self.request.POST['notify_mail'] == 'on'):
+                    steps.append('notify_mail')
+                # Notify via Slack
+                if('notify_slack' in self.request.POST and
+                        self.request.POST['notify_slack'] == 'on'):
+                    steps.append('notify_slack')
+                menu_id = str(self.object.pk)
+                service_date = self.object.service_date
+                transaction.on_commit(lambda: forget_todays_menu(service_date))
+                # Renders the menu page ahead of the first visit
+                transaction.on_commit(lambda: get_menu_page(menu_id))
+                if steps:
+                    transaction.on_commit(lambda: queue_menu_publication(menu_id, steps))
+        except IntegrityError:
+            # Today's menu was already published
+            self.object = None
+            messages.error(self.request, '¡Ya se publicó el menú de hoy, no puede crear otro!')
+            return redirect('home')
         messages.success(self.request, "Menú añadido exitosamente!")
         return redirect(self.get_success_url())
 
+    def get_context_data(self, **kwargs):
+        """
+        Adds the expected demand of the dishes most ordered on today's weekday, to help choosing
+        the dishes of the new menu (see forecasting.forecast_demand).
+        """
+        context = super().get_context_data(**kwargs)
+        context['demand_forecast'] = forecast_demand([], timezone.localdate())
+        return context
+
     def form_invalid(self, form, menu_item_form):
         """
         Method called upon an unsuccesful validation of any of the menu or menu item forms,
@@ -1,12 +1,19 @@
+import logging
 from django.shortcuts import redirect
+from django.db import transaction
 from django.views.generic import UpdateView
 from django.utils.decorators import method_decorator
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponseServerError
-from ..forms import MenuForm, MenuItemFormSet
+from ..forms import MenuForm, MenuItemEditFormSet
 from ..decorators import chef_required, login_required_message
 from ..models import Menu, MenuItem
+from ..caches import bump_menu_version, get_menu_state
+from ..forecasting import forecast_demand
+from ..events import publish_menu_reset
+
+logger = logging.getLogger(__name__)
 
 
 @method_decorator(
@@ -27,7 +34,11 @@ class MenuEditView(UpdateView):
         self.object = get_object_or_404(Menu, pk=self.kwargs['unique_id'])
         form_class = self.get_form_class()
         form = self.get_form(form_class)
-        menu_item_form = MenuItemFormSet(queryset=MenuItem.objects.filter(menu__exact=self.object))
+        menu_item_form = MenuItemEditFormSet(initial=[
+            {'id': pk, 'item_text': text}
+            for pk, text in MenuItem.objects.filter(menu__exact=self.object)
+            .order_by('pk').values_list('pk', 'item_text')
+        ])
         return self.render_to_response(
             self.get_context_data(
                 form=form,
@@ -43,47 +54,52 @@ class MenuEditView(UpdateView):
         self.object = None
         try:
             old_menu = Menu.objects.get(pk=self.kwargs['unique_id'])
-            old_menu_items = MenuItem.objects.filter(menu__exact=old_menu)
             form_class = self.get_form_class()
             form = self.get_form(form_class)
-            menu_item_form = MenuItemFormSet(self.request.POST)
+            menu_item_form = MenuItemEditFormSet(self.request.POST)
             if(form.is_valid() and menu_item_form.is_valid()):
-                return self.form_valid(form, menu_item_form, old_menu, old_menu_items)
+                return self.form_valid(form, menu_item_form, old_menu)
             else:
                 return self.form_invalid(form, menu_item_form)
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception('Could not update the menu %s', self.kwargs['unique_id'])
             return HttpResponseServerError('Ocurrió un error al tratar de actualizar menú!')
 
-    def form_valid(self, form, menu_item_form, old_menu, old_menu_items):
+    def form_valid(self, form, menu_item_form, old_menu):
         """
         Method called upon a succesful validation of both the menu forms and the menu item forms,
-        Updates the menu and menuitems with information of the form. Updating the menu's title,
-        and editing, deleting or adding menu items.
+        Updates the menu and menuitems with information of the form in a single transaction.
+        Updating the menu's title, and editing, deleting or adding menu items, matched by their
+        id (see MenuItemManager.sync_for_menu).
         DO NOTICE: That if a menu's items are deleted then so will be their corresponding orders!
         """
-        # Update title
         self.object = form.save(commit=False)
         old_menu.menu_title = self.object.menu_title
-        old_menu.save()
-        # Update item text for existing entries, create new ones
-        for idx in range(len(menu_item_form)):
-            if idx < len(old_menu_items):
-                old_item = old_menu_items[idx]
-                old_item.item_text = menu_item_form[idx].cleaned_data['item_text']
-                old_item.save()
-            else:
-                new_menu_item = MenuItem(
-                    menu=old_menu,
-                    item_text=menu_item_form[idx].cleaned_data['item_text'],
-                    count=0)
-                new_menu_item.save()
-        # Delete excess old entries (When editing deletes entries.)
-        for idx in range(len(menu_item_form), len(old_menu_items)):
-            old_menu_items[idx].delete()
+        items = [
+            (item_form.cleaned_data['id'], item_form.cleaned_data['item_text'])
+            for item_form in menu_item_form.forms
+            if item_form.cleaned_data and item_form not in menu_item_form.deleted_forms
+        ]
+        with transaction.atomic():
+            old_menu.save(update_fields=['menu_title', 'modified'])
+            MenuItem.objects.sync_for_menu(old_menu, items)
+            menu_id = old_menu.pk
+            transaction.on_commit(lambda: publish_menu_reset(menu_id))
+        bump_menu_version(old_menu.pk)
         messages.success(self.request, "Menú actualizado exitosamente!")
         return redirect(self.get_success_url())
 
+    def get_context_data(self, **kwargs):
+        """
+        Adds the expected demand of the current dishes of the menu on its service date (see
+        forecasting.forecast_demand).
+        """
+        context = super().get_context_data(**kwargs)
+        menu_state = get_menu_state(self.kwargs['unique_id'])
+        context['demand_forecast'] = forecast_demand(
+            [text for _, text in menu_state['items']], menu_state['menu'].service_date)
+        return context
+
     def form_invalid(self, form, menu_item_form):
         """
         Method called upon an unsuccesful validation of any of the menu or menu item forms,
@@ -1,11 +1,16 @@
+from django.conf import settings
 from django.utils.decorators import method_decorator
 from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.html import format_html
 from django.contrib import messages
 from django.views.generic import CreateView
-from ..models import Menu, MenuItem, Order
+from ..models import ItemNotFound, Menu, Order, OrderAlreadyFound, OutOfDateError
 from ..forms import OrderForm
 from ..decorators import login_required_message, client_required
-from ..utils import still_in_ordering_time
+from ..caches import bump_menu_version, get_menu_state
+from ..intake import enqueue_order
+from ..tasks import schedule_order_queue_drain
 
 @method_decorator(
     [
@@ -24,18 +29,9 @@ class OrderCreateView(CreateView):
     success_url = 'home'
     form_class = OrderForm
 
-    class OrderAlreadyFound(Exception):
-        """
-        Exception that indicates that a given user already has an order associated with a menu.
-        """
-        pass
-
-    class OutOfDateError(Exception):
-        """
-        Exception that indicated that an order is trying to be issued on a menu that is out of date
-        to do so.
-        """
-        pass
+    # Kept here so they can still be referenced through the view.
+    OrderAlreadyFound = OrderAlreadyFound
+    OutOfDateError = OutOfDateError
 
     def check_no_order_or_fail(self, user, menu):
         """
@@ -50,38 +46,39 @@ class OrderCreateView(CreateView):
         **menu**
             Menu to look for any previous orders from the given user.
         """
-        prev_orders = Order.objects.filter(user=user, item_choice__menu=menu)
-        if prev_orders:
+        if Order.objects.filter(user=user, menu=menu).exists():
             raise OrderCreateView.OrderAlreadyFound
         return True
 
     def check_proper_time_or_fail(self, menu):
         """
-        Method that checks that it is still a proper time to order the menu, that is, the menu
-        was published today and it is before the previously set ordering time (default: before
-        11 AM CLT). If it all checks, return True, otherwise raises an OutOfDateError.
+        Method that checks that it is still a proper time to order the menu, that is, now is
+        within the ordering window of the menu (by default, the day of the menu before 11 AM CLT).
+        If it all checks, return True, otherwise raises an OutOfDateError.
 
         Attributes:
 
         **menu**
             Menu which will be checked for date.
         """
-        if not menu.published_today() or not still_in_ordering_time():
+        if not menu.is_open():
             raise OrderCreateView.OutOfDateError
         return True
 
     def get(self, request, *args, **kwargs):
         """
-        Called on GET request of this view, shows an empty form to be filled
+        Called on GET request of this view, shows an empty form to be filled, the menu and its
+        items are taken from the cache (see caches.get_menu_state).
         """
         try:
-            cur_menu = Menu.objects.get(pk=self.kwargs['unique_id'])
+            menu_state = get_menu_state(self.kwargs['unique_id'])
+            cur_menu = menu_state['menu']
             self.check_no_order_or_fail(self.request.user, cur_menu)
             self.check_proper_time_or_fail(cur_menu)
             self.object = None
             form_class = self.get_form_class()
             form = self.get_form(form_class)
-            form.fields['item_choice'].queryset = MenuItem.objects.filter(menu__exact=cur_menu)
+            form.use_menu_items(cur_menu, menu_state['items'])
             return self.render_to_response(
                 self.get_context_data(
                     form=form,
@@ -101,19 +98,22 @@ class OrderCreateView(CreateView):
     def post(self, request, *args, **kwargs):
         """
         called on POST request of this view, takes data from the form, validates it and
-        sends an appropiate response (save and redirect or errors)
+        sends an appropiate response (place the order and redirect or errors).
+        The item choice is only valid if it belongs to this menu, which is checked against the
+        cached items of the menu, and the cached menu is then used by the atomic ordering path
+        to check for the ordering time.
         """
         try:
-            cur_menu = Menu.objects.get(pk=self.kwargs['unique_id'])
-            self.check_no_order_or_fail(self.request.user, cur_menu)
-            self.check_proper_time_or_fail(cur_menu)
             self.object = None
             form_class = self.get_form_class()
             form = self.get_form(form_class)
-            if(form.is_valid() and self.item_choice_valid(form, cur_menu)):
+            if settings.NORA_ORDER_INTAKE == 'queue':
+                return self.queue_order(form)
+            menu_state = get_menu_state(self.kwargs['unique_id'])
+            form.use_menu_items(menu_state['menu'], menu_state['items'])
+            if form.is_valid():
                 return self.form_valid(form)
-            else:
-                return self.form_invalid(form)
+            return self.form_invalid(form)
         except Menu.DoesNotExist:
             messages.error(self.request, 'El menú al que trató de acceder no existe!')
             return redirect('home')
@@ -124,28 +124,51 @@ class OrderCreateView(CreateView):
             messages.error(self.request, 'Ya pasó el tiempo para ordernar de este menú')
             return redirect('home')
 
-    def item_choice_valid(self, form, cur_menu):
+    def queue_order(self, form):
         """
-        Method used to verify that an order's item choice is indeed associated with the given menu.
+        Method used instead of the regular ordering path when the NORA_ORDER_INTAKE setting is
+        'queue'. The form is validated against the cached state of the menu and the order is put
+        on the order queue, to be saved shortly after by a Celery worker. The user is redirected
+        right away, with a success message linking to the status of the order (see
+        views.order_status), which tells whether it was finally accepted or rejected.
 
         Arguments:
 
         **form**
-            Form that will be used to build the Order object
-        **cur_menu**
-            Menu that will be checked against the Order object's MenuItem.
-        """
-        cur_order = form.save(commit=False)
-        valid_choices = MenuItem.objects.filter(menu__exact=cur_menu)
-        return cur_order.item_choice in valid_choices
+            Order form built from the request.
+        """
+        menu_state = get_menu_state(self.kwargs['unique_id'])
+        form.use_menu_items(menu_state['menu'], menu_state['items'])
+        if not form.is_valid():
+            return self.form_invalid(form)
+        ticket = enqueue_order(
+            self.request.user,
+            menu_state['menu'],
+            form.cleaned_data['item_choice'],
+            form.cleaned_data['size'],
+            form.cleaned_data['comments'])
+        schedule_order_queue_drain()
+        messages.success(self.request, format_html(
+            'Orden recibida exitosamente, será procesada en breve! Puede revisar su estado '
+            '<a href="{}">aquí</a>.', reverse('order_status', kwargs={'ticket': ticket})))
+        return redirect(self.success_url)
 
     def form_valid(self, form):
         """
         Method called upon a succesful validation of the order form and item choice validation,
         created the order and associates it to the user, giving feedback that the order was
         correctly added and redirecting them. It also adds one to the count for this order.
+        Everything is done in a single transaction, see OrderManager.place. If the chosen item
+        was deleted in the meantime the form is shown again with the up to date items.
         """
-        self.object = form.save_with_user_and_add_to_count(self.request.user)
+        try:
+            self.object = form.place_with_user(self.request.user)
+        except ItemNotFound:
+            # The cached items of the menu are out of date, they are loaded again
+            bump_menu_version(self.kwargs['unique_id'])
+            menu_state = get_menu_state(self.kwargs['unique_id'])
+            form.reject_item_choice(menu_state['menu'], menu_state['items'])
+            return self.form_invalid(form)
         messages.success(self.request, "Orden añadida exitosamente!")
         return redirect(self.get_success_url())
 
@@ -3,7 +3,10 @@ from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from django.shortcuts import resolve_url
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag)
 from django.utils.decorators import available_attrs
+from django.utils.http import http_date
 from functools import wraps
 from urllib.parse import urlparse
 
@@ -89,3 +92,49 @@ def client_required(function=None,message=default_message, redirect_field_name=R
     if function:
         return actual_decorator(function)
     return actual_decorator
+
+
+def conditional_page(watermark_func, public_max_age=None):
+    """
+    Decorator for page views that answers GET requests with a 304 when the page didn't change
+    since the client got it, before the view (and its template) runs. The ETag and the last
+    modification time of the page are given by watermark_func, called with the same arguments
+    as the view, which returns them as a pair or None if the view must run anyway (e.g: the
+    user can't see the page). The ETag is what decides, the last modification time is only
+    used by clients that don't send it back.
+    Pages for anonymous users can be kept by shared caches (e.g: a reverse proxy) for
+    public_max_age seconds (also a function of the request, or None to keep them private), pages
+    for logged in users are private and revalidated on every use. Requests with pending messages
+    always get the whole page, without validators, so the messages are shown.
+    """
+    def decorator(view_func):
+        @wraps(view_func, assigned=available_attrs(view_func))
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)):
+                response = view_func(request, *args, **kwargs)
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+            watermark = watermark_func(request, *args, **kwargs)
+            if watermark is None:
+                response = None
+            else:
+                etag, last_modified = quote_etag(watermark[0]), watermark[1]
+                response = get_conditional_response(
+                    request, etag=etag,
+                    last_modified=last_modified and int(last_modified.timestamp()))
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                if watermark is not None and response.status_code == 200:
+                    response.setdefault('ETag', etag)
+                    if last_modified:
+                        response.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+            max_age = public_max_age and public_max_age(request)
+            if (max_age is not None and not request.user.is_authenticated and
+                    response.status_code in (200, 304)):
+                patch_cache_control(response, public=True, max_age=max_age)
+            else:
+                patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return _wrapped_view
+    return decorator
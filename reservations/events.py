@@ -0,0 +1,275 @@
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.utils.module_loading import import_string
+from kombu import Connection, Exchange, Queue
+from kombu.exceptions import OperationalError
+from kombu.pools import connections
+
+# Maximum number of events waiting to be sent to a single subscriber, once it's full the
+# subscriber is told to start over instead.
+SUBSCRIPTION_MAX_EVENTS = 1000
+
+# Seconds between keep-alive comments on an idle event stream.
+STREAM_HEARTBEAT = 15
+
+# Milliseconds that browsers wait before reconnecting to a closed event stream.
+STREAM_RETRY = 2000
+
+# Name of the fanout exchange through which a KombuEventBus reaches every process.
+EVENT_EXCHANGE_NAME = 'nora.events'
+
+# Seconds a KombuEventBus waits for the broker: before giving up on publishing an event, between
+# attempts to listen again, and for its listener to be ready before subscribing anyway.
+EVENT_BROKER_TIMEOUT = 2
+
+_event_buses = {}
+_event_bus_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Subscription of a single listener to a channel of an InMemoryEventBus, events are taken from
+    it in the order they were published with get.
+
+    Attributes:
+
+    **channel**
+        Name of the channel subscribed to.
+    **overflowed**
+        True if events were lost because the listener didn't keep up with them.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.overflowed = False
+        self.events = queue.Queue(SUBSCRIPTION_MAX_EVENTS)
+
+    def put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        Returns the next event, waiting up to timeout seconds for it. Raises queue.Empty if no
+        event was published in the meantime.
+        """
+        return self.events.get(timeout=timeout)
+
+
+class InMemoryEventBus:
+    """
+    Event bus that hands the events published on a channel to the subscribers of the channel
+    within the same process, e.g: the threads of the development server. Events are dicts with
+    the type of the event under 'type' and its data under 'data'.
+
+    Attributes:
+
+    **shared**
+        True if the events published by a process reach the subscribers of every process.
+    """
+    shared = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel)
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+class KombuEventBus(InMemoryEventBus):
+    """
+    Event bus that hands the events published on a channel to the subscribers of the channel in
+    every process, e.g: the orders saved by a Celery worker to the chefs listening in the web
+    processes. Events go through a fanout exchange on the broker given by the NORA_EVENT_BUS_URL
+    setting, and each process that has subscribers listens to it from a thread of its own (with
+    a queue that is deleted when the process goes away) to hand them over like an
+    InMemoryEventBus. Events published while the broker is down are lost, listeners get them
+    when they load the counts again.
+    """
+    shared = True
+
+    def __init__(self):
+        super(KombuEventBus, self).__init__()
+        self.url = settings.NORA_EVENT_BUS_URL or settings.NORA_ORDER_QUEUE_URL
+        self.exchange = Exchange(EVENT_EXCHANGE_NAME, type='fanout', durable=False)
+        self.listener = None
+        self.listening = threading.Event()
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self.listen, name='nora-event-listener', daemon=True)
+                self.listener.start()
+        self.listening.wait(EVENT_BROKER_TIMEOUT)
+        return super(KombuEventBus, self).subscribe(channel)
+
+    def publish(self, channel, event):
+        try:
+            with connections[Connection(self.url)].acquire(block=True) as conn:
+                conn.ensure_connection(max_retries=1, interval_start=0)
+                conn.Producer().publish(
+                    {'channel': channel, 'event': event}, exchange=self.exchange,
+                    declare=[self.exchange], serializer='json', retry=False)
+        except (OperationalError, OSError):
+            logger.exception('Could not publish an event on %s', channel)
+
+    def deliver(self, body, message):
+        message.ack()
+        super(KombuEventBus, self).publish(body['channel'], body['event'])
+
+    def listen(self):
+        """
+        Hands the events of the exchange to the subscribers of this process, for as long as the
+        process runs, connecting again whenever the broker goes away.
+        """
+        events = Queue(
+            '%s.%s' % (EVENT_EXCHANGE_NAME, uuid.uuid4().hex), exchange=self.exchange,
+            durable=False, exclusive=True, auto_delete=True)
+        while True:
+            try:
+                with Connection(self.url) as conn:
+                    with conn.Consumer(events, callbacks=[self.deliver], accept=['json']):
+                        self.listening.set()
+                        while True:
+                            try:
+                                conn.drain_events(timeout=EVENT_BROKER_TIMEOUT)
+                            except socket.timeout:
+                                pass
+            except (OperationalError, OSError):
+                self.listening.clear()
+                logger.exception('Lost the connection to the event exchange')
+                time.sleep(EVENT_BROKER_TIMEOUT)
+
+
+def get_event_bus_class():
+    """
+    Utility function that returns the class of the event bus, the one given by the
+    NORA_EVENT_BUS setting or, if it's None, KombuEventBus when orders are saved by a Celery
+    worker (NORA_ORDER_INTAKE = 'queue') and InMemoryEventBus otherwise.
+    """
+    if settings.NORA_EVENT_BUS:
+        return import_string(settings.NORA_EVENT_BUS)
+    if settings.NORA_ORDER_INTAKE == 'queue':
+        return KombuEventBus
+    return InMemoryEventBus
+
+
+def get_event_bus():
+    """
+    Utility function that returns the event bus of this process, an instance of the class given
+    by get_event_bus_class.
+    """
+    bus_class = get_event_bus_class()
+    with _event_bus_lock:
+        if bus_class not in _event_buses:
+            _event_buses[bus_class] = bus_class()
+        return _event_buses[bus_class]
+
+
+def menu_channel(menu_id):
+    return 'menu:%s' % menu_id
+
+
+def publish_order_changes(menu_id, changes):
+    """
+    Utility function that lets the listeners of a menu know that orders were added to it. Should
+    be called once the orders are committed (see transaction.on_commit).
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu the orders belong to.
+    **changes**
+        List of (item id, size, amount) tuples with the number of new orders of each item and
+        size.
+    """
+    get_event_bus().publish(menu_channel(menu_id), {
+        'type': 'orders',
+        'data': [
+            {'item': item_id, 'size': size, 'amount': amount}
+            for item_id, size, amount in changes
+        ],
+    })
+
+
+def publish_menu_reset(menu_id):
+    """
+    Utility function that lets the listeners of a menu know that its counts must be loaded
+    again, e.g: because some of its items were deleted.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    """
+    get_event_bus().publish(menu_channel(menu_id), {'type': 'reset', 'data': None})
+
+
+def format_event(event):
+    return 'event: %s\ndata: %s\n\n' % (event['type'], json.dumps(event['data']))
+
+
+def order_event_stream(menu_id, timeout):
+    """
+    Generator of the Server-Sent Events about the orders of a menu, as published by
+    publish_order_changes and publish_menu_reset, sending keep-alive comments while idle. The
+    stream ends after timeout seconds (browsers reconnect by themselves), or right after a reset
+    event, and stops listening when it's closed.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu.
+    **timeout**
+        Seconds the stream lasts.
+    """
+    bus = get_event_bus()
+    subscription = bus.subscribe(menu_channel(menu_id))
+    try:
+        yield 'retry: %d\n\n' % STREAM_RETRY
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = subscription.get(min(STREAM_HEARTBEAT, remaining))
+            except queue.Empty:
+                event = None
+            if subscription.overflowed:
+                event = {'type': 'reset', 'data': None}
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(event)
+            if event['type'] == 'reset':
+                return
+    finally:
+        bus.unsubscribe(subscription)
@@ -0,0 +1,193 @@
+import datetime
+import numpy as np
+from django.core.cache import cache
+from django.db.models.functions import ExtractWeekDay
+from django.utils import timezone
+from .models import Menu, MenuItem, Order, OrderAggregate
+from .utils import default_ordering_window, seconds_until
+
+DEMAND_MODEL_KEY = 'nora:demand-model'
+
+# Number of dishes shown when no dishes are given to forecast_demand.
+TOP_DISHES = 10
+
+
+def dish_key(item_text):
+    """
+    Utility function that returns the name under which the orders of a menu item are grouped
+    with the ones of the same dish in other menus: its text in lowercase, with single spaces.
+    """
+    return ' '.join(item_text.lower().split())
+
+
+class DemandModel:
+    """
+    Expected number of orders of each dish by weekday and size, estimated from the orders of
+    every closed menu. The estimate of a dish on a weekday is its mean number of orders on the
+    menus of that weekday it was offered in, or on every menu it was offered in if it was never
+    offered on that weekday.
+
+    Attributes:
+
+    **dishes**
+        Dict with the index of each dish (see dish_key) in the estimates.
+    **names**
+        List with the text each dish was last offered as, by index.
+    **estimates**
+        Array of shape (dishes, 7, sizes) with the expected number of orders of each dish, by
+        weekday (Monday being 0) and size (in the order of Order.MEAL_SIZES).
+    """
+    def __init__(self, dishes, names, estimates):
+        self.dishes = dishes
+        self.names = names
+        self.estimates = estimates
+
+    @classmethod
+    def build(cls, offers, orders):
+        """
+        Builds the model from the whole history at once, with array operations over all the
+        offers and orders instead of going through them menu by menu.
+
+        Arguments:
+
+        **offers**
+            List of (weekday, item text) pairs, one for each menu item that was offered,
+            oldest first.
+        **orders**
+            List of (weekday, item text, size, count) tuples with the number of orders of each
+            menu item and size.
+        """
+        sizes = np.array([size for size, _ in Order.MEAL_SIZES])
+        if not offers:
+            return cls({}, [], np.zeros((0, 7, len(sizes))))
+        offer_weekday, offer_text = (np.array(column) for column in zip(*offers))
+        order_weekday, order_text, order_size, order_count = (
+            (np.array(column) for column in zip(*orders)) if orders else
+            (np.zeros(0, dtype=int), np.zeros(0, dtype=str), np.zeros(0, dtype=int),
+             np.zeros(0)))
+        normalize = np.vectorize(dish_key, otypes=[str])
+        keys, dish_idx = np.unique(
+            np.concatenate([normalize(offer_text), normalize(order_text)]), return_inverse=True)
+        offer_dish, order_dish = dish_idx[:len(offers)], dish_idx[len(offers):]
+        size_order = np.argsort(sizes)
+        order_size = size_order[np.searchsorted(sizes, order_size, sorter=size_order)]
+
+        offered = np.zeros((len(keys), 7))
+        np.add.at(offered, (offer_dish, offer_weekday.astype(int)), 1)
+        ordered = np.zeros((len(keys), 7, len(sizes)))
+        np.add.at(ordered, (order_dish, order_weekday.astype(int), order_size), order_count)
+
+        by_weekday = np.divide(
+            ordered, offered[:, :, None],
+            out=np.zeros_like(ordered), where=offered[:, :, None] > 0)
+        total_offered = offered.sum(axis=1)
+        overall = np.divide(
+            ordered.sum(axis=1), total_offered[:, None],
+            out=np.zeros((len(keys), len(sizes))), where=total_offered[:, None] > 0)
+        estimates = np.where(offered[:, :, None] > 0, by_weekday, overall[:, None, :])
+
+        # Text of the last offer of each dish
+        _, last_from_end = np.unique(offer_dish[::-1], return_index=True)
+        names = offer_text[len(offers) - 1 - last_from_end].tolist()
+        return cls({key: idx for idx, key in enumerate(keys)}, names, estimates)
+
+    def forecast(self, item_text, weekday):
+        """
+        Returns the expected number of orders of a dish on the given weekday as a list with one
+        number per size (in the order of Order.MEAL_SIZES), or None if the dish was never offered.
+        """
+        idx = self.dishes.get(dish_key(item_text))
+        if idx is None:
+            return None
+        return self.estimates[idx, weekday].tolist()
+
+    def top_dishes(self, weekday, count):
+        """
+        Returns the text of the given number of dishes with the highest expected demand on the
+        given weekday, highest first.
+        """
+        totals = self.estimates[:, weekday].sum(axis=1)
+        return [self.names[idx] for idx in np.argsort(-totals, kind='stable')[:count]]
+
+
+def load_demand_model():
+    """
+    Utility function that builds the demand model from the orders of the menus that are already
+    closed, reading the order aggregates (see OrderAggregate) with two queries.
+    """
+    closed = {'menu__orders_close_at__lte': timezone.now()}
+    # The database counts weekdays from Sunday (1) to Saturday (7)
+    offers = list(
+        MenuItem.objects.filter(**closed).order_by('menu__service_date', 'pk')
+        .annotate(weekday=(ExtractWeekDay('menu__service_date') + 5) % 7)
+        .values_list('weekday', 'item_text'))
+    orders = list(
+        OrderAggregate.objects.filter(**closed).order_by()
+        .annotate(weekday=(ExtractWeekDay('menu__service_date') + 5) % 7)
+        .values_list('weekday', 'item__item_text', 'size', 'count'))
+    return DemandModel.build(offers, orders)
+
+
+def next_close():
+    """
+    Utility function that returns the next time a menu closes: the closing time of the open (or
+    upcoming) menu that closes first, or the default closing time of the next service date if
+    there's none.
+    """
+    now = timezone.now()
+    close_at = (
+        Menu.objects.filter(orders_close_at__gt=now).order_by('orders_close_at')
+        .values_list('orders_close_at', flat=True).first())
+    if close_at is None:
+        close_at = default_ordering_window(timezone.localdate())[1]
+        if close_at <= now:
+            close_at = default_ordering_window(
+                timezone.localdate() + datetime.timedelta(days=1))[1]
+    return close_at
+
+
+def get_demand_model():
+    """
+    Utility function that returns the cached demand model. The model only changes when a menu
+    closes, so it's kept until the next one does.
+    """
+    model = cache.get(DEMAND_MODEL_KEY)
+    if model is None:
+        model = load_demand_model()
+        cache.set(DEMAND_MODEL_KEY, model, seconds_until(next_close()))
+    return model
+
+
+def forecast_demand(item_texts, service_date):
+    """
+    Utility function that returns the expected demand of the given dishes on a service date, as
+    a list of dicts with the text of the dish under 'item_text', the expected orders of each
+    size under 'sizes' (as (size name, orders) pairs) and their sum under 'total'. Dishes never
+    offered before are left out. If no dishes are given, the TOP_DISHES dishes with the highest
+    expected demand are returned.
+
+    Arguments:
+
+    **item_texts**
+        List with the text of the dishes.
+    **service_date**
+        The date the dishes would be served.
+    """
+    model = get_demand_model()
+    weekday = service_date.weekday()
+    if not item_texts:
+        item_texts = model.top_dishes(weekday, TOP_DISHES)
+    forecasts = []
+    for item_text in item_texts:
+        estimate = model.forecast(item_text, weekday)
+        if estimate is None:
+            continue
+        forecasts.append({
+            'item_text': item_text,
+            'sizes': [
+                (display, round(value, 1))
+                for (_, display), value in zip(Order.MEAL_SIZES, estimate)
+            ],
+            'total': round(sum(estimate), 1),
+        })
+    return forecasts
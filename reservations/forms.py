@@ -1,7 +1,7 @@
 from django import forms
+from django.forms import formset_factory
 from django.forms.models import modelformset_factory
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import F
 from .models import User, Menu, MenuItem, Order
 
 
@@ -50,6 +50,24 @@ class MenuForm(forms.ModelForm):
         }
 
 
+class MenuItemChoiceField(forms.ChoiceField):
+    """
+    Choice field for the items of a single menu, built from already known (id, item_text) pairs
+    instead of a queryset, so validating a choice doesn't need a query. A valid choice is cleaned
+    into an unsaved MenuItem carrying its id, menu and text.
+    """
+    def __init__(self, menu, items, **kwargs):
+        self.menu = menu
+        self.item_texts = {str(pk): text for pk, text in items}
+        super().__init__(choices=[('', '---------')] + list(items), **kwargs)
+
+    def clean(self, value):
+        value = super().clean(value)
+        if value in self.empty_values:
+            return None
+        return MenuItem(pk=int(value), menu=self.menu, item_text=self.item_texts[value])
+
+
 class OrderForm(forms.ModelForm):
     """
     Model form for filling up an order, the user is filled automatically.
@@ -64,6 +82,42 @@ class OrderForm(forms.ModelForm):
             'size': ('Tamaño')
         }
 
+    def use_menu_items(self, menu, items):
+        """
+        Restricts the item choice of this form to the given items of a menu, which are then
+        shown and validated without going to the database (see caches.get_menu_state).
+
+        Arguments:
+
+        **menu**
+            The Menu the items belong to.
+        **items**
+            List of (id, item_text) pairs of the menu's items.
+        """
+        item_choice = self.fields['item_choice']
+        self.fields['item_choice'] = MenuItemChoiceField(
+            menu, items, label=item_choice.label, required=item_choice.required)
+
+    def reject_item_choice(self, menu, items):
+        """
+        Marks the chosen item as not valid, when it turns out not to exist anymore while placing
+        the order, and restricts the item choice to the given up to date items of the menu (see
+        use_menu_items).
+        """
+        value = self.data.get('item_choice')
+        self.use_menu_items(menu, items)
+        self.add_error('item_choice', forms.ValidationError(
+            self.fields['item_choice'].error_messages['invalid_choice'],
+            code='invalid_choice',
+            params={'value': value}))
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if isinstance(self.fields['item_choice'], MenuItemChoiceField):
+            # Already validated against the menu's items
+            exclude.append('item_choice')
+        return exclude
+
     def save_with_user_and_add_to_count(self, user):
         """
         Method to save an Order, associate the order with a given user and add one to the count
@@ -77,11 +131,25 @@ class OrderForm(forms.ModelForm):
         order = super().save(commit=False)
         order.user = user
         order.save()
-        cur_choice = order.item_choice
-        cur_choice.count = F('count') + 1
-        cur_choice.save()
+        MenuItem.objects.add_to_count(order.item_choice_id)
         return order
 
+    def place_with_user(self, user):
+        """
+        Method to place the Order of this form for the given user through the atomic ordering
+        path (see OrderManager.place), the item choice's menu should be loaded along with it.
+
+        Arguments:
+
+        **user**
+            An User model object who issues the order.
+        """
+        return Order.objects.place(
+            user,
+            self.cleaned_data['item_choice'],
+            size=self.cleaned_data['size'],
+            comments=self.cleaned_data['comments'])
+
 # ModelFormSet based on the MenuItem model, just asks for the name of the menu item,
 # used for dynamic forms in the create and edit menu views.
 MenuItemFormSet = modelformset_factory(
@@ -92,3 +160,23 @@ MenuItemFormSet = modelformset_factory(
     min_num=1,
     extra=0,
     validate_min=True)
+
+
+class MenuItemEditForm(forms.Form):
+    """
+    Form for an item of an existing menu, asks for the name of the menu item and carries the id
+    of the item being edited in a hidden field (empty for new items). Unlike the model formset,
+    the id isn't looked up in the database by each form.
+    """
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    item_text = forms.CharField(
+        max_length=MenuItem._meta.get_field('item_text').max_length, label="Nombre del plato")
+
+
+# FormSet of MenuItemEditForm, used for dynamic forms in the edit menu view.
+MenuItemEditFormSet = formset_factory(
+    MenuItemEditForm,
+    can_delete=True,
+    min_num=1,
+    extra=0,
+    validate_min=True)
@@ -0,0 +1,245 @@
+import threading
+import time
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template
+
+# Upper bounds of the buckets of the duration histograms, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the buckets of the SQL queries histogram.
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# View name of the requests that didn't match any URL.
+UNRESOLVED_VIEW = '<unresolved>'
+
+# HTTP methods recorded by name, any other method (as sent by the client) is recorded as
+# OTHER_METHOD so clients can't make up new histograms.
+KNOWN_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+OTHER_METHOD = 'other'
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """
+    Work done by a single request, filled while the request is handled.
+
+    Attributes:
+
+    **sql_count**
+        Number of SQL queries.
+    **sql_time**
+        Seconds spent running SQL queries.
+    **template_time**
+        Seconds spent rendering templates (nested renders are counted once).
+    """
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+def current_metrics():
+    """
+    Utility function that returns the RequestMetrics of the request being handled by this
+    thread, or None if there's none (e.g: in a Celery task).
+    """
+    return getattr(_local, 'metrics', None)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: the number of observations under each bucket's upper bound,
+    along with their count and sum.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Histograms of the requests handled by this process, by metric and labels. Every process
+    keeps its own, so each one must be scraped (or the metrics summed) separately.
+    """
+    METRICS = (
+        ('nora_request_duration_seconds', 'Time taken to handle the request.', DURATION_BUCKETS),
+        ('nora_request_sql_duration_seconds', 'Time spent running SQL queries.', DURATION_BUCKETS),
+        ('nora_request_sql_queries', 'Number of SQL queries.', QUERY_BUCKETS),
+        ('nora_request_template_duration_seconds', 'Time spent rendering templates.',
+         DURATION_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name, _, _ in self.METRICS}
+        self.buckets = {name: buckets for name, _, buckets in self.METRICS}
+
+    def observe(self, labels, values):
+        """
+        Records the values of a request, a dict by metric name, under the given labels (a tuple
+        of (name, value) pairs).
+        """
+        with self.lock:
+            for name, value in values.items():
+                histograms = self.histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(self.buckets[name])
+                histograms[labels].observe(value)
+
+    def render(self):
+        """
+        Returns every histogram in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name, description, _ in self.METRICS:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('%s_bucket{%s} %d' % (
+                            name, format_labels(labels + (('le', format_value(bound)),)), count))
+                    lines.append('%s_bucket{%s} %d' % (
+                        name, format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                    lines.append('%s_sum{%s} %s' % (
+                        name, format_labels(labels), format_value(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (
+                        name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                     .replace('\n', '\\n'))
+        for name, value in labels)
+
+
+registry = MetricsRegistry()
+
+
+def time_sql(execute, sql, params, many, context):
+    metrics = current_metrics()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started
+        metrics.sql_count += 1
+
+
+class InstrumentationMiddleware:
+    """
+    Middleware that measures the total time of every request, the number and time of its SQL
+    queries (through an execute wrapper on the default database connection) and the time spent
+    rendering templates (see TimedDjangoTemplates). The measures are sent back in a
+    Server-Timing header and recorded in histograms by view name and method (see views.metrics).
+    The content of streaming responses is measured too while it's sent, and recorded once the
+    response is closed (their Server-Timing header can only tell the time before it's sent).
+    Should be the first middleware, so the time of the others is counted too.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(time_sql):
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        response['Server-Timing'] = (
+            'total;dur=%.1f, sql;dur=%.1f;desc="%d queries", template;dur=%.1f' % (
+                (time.perf_counter() - started) * 1000, metrics.sql_time * 1000,
+                metrics.sql_count, metrics.template_time * 1000))
+        if not response.streaming:
+            self.record(request, metrics, time.perf_counter() - started)
+            return response
+        response.streaming_content = self.measure_stream(response.streaming_content, metrics)
+        close = response.close
+
+        def close_and_record():
+            try:
+                close()
+            finally:
+                self.record(request, metrics, time.perf_counter() - started)
+        response.close = close_and_record
+        return response
+
+    def measure_stream(self, content, metrics):
+        """
+        Wraps the content of a streaming response so that the queries and templates it takes
+        while it's sent are added to the metrics of its request.
+        """
+        content = iter(content)
+        while True:
+            _local.metrics = metrics
+            try:
+                with connection.execute_wrapper(time_sql):
+                    chunk = next(content)
+            except StopIteration:
+                return
+            finally:
+                _local.metrics = None
+            yield chunk
+
+    def record(self, request, metrics, total):
+        match = request.resolver_match
+        method = request.method if request.method in KNOWN_METHODS else OTHER_METHOD
+        registry.observe(
+            (('view', (match.url_name or match.view_name) if match else UNRESOLVED_VIEW),
+             ('method', method)),
+            {
+                'nora_request_duration_seconds': total,
+                'nora_request_sql_duration_seconds': metrics.sql_time,
+                'nora_request_sql_queries': metrics.sql_count,
+                'nora_request_template_duration_seconds': metrics.template_time,
+            })
+
+
+class TimedTemplate(Template):
+    """
+    Django template that adds the time it takes to render to the current request's metrics.
+    """
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with its templates timed (see TimedTemplate). Templates
+    rendered while rendering another one are counted as part of it.
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,233 @@
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from kombu import Connection
+from kombu.pools import connections
+from .models import MenuItem, Order, OrderAggregate, OrderAlreadyFound, OutOfDateError
+from .utils import seconds_until
+from .events import publish_order_changes
+from .caches import bump_menu_version
+
+# Name of the queue (and exchange) that holds the orders waiting to be saved.
+ORDER_QUEUE_NAME = 'nora.orders'
+
+# Time in seconds that the status of an order is kept. The claim of a user on a menu is kept until
+# the menu closes.
+STATUS_TIMEOUT = 60 * 60 * 24
+
+PENDING = 'pending'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+
+
+def claim_key(user_id, menu_id):
+    return 'nora:intake:claim:%s:%s' % (menu_id, user_id)
+
+
+def status_key(ticket):
+    return 'nora:intake:status:%s' % ticket
+
+
+def get_connection():
+    """
+    Utility function that returns a connection to the order queue's broker (as set in the
+    NORA_ORDER_QUEUE_URL setting) taken from a pool, to be used as a context manager.
+    """
+    return connections[Connection(settings.NORA_ORDER_QUEUE_URL)].acquire(block=True)
+
+
+def enqueue_order(user, menu, item_choice, size, comments=''):
+    """
+    Utility function that accepts an order and puts it on the order queue to be saved later by
+    save_queued_orders. It checks that the menu can still be ordered from and that the user
+    doesn't have an order for it (using a claim in the cache, so only the first order of a user
+    for a menu checks the database), raising OutOfDateError or OrderAlreadyFound otherwise.
+    Returns the ticket of the order, which is also the unique_id the order will be saved with.
+
+    Arguments:
+
+    **user**
+        An User model object who issues the order.
+    **menu**
+        The Menu being ordered from.
+    **item_choice**
+        The chosen MenuItem, only its id is used.
+    **size**
+        Size choice for this order.
+    **comments**
+        Any additional comments to the order.
+    """
+    if not menu.is_open():
+        raise OutOfDateError
+    ticket = uuid.uuid4()
+    claim = claim_key(user.pk, menu.pk)
+    if not cache.add(claim, str(ticket), seconds_until(menu.orders_close_at)):
+        raise OrderAlreadyFound
+    if Order.objects.filter(user=user, menu=menu).exists():
+        raise OrderAlreadyFound
+    cache.set(status_key(ticket), {'user': user.pk, 'status': PENDING}, STATUS_TIMEOUT)
+    payload = {
+        'ticket': str(ticket),
+        'user': user.pk,
+        'menu': str(menu.pk),
+        'item': item_choice.pk,
+        'size': size,
+        'comments': comments,
+    }
+    try:
+        with get_connection() as conn, conn.SimpleQueue(ORDER_QUEUE_NAME) as queue:
+            queue.put(payload, serializer='json')
+    except Exception:
+        cache.delete_many([claim, status_key(ticket)])
+        raise
+    return ticket
+
+
+def get_order_status(ticket):
+    """
+    Utility function that returns the status of a queued order as a dict with the id of the
+    user under 'user', one of PENDING, ACCEPTED or REJECTED under 'status' and, for rejected
+    orders, the reason under 'reason'. Returns None if the ticket is unknown.
+
+    Arguments:
+
+    **ticket**
+        The ticket returned by enqueue_order.
+    """
+    return cache.get(status_key(ticket))
+
+
+def save_orders(payloads):
+    """
+    Utility function that saves a batch of queued orders, using a single bulk insert, one count
+    update per chosen item and one aggregate update per chosen item and size in a single
+    transaction. Orders from users that already have an order for the menu, or whose item doesn't
+    belong to the menu anymore (even if it's deleted while saving them), are rejected, and the
+    menus of the latter get a new version so their cached items are loaded again. The saved
+    orders are published to the listeners of their menus (see events.publish_order_changes).
+    Returns a dict with the status of each order by ticket.
+
+    Arguments:
+
+    **payloads**
+        List of orders as put on the queue by enqueue_order.
+    """
+    tickets = [uuid.UUID(payload['ticket']) for payload in payloads]
+    menu_ids = {uuid.UUID(payload['menu']) for payload in payloads}
+    saved = set(Order.objects.filter(pk__in=tickets).values_list('pk', flat=True))
+    ordered = set(
+        Order.objects.filter(menu__in=menu_ids, user__in={payload['user'] for payload in payloads})
+        .values_list('user_id', 'menu_id'))
+    item_menus = dict(
+        MenuItem.objects.filter(pk__in={payload['item'] for payload in payloads})
+        .values_list('pk', 'menu_id'))
+    statuses = {}
+    orders = []
+    for ticket, payload in zip(tickets, payloads):
+        menu_id = uuid.UUID(payload['menu'])
+        if ticket in saved:
+            # Already saved by a previous delivery of this order
+            statuses[ticket] = {'user': payload['user'], 'status': ACCEPTED}
+        elif (payload['user'], menu_id) in ordered:
+            statuses[ticket] = {'user': payload['user'], 'status': REJECTED, 'reason': 'duplicate'}
+        elif item_menus.get(payload['item']) != menu_id:
+            statuses[ticket] = {
+                'user': payload['user'], 'status': REJECTED, 'reason': 'invalid_item'}
+        else:
+            ordered.add((payload['user'], menu_id))
+            orders.append(Order(
+                unique_id=ticket,
+                user_id=payload['user'],
+                menu_id=menu_id,
+                item_choice_id=payload['item'],
+                size=payload['size'],
+                comments=payload['comments']))
+    saved_orders = []
+    try:
+        with transaction.atomic():
+            Order.objects.bulk_create(orders)
+            counts = Counter(order.item_choice_id for order in orders)
+            for item_id, amount in counts.items():
+                MenuItem.objects.add_to_count(item_id, amount)
+            aggregates = Counter(
+                (order.menu_id, order.item_choice_id, order.size) for order in orders)
+            for (menu_id, item_id, size), amount in aggregates.items():
+                OrderAggregate.objects.add(menu_id, item_id, size, amount)
+        saved_orders = orders
+    except IntegrityError:
+        # An order was placed some other way (or an item was deleted) in the meantime, save them
+        # one by one
+        for order in orders:
+            try:
+                with transaction.atomic():
+                    order._state.adding = True
+                    order.save(force_insert=True)
+                    MenuItem.objects.add_to_count(order.item_choice_id)
+                saved_orders.append(order)
+            except IntegrityError:
+                if Order.objects.filter(user=order.user_id, menu=order.menu_id).exists():
+                    reason = 'duplicate'
+                elif not MenuItem.objects.filter(
+                        pk=order.item_choice_id, menu=order.menu_id).exists():
+                    reason = 'invalid_item'
+                else:
+                    raise
+                statuses[order.pk] = {'user': order.user_id, 'status': REJECTED, 'reason': reason}
+    # The cached items of these menus are out of date, so they are loaded again
+    for menu_id in {
+            uuid.UUID(payload['menu']) for ticket, payload in zip(tickets, payloads)
+            if statuses.get(ticket, {}).get('reason') == 'invalid_item'}:
+        bump_menu_version(menu_id)
+    for order in saved_orders:
+        statuses[order.pk] = {'user': order.user_id, 'status': ACCEPTED}
+    changes = Counter((order.menu_id, order.item_choice_id, order.size) for order in saved_orders)
+    for menu_id in {order.menu_id for order in saved_orders}:
+        publish_order_changes(menu_id, [
+            (item_id, size, amount)
+            for (order_menu_id, item_id, size), amount in changes.items()
+            if order_menu_id == menu_id
+        ])
+    return statuses
+
+
+def drain_order_queue(batch_size):
+    """
+    Utility function that takes up to batch_size orders from the order queue and saves them with
+    save_orders, recording the status of each of them. Orders are only removed from the queue
+    once they are saved. Returns the number of orders taken from the queue.
+
+    Arguments:
+
+    **batch_size**
+        Maximum number of orders to take from the queue.
+    """
+    with get_connection() as conn, conn.SimpleQueue(ORDER_QUEUE_NAME) as queue:
+        queued = []
+        try:
+            while len(queued) < batch_size:
+                queued.append(queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not queued:
+            return 0
+        payloads = [message.payload for message in queued]
+        try:
+            statuses = save_orders(payloads)
+        except Exception:
+            for message in queued:
+                message.requeue()
+            raise
+        cache.set_many(
+            {status_key(ticket): status for ticket, status in statuses.items()},
+            STATUS_TIMEOUT)
+        # Let users order again when their order was rejected for something other than a
+        # previous order.
+        cache.delete_many([
+            claim_key(payload['user'], payload['menu']) for payload in payloads
+            if statuses[uuid.UUID(payload['ticket'])].get('reason') == 'invalid_item'
+        ])
+        for message in queued:
+            message.ack()
+        return len(queued)
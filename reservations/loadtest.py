@@ -0,0 +1,290 @@
+import datetime
+import http.client
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from .models import Menu, MenuItem, Order, User
+from .utils import local_datetime
+
+# Host header sent with every request, it must be in the ALLOWED_HOSTS setting.
+LOAD_TEST_HOST = 'localhost'
+
+# Password of the simulated users.
+LOAD_TEST_PASSWORD = 'loadTestPassword123'
+
+# Response header with the number of SQL queries the request took, see count_queries.
+QUERY_COUNT_HEADER = 'X-Nora-Query-Count'
+
+CSRF_TOKEN_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def count_queries(application):
+    """
+    Wraps a WSGI application so that every response tells how many SQL queries its request took
+    (in the QUERY_COUNT_HEADER header), counted with an execute wrapper on the database connection
+    of the thread handling the request.
+    """
+    def counted_application(environ, start_response):
+        queries = [0]
+
+        def counter(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        def counted_start_response(status, headers, exc_info=None):
+            return start_response(
+                status, headers + [(QUERY_COUNT_HEADER, str(queries[0]))], exc_info)
+
+        with connection.execute_wrapper(counter):
+            return application(environ, counted_start_response)
+    return counted_application
+
+
+def serve(application):
+    """
+    Utility function that serves a WSGI application on a free local port, one thread per
+    request, from a background thread. Returns the server, to be stopped with shutdown.
+    """
+    server = make_server(
+        '127.0.0.1', 0, count_queries(application),
+        server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Session:
+    """
+    Minimal HTTP client for a simulated user, keeping its cookies between requests and taking
+    the CSRF token from the forms it gets. Every request is recorded as a dict with the name of
+    the step under 'step', whether it got the expected status under 'ok', its latency in seconds
+    under 'latency' and the number of SQL queries it took under 'queries'.
+    """
+    def __init__(self, port, records):
+        self.port = port
+        self.records = records
+        self.cookies = SimpleCookie()
+        self.csrf_token = None
+
+    def request(self, step, method, path, data=None, expected=200):
+        headers = {'Host': LOAD_TEST_HOST}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                '%s=%s' % (name, morsel.value) for name, morsel in self.cookies.items())
+        body = None
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.csrf_token or '')
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        started = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            content = response.read().decode('utf-8', 'replace')
+        except Exception:
+            self.records.append({
+                'step': step, 'ok': False, 'latency': time.perf_counter() - started,
+                'queries': None})
+            return None
+        finally:
+            conn.close()
+        for header in response.msg.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        match = CSRF_TOKEN_RE.search(content)
+        if match:
+            self.csrf_token = match.group(1)
+        queries = response.getheader(QUERY_COUNT_HEADER)
+        self.records.append({
+            'step': step,
+            'ok': response.status == expected,
+            'latency': time.perf_counter() - started,
+            'queries': int(queries) if queries is not None else None,
+        })
+        return content
+
+
+def simulate_user(port, index, menu, item_ids, think_time, records):
+    """
+    Utility function that goes through the ordering rush as a single employee would: signs up,
+    logs out and in again, looks at the home page and today's menu, and orders from it. Waits
+    up to think_time seconds (at random) between steps.
+    """
+    session = Session(port, records)
+    username = 'load_test_user_%d' % index
+    menu_path = reverse('menu', kwargs={'unique_id': menu.pk})
+    order_path = reverse('new_order', kwargs={'unique_id': menu.pk})
+    steps = [
+        ('signup_form', 'GET', reverse('signup'), None, 200),
+        ('signup', 'POST', reverse('signup'), {
+            'username': username,
+            'first_name': 'Load',
+            'last_name': 'Test',
+            'email': '%s@example.com' % username,
+            'password1': LOAD_TEST_PASSWORD,
+            'password2': LOAD_TEST_PASSWORD,
+        }, 302),
+        ('logout', 'GET', reverse('logout'), None, 302),
+        ('login_form', 'GET', reverse('login'), None, 200),
+        ('login', 'POST', reverse('login'), {
+            'username': username, 'password': LOAD_TEST_PASSWORD}, 302),
+        ('home', 'GET', reverse('home'), None, 200),
+        ('menu', 'GET', menu_path, None, 200),
+        ('order_form', 'GET', order_path, None, 200),
+        ('order', 'POST', order_path, {
+            'item_choice': random.choice(item_ids),
+            'size': random.choice(Order.MEAL_SIZES)[0],
+            'comments': '',
+        }, 302),
+    ]
+    for step, method, path, data, expected in steps:
+        if think_time:
+            time.sleep(random.uniform(0, think_time))
+        session.request(step, method, path, data, expected)
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile of a list of numbers, by the nearest-rank method.
+    """
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(records, duration):
+    """
+    Utility function that sums up the recorded requests of a load test, overall and by step:
+    number of requests, throughput (requests per second), error rate, latency percentiles (in
+    milliseconds) and SQL queries per request.
+
+    Arguments:
+
+    **records**
+        List of requests as recorded by Session.
+    **duration**
+        Seconds the load test took.
+    """
+    def stats(selected):
+        latencies = [record['latency'] * 1000 for record in selected]
+        queries = [record['queries'] for record in selected if record['queries'] is not None]
+        errors = sum(1 for record in selected if not record['ok'])
+        return {
+            'requests': len(selected),
+            'throughput': round(len(selected) / duration, 2) if duration else None,
+            'errors': errors,
+            'error_rate': round(errors / len(selected), 4),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2),
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(max(latencies), 2),
+            },
+            'queries': {
+                'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'max': max(queries) if queries else None,
+            },
+        }
+    steps = []
+    for record in records:
+        if record['step'] not in steps:
+            steps.append(record['step'])
+    return {
+        'duration': round(duration, 3),
+        'overall': stats(records) if records else None,
+        'steps': {
+            step: stats([record for record in records if record['step'] == step])
+            for step in steps
+        },
+    }
+
+
+def create_rush_menu(items):
+    """
+    Utility function that creates today's menu with the given number of items, open for orders
+    from now until the ordering hour limit (or for an hour if it already passed).
+    """
+    now = timezone.now()
+    close_at = local_datetime(timezone.localdate(), datetime.time(settings.NORA_ORDER_HOUR_LIMIT))
+    if close_at <= now:
+        close_at = now + datetime.timedelta(hours=1)
+    menu = Menu.objects.create(
+        menu_title='Menú de prueba de carga', orders_open_at=now, orders_close_at=close_at)
+    MenuItem.objects.bulk_create_for_menu(menu, ['Plato %d' % idx for idx in range(items)])
+    return menu
+
+
+def run_load_test(application, users, ramp=0, think_time=0, items=3):
+    """
+    Utility function that replays the ordering rush against a WSGI application: creates today's
+    menu, serves the application locally and has the given number of simulated users (see
+    simulate_user) go through it concurrently, starting evenly spread over ramp seconds. Must be
+    run against a database made for the test, since it creates users, a menu and orders. Returns
+    the summary of the run (see summarize) along with its parameters.
+
+    Arguments:
+
+    **application**
+        The WSGI application, e.g: nora.wsgi.application.
+    **users**
+        Number of simulated users.
+    **ramp**
+        Seconds over which the users start.
+    **think_time**
+        Maximum seconds a user waits between steps.
+    **items**
+        Number of items of the menu.
+    """
+    menu = create_rush_menu(items)
+    item_ids = list(MenuItem.objects.filter(menu=menu).values_list('pk', flat=True))
+    server = serve(application)
+    port = server.server_address[1]
+    records = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            futures = []
+            for index in range(users):
+                delay = ramp * index / users
+
+                def start(index=index, delay=delay):
+                    time.sleep(delay)
+                    simulate_user(port, index, menu, item_ids, think_time, records)
+                futures.append(executor.submit(start))
+            for future in futures:
+                future.result()
+    finally:
+        duration = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+    summary = summarize(records, duration)
+    summary['parameters'] = {
+        'users': users,
+        'ramp': ramp,
+        'think_time': think_time,
+        'items': items,
+        'order_intake': settings.NORA_ORDER_INTAKE,
+        'database': connection.vendor,
+    }
+    summary['orders_saved'] = Order.objects.filter(menu=menu).count()
+    summary['users_created'] = User.objects.filter(username__startswith='load_test_user_').count()
+    return summary
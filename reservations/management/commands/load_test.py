@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from ...loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    """
+    Management command that replays the ordering rush before the ordering hour limit against
+    the WSGI application (nora.wsgi), with concurrent simulated users (see loadtest), and saves
+    its results as JSON so runs can be compared over time. It runs on a database created for the
+    test (a temporary file for SQLite) which is destroyed afterwards.
+    """
+    help = 'Replays the ordering rush against the WSGI application and saves the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=50, help='Number of simulated users, 50 by default.')
+        parser.add_argument(
+            '--ramp', type=float, default=0,
+            help='Seconds over which the users start, all at once by default.')
+        parser.add_argument(
+            '--think-time', type=float, default=0,
+            help='Maximum seconds a user waits between steps, none by default.')
+        parser.add_argument(
+            '--items', type=int, default=3, help='Number of items of the menu, 3 by default.')
+        parser.add_argument(
+            '--output', help='File the results are saved to, loadtest-<date and time>.json by '
+                             'default.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['items'] < 1:
+            raise CommandError('There must be at least one user and one item.')
+        output = options['output'] or 'loadtest-%s.json' % (
+            timezone.localtime().strftime('%Y%m%d-%H%M%S'))
+        started = timezone.now()
+        temp_dir = None
+        if connection.vendor == 'sqlite':
+            # An in-memory database can't be written by many threads at once
+            temp_dir = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'loadtest.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            from nora.wsgi import application
+            results = run_load_test(
+                application, options['users'], ramp=options['ramp'],
+                think_time=options['think_time'], items=options['items'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        results['started'] = started.isoformat()
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        self.stdout.write('%-12s %8s %8s %8s %8s %8s %8s' % (
+            'step', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for step, stats in sorted(results['steps'].items()) + [('overall', results['overall'])]:
+            self.stdout.write('%-12s %8d %8d %8.1f %8.1f %8.1f %8s' % (
+                step, stats['requests'], stats['errors'], stats['latency_ms']['p50'],
+                stats['latency_ms']['p95'], stats['latency_ms']['p99'],
+                stats['queries']['mean']))
+        self.stdout.write('%.1f requests per second, results saved to %s' % (
+            results['overall']['throughput'], output))
@@ -0,0 +1,30 @@
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from ...models import Menu, OrderAggregate
+
+
+class Command(BaseCommand):
+    """
+    Management command that builds the order aggregates (see OrderAggregate) again from the
+    orders, of every menu or only of the given ones.
+    """
+    help = 'Builds the order aggregates again from the orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'menu_ids', nargs='*', help='Ids of the menus to rebuild, all of them by default.')
+
+    def handle(self, *args, **options):
+        menu_ids = None
+        if options['menu_ids']:
+            try:
+                menu_ids = [uuid.UUID(menu_id) for menu_id in options['menu_ids']]
+            except ValueError:
+                raise CommandError('Menu ids must be UUIDs.')
+            missing = set(menu_ids) - set(
+                Menu.objects.filter(pk__in=menu_ids).values_list('pk', flat=True))
+            if missing:
+                raise CommandError(
+                    'Unknown menus: %s' % ', '.join(str(menu_id) for menu_id in missing))
+        built = OrderAggregate.objects.rebuild(menu_ids)
+        self.stdout.write('Built %d order aggregates.' % built)
@@ -0,0 +1,56 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:28
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_order_menu(apps, schema_editor):
+    """
+    Fills the menu of the already existing orders with the menu of their item choice.
+    """
+    Order = apps.get_model('reservations', 'Order')
+    MenuItem = apps.get_model('reservations', 'MenuItem')
+    Order.objects.filter(menu__isnull=True).update(
+        menu=Subquery(MenuItem.objects.filter(pk=OuterRef('item_choice')).values('menu')[:1])
+    )
+
+
+def remove_duplicate_orders(apps, schema_editor):
+    """
+    Removes the repeated orders of a user for the same menu (left by concurrent requests before
+    the unique constraint existed), keeping the earliest one and taking the removed ones out of
+    the counts of their items.
+    """
+    Order = apps.get_model('reservations', 'Order')
+    MenuItem = apps.get_model('reservations', 'MenuItem')
+    repeated = (
+        Order.objects.order_by().values('user', 'menu').annotate(orders=Count('pk'))
+        .filter(orders__gt=1))
+    for group in repeated:
+        orders = list(
+            Order.objects.filter(user=group['user'], menu=group['menu']).order_by('created', 'pk'))
+        for order in orders[1:]:
+            MenuItem.objects.filter(pk=order.item_choice_id).update(count=F('count') - 1)
+            order.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0004_auto_20180719_1229'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='menu',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='reservations.Menu'),
+        ),
+        migrations.RunPython(fill_order_menu, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_orders, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='order',
+            unique_together={('user', 'menu')},
+        ),
+    ]
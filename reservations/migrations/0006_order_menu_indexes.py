@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_order_menu'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='menu',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='reservations.Menu'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['menu', '-created'], name='order_menu_created_idx'),
+        ),
+    ]
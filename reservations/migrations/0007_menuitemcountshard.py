@@ -0,0 +1,27 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_order_menu_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemCountShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.SmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='count_shards', to='reservations.MenuItem')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='menuitemcountshard',
+            unique_together={('item', 'shard')},
+        ),
+    ]
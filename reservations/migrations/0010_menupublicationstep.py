@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_order_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuPublicationStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.CharField(max_length=50)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('menu', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='publication_steps', to='reservations.Menu')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='menupublicationstep',
+            unique_together={('menu', 'step')},
+        ),
+    ]
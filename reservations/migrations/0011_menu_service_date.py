@@ -0,0 +1,42 @@
+from collections import Counter
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_service_date(apps, schema_editor):
+    """
+    Fills the service date of the already existing menus with the (local) date they were created.
+    """
+    Menu = apps.get_model('reservations', 'Menu')
+    menus = list(Menu.objects.only('pk', 'created'))
+    for menu in menus:
+        menu.service_date = timezone.localtime(menu.created).date()
+    repeated = [day for day, count in Counter(menu.service_date for menu in menus).items()
+                if count > 1]
+    if repeated:
+        raise RuntimeError(
+            'There is more than one menu for the days %s, only one menu per day is allowed. '
+            'Fix them before migrating.' % ', '.join(str(day) for day in sorted(repeated)))
+    for menu in menus:
+        Menu.objects.filter(pk=menu.pk).update(service_date=menu.service_date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0010_menupublicationstep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='service_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(fill_service_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='menu',
+            name='service_date',
+            field=models.DateField(default=timezone.localdate, unique=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_ordering_window(apps, schema_editor):
+    """
+    Fills the ordering window of the already existing menus with the default one of their service
+    date: from the start of the day until the NORA_ORDER_HOUR_LIMIT hour.
+    """
+    Menu = apps.get_model('reservations', 'Menu')
+    for menu_id, service_date in Menu.objects.values_list('pk', 'service_date'):
+        Menu.objects.filter(pk=menu_id).update(
+            orders_open_at=timezone.make_aware(
+                datetime.datetime.combine(service_date, datetime.time()), is_dst=False),
+            orders_close_at=timezone.make_aware(
+                datetime.datetime.combine(
+                    service_date, datetime.time(settings.NORA_ORDER_HOUR_LIMIT)),
+                is_dst=False))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0011_menu_service_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='orders_open_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='menu',
+            name='orders_close_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_ordering_window, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='menu',
+            name='orders_open_at',
+            field=models.DateTimeField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='menu',
+            name='orders_close_at',
+            field=models.DateTimeField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(
+                fields=['orders_close_at', 'orders_open_at'], name='menu_ordering_idx'),
+        ),
+    ]
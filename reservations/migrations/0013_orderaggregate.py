@@ -0,0 +1,45 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:49
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_order_aggregates(apps, schema_editor):
+    """
+    Builds the aggregates of the already existing orders.
+    """
+    Order = apps.get_model('reservations', 'Order')
+    OrderAggregate = apps.get_model('reservations', 'OrderAggregate')
+    OrderAggregate.objects.bulk_create([
+        OrderAggregate(
+            menu_id=row['menu_id'], item_id=row['item_choice_id'], size=row['size'],
+            count=row['count'])
+        for row in Order.objects.order_by().values('menu_id', 'item_choice_id', 'size')
+        .annotate(count=Count('pk')).iterator()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0012_menu_ordering_window'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.SmallIntegerField(choices=[(0, 'Normal'), (1, 'Large')])),
+                ('count', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_aggregates', to='reservations.MenuItem')),
+                ('menu', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_aggregates', to='reservations.Menu')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderaggregate',
+            unique_together={('item', 'size')},
+        ),
+        migrations.RunPython(fill_order_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.15 on 2026-10-17 18:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0013_orderaggregate'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='order',
+            options={'ordering': ['-created'], 'permissions': (('place_team_orders', 'Puede ordenar para otros usuarios'),)},
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.1.15 on 2026-10-17 19:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fill_state(apps, schema_editor):
+    """
+    Marks the already finished publication steps as done, the others are left as started.
+    """
+    MenuPublicationStep = apps.get_model('reservations', 'MenuPublicationStep')
+    MenuPublicationStep.objects.filter(finished__isnull=False).update(state='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0014_order_place_team_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menupublicationstep',
+            name='progress',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='menupublicationstep',
+            name='state',
+            field=models.CharField(choices=[('started', 'Iniciado'), ('failed', 'Fallido'), ('done', 'Terminado')], default='started', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='menupublicationstep',
+            name='started',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_state, migrations.RunPython.noop),
+    ]
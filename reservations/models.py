@@ -1,7 +1,14 @@
+import datetime
+import random
 import uuid
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Sum, Count, Case, When, Value, CharField
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
+from .utils import default_ordering_window
+from .events import publish_order_changes
 
 class User(AbstractUser):
     """
@@ -18,13 +25,25 @@ class User(AbstractUser):
     """
     is_chef = models.BooleanField(default=False)
 
+class MenuQuerySet(models.QuerySet):
+    """
+    QuerySet for menus, selects them by their ordering window.
+    """
+    def open_now(self):
+        """
+        Returns the menus that can be ordered from right now, according to their ordering window,
+        with a single query on its index (see Menu.Meta.indexes).
+        """
+        now = timezone.now()
+        return self.filter(orders_close_at__gt=now, orders_open_at__lte=now)
+
+
 class MenuManager(models.Manager):
     """
-    Manager for checking the menu published today, used to avoid publishing of 2 menus in a single
-    day.
+    Manager for checking the menu published today, that is, the menu whose service date is today.
     """
     def get_queryset(self):
-        return super().get_queryset().filter(created__date=timezone.localdate())
+        return super().get_queryset().filter(service_date=timezone.localdate())
 
 class Menu(models.Model):
     """
@@ -46,27 +65,153 @@ class Menu(models.Model):
 
     **unique_id**
         A UUID field that uniquely identifies this menu.
+
+    **service_date**
+        A Date field with the day this menu is served, today by default. It's unique, so the
+        database itself avoids the publishing of 2 menus in a single day.
+
+    **orders_open_at**
+        A Date/Time field with the time from which this menu can be ordered from, by default the
+        start of its service date.
+
+    **orders_close_at**
+        A Date/Time field with the time until which this menu can be ordered from, by default the
+        hour given by the NORA_ORDER_HOUR_LIMIT setting on its service date.
     """
     # Default manager
-    objects = models.Manager()
+    objects = MenuQuerySet.as_manager()
 
     menu_title = models.CharField(max_length=50)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     unique_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    service_date = models.DateField(default=timezone.localdate, unique=True)
+    orders_open_at = models.DateTimeField(blank=True)
+    orders_close_at = models.DateTimeField(blank=True)
     todays_menu = MenuManager()
 
     def __str__(self):
         return self.menu_title
 
-    def published_today(self):
+    def save(self, *args, **kwargs):
         """
-        returns True if this menu entry was published within today's date, False otherwise.
+        Saves this menu, filling its ordering window with the default one of its service date
+        (see utils.default_ordering_window) if it wasn't set.
         """
-        return timezone.localtime(self.created).date() == timezone.localdate()
+        open_at, close_at = default_ordering_window(self.service_date)
+        if self.orders_open_at is None:
+            self.orders_open_at = open_at
+        if self.orders_close_at is None:
+            self.orders_close_at = close_at
+        super().save(*args, **kwargs)
+
+    def is_open(self):
+        """
+        returns True if this menu can be ordered from right now, False otherwise.
+        """
+        return self.orders_open_at <= timezone.now() < self.orders_close_at
 
     class Meta:
         ordering = ['-created']
+        # The previous menus are paginated on the index of the unique service_date.
+        indexes = [
+            models.Index(fields=['orders_close_at', 'orders_open_at'], name='menu_ordering_idx'),
+        ]
+
+class MenuItemManager(models.Manager):
+    """
+    Manager for menu items, takes care of their order counts. If the NORA_COUNTER_SHARDS setting
+    is greater than 1, the counts are striped: each increment goes to one of several
+    MenuItemCountShard rows of the item (chosen at random) instead of the item's row itself, so
+    simultaneous orders of the same item don't wait on each other. The total count of an item is
+    then its own count plus the count of all of its shards.
+    """
+    def with_total_count(self):
+        """
+        Returns a queryset of menu items annotated with their total number of orders as
+        total_count.
+        """
+        return self.get_queryset().annotate(
+            total_count=F('count') + Coalesce(Sum('count_shards__count'), 0))
+
+    def bulk_create_for_menu(self, menu, item_texts):
+        """
+        Creates the items of a menu with a single insert. Should be called within the same
+        transaction the menu is saved in.
+
+        Arguments:
+
+        **menu**
+            The Menu the items belong to, already saved.
+        **item_texts**
+            List with the text of each item.
+        """
+        return self.bulk_create([MenuItem(menu=menu, item_text=text) for text in item_texts])
+
+    def sync_for_menu(self, menu, items):
+        """
+        Makes the items of a menu match the given list, comparing by primary key: items whose
+        text changed are updated with a single query, items without a primary key (or with one
+        that isn't in the menu anymore) are created with a single insert and the items of the
+        menu that aren't in the list are deleted with a single delete, along with their orders.
+        The number of queries doesn't depend on the number of items. Should be called within a
+        transaction.
+
+        Arguments:
+
+        **menu**
+            The Menu whose items are being edited.
+        **items**
+            List of (id, item_text) pairs, id being None for new items.
+        """
+        old_texts = dict(self.filter(menu=menu).values_list('pk', 'item_text'))
+        changed = {}
+        kept = set()
+        new_texts = []
+        for pk, text in items:
+            if pk in old_texts:
+                kept.add(pk)
+                if old_texts[pk] != text:
+                    changed[pk] = text
+            else:
+                new_texts.append(text)
+        if changed:
+            self.filter(pk__in=changed).update(item_text=Case(
+                *[When(pk=pk, then=Value(text)) for pk, text in changed.items()],
+                output_field=CharField()))
+        if new_texts:
+            self.bulk_create_for_menu(menu, new_texts)
+        removed = set(old_texts) - kept
+        if removed:
+            self.filter(pk__in=removed).delete()
+
+    def add_to_count(self, item_id, amount=1):
+        """
+        Adds the given amount to the count of a menu item. Should be called within the same
+        transaction as the orders being counted.
+
+        Arguments:
+
+        **item_id**
+            Primary key of the MenuItem to add to.
+        **amount**
+            How much to add, 1 by default.
+        """
+        shards = getattr(settings, 'NORA_COUNTER_SHARDS', 1)
+        if shards <= 1:
+            self.filter(pk=item_id).update(count=F('count') + amount)
+            return
+        shard = random.randrange(shards)
+        item_shard = MenuItemCountShard.objects.filter(item_id=item_id, shard=shard)
+        if item_shard.update(count=F('count') + amount):
+            return
+        try:
+            with transaction.atomic():
+                MenuItemCountShard.objects.create(item_id=item_id, shard=shard, count=amount)
+        except IntegrityError:
+            # Somebody else created the shard in the meantime
+            item_shard.update(count=F('count') + amount)
+
 
 class MenuItem(models.Model):
     """
@@ -82,15 +227,136 @@ class MenuItem(models.Model):
     **item_text**
         A Char field with the menu's choice itself.
     **count**
-        An Int field with the number of times this menu item has been ordered.
+        An Int field with the number of times this menu item has been ordered. When the counts
+        are striped (see MenuItemManager) part of the count lives in the item's count shards.
     """
     menu = models.ForeignKey(Menu, on_delete=models.CASCADE)
     item_text = models.CharField(max_length=200)
     count = models.IntegerField(default=0)
 
+    objects = MenuItemManager()
+
     def __str__(self):
         return self.item_text
 
+
+class MenuItemCountShard(models.Model):
+    """
+    Model holding a part of a MenuItem's order count, used when the counts are striped.
+
+    Attributes:
+
+    **item**
+        A Foreign key to the MenuItem this count belongs to.
+    **shard**
+        A Small Int field with the number of this shard within the item.
+    **count**
+        An Int field with the number of orders counted in this shard.
+    """
+    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='count_shards')
+    shard = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('item', 'shard'),)
+
+class OrderAlreadyFound(Exception):
+    """
+    Exception that indicates that a given user already has an order associated with a menu.
+    """
+    pass
+
+
+class ItemNotFound(Exception):
+    """
+    Exception that indicates that the item chosen for an order doesn't exist anymore, e.g: it was
+    deleted from its menu while the order was being placed.
+    """
+    pass
+
+
+class OutOfDateError(Exception):
+    """
+    Exception that indicates that an order is trying to be issued on a menu that is out of date
+    to do so.
+    """
+    pass
+
+
+class OrderQuerySet(models.QuerySet):
+    """
+    QuerySet for orders, allows to get them as lightweight rows.
+    """
+    def as_rows(self):
+        """
+        Returns the orders as named tuples of plain values instead of model objects, with
+        everything needed to list them taken in the same query: unique_id, created, comments,
+        size, size_display, username, item_text, menu_id and menu_title.
+        """
+        return self.annotate(
+            size_display=Case(
+                *[When(size=size, then=Value(label)) for size, label in Order.MEAL_SIZES],
+                output_field=CharField()),
+            username=F('user__username'),
+            item_text=F('item_choice__item_text'),
+            menu_title=F('menu__menu_title'),
+        ).values_list(
+            'unique_id', 'created', 'comments', 'size', 'size_display', 'username', 'item_text',
+            'menu_id', 'menu_title', named=True)
+
+
+class OrderManager(models.Manager):
+    """
+    Manager for orders, provides the atomic path used to place a new order.
+    """
+    def place(self, user, item_choice, size=None, comments=''):
+        """
+        Places an order for the given user in a single transaction: checks that the menu can
+        still be ordered from, inserts the order and adds one to the count of the chosen
+        MenuItem. Having two orders for the same user and menu is prevented by the database
+        itself, so two simultaneous requests can't both get through. Once committed, the new order
+        is published to the listeners of the menu (see events.publish_order_changes).
+
+        Raises OutOfDateError if the menu can't be ordered from anymore, OrderAlreadyFound if
+        the user already has an order for this menu and ItemNotFound if the chosen item doesn't
+        exist anymore (e.g: it was chosen from out of date cached items), other integrity errors
+        are raised as they are.
+
+        Arguments:
+
+        **user**
+            An User model object who issues the order.
+        **item_choice**
+            The chosen MenuItem, its menu should already be loaded (i.e: select_related('menu'))
+            to avoid an additional query.
+        **size**
+            Size choice for this order, Order.NORMAL by default.
+        **comments**
+            Any additional comments to the order.
+        """
+        menu = item_choice.menu
+        if not menu.is_open():
+            raise OutOfDateError
+        order = self.model(user=user, item_choice=item_choice, menu=menu, comments=comments)
+        if size is not None:
+            order.size = size
+        try:
+            with transaction.atomic():
+                order.save(force_insert=True)
+                MenuItem.objects.add_to_count(item_choice.pk)
+                changes = [(item_choice.pk, order.size, 1)]
+                transaction.on_commit(lambda: publish_order_changes(menu.pk, changes))
+        except IntegrityError:
+            # Only the (user, menu) constraint means the user already ordered, and a missing item
+            # means it was deleted in the meantime, anything else is left to propagate
+            if self.filter(user=user, menu=menu).exists():
+                raise OrderAlreadyFound
+            if not MenuItem.objects.filter(pk=item_choice.pk, menu=menu).exists():
+                raise ItemNotFound
+            raise
+        return order
+
+
 class Order(models.Model):
     """
     Model holding a client's order data.
@@ -107,12 +373,19 @@ class Order(models.Model):
         A Date/Time field that represents the time of creation of this order
     **item_choice**
         A Foreign key with this order's menu choice.
+    **menu**
+        A Foreign key to the menu of the item choice, filled automatically on save. Together
+        with the user it's unique, so a user can only have one order per menu. It avoids going
+        through the MenuItem table when looking for the orders of a menu.
     **comments**
         A Char field with any additional comments to the order.
     **size**
         A Small Int field that represents the size choice for this order.
     **user**
         A Foreign key to the user who issued this order.
+
+    Users with the place_team_orders permission (e.g: team leads) can place orders for other
+    users through the API.
     """
     NORMAL = 0
     LARGE = 1
@@ -126,6 +399,229 @@ class Order(models.Model):
     comments = models.CharField(max_length=200, blank=True)
     size = models.SmallIntegerField(choices=MEAL_SIZES, default=NORMAL)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE, editable=False)
+
+    objects = OrderManager.from_queryset(OrderQuerySet)()
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the order, filling the menu from the item choice if it wasn't set. A new order is
+        added to its OrderAggregate in the same transaction.
+        """
+        if self.menu_id is None and self.item_choice_id is not None:
+            self.menu_id = self.item_choice.menu_id
+        adding = self._state.adding
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if adding:
+                OrderAggregate.objects.add(self.menu_id, self.item_choice_id, self.size)
+
+    class Meta:
+        ordering = ['-created']
+        # The unique constraint also indexes the "has this user ordered from this menu" lookup.
+        unique_together = (('user', 'menu'),)
+        indexes = [
+            models.Index(fields=['menu', '-created'], name='order_menu_created_idx'),
+            models.Index(fields=['user', '-created'], name='order_user_created_idx'),
+        ]
+        permissions = (
+            ('place_team_orders', 'Puede ordenar para otros usuarios'),
+        )
+
+
+class PublicationStepBusy(Exception):
+    """
+    Exception that indicates that a step of the publication of a menu is being run by somebody
+    else (e.g: another Celery worker), so it can't be run right now.
+    """
+    pass
+
+
+class MenuPublicationStepManager(models.Manager):
+    """
+    Manager for the steps of menu publications, makes sure each step is done once per menu.
+    """
+    def run_once(self, menu_id, step, func):
+        """
+        Runs a step of the publication of a menu, unless it's already done for that menu. The
+        step is recorded as started before being run and as done once it returns. If it fails
+        with an exception it's recorded as failed, and running it again resumes it from the
+        progress it recorded (see MenuPublicationStep.save_progress), so steps that work in
+        parts (e.g: notifying users by chunks) don't repeat the parts already done. A step that
+        was started more than NORA_PUBLICATION_STEP_TIMEOUT seconds ago without finishing (e.g:
+        its worker died) is resumed as well, while one started more recently raises
+        PublicationStepBusy. Returns True if the step was run, False if it was already done.
+
+        Arguments:
+
+        **menu_id**
+            Primary key of the menu being published.
+        **step**
+            Name of the step.
+        **func**
+            Callable that runs the step, it gets the MenuPublicationStep record.
+        """
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = self.create(menu_id=menu_id, step=step, started=now)
+        except IntegrityError:
+            stale = now - datetime.timedelta(seconds=settings.NORA_PUBLICATION_STEP_TIMEOUT)
+            claimed = (
+                self.filter(menu_id=menu_id, step=step)
+                .filter(
+                    Q(state=MenuPublicationStep.FAILED) |
+                    Q(state=MenuPublicationStep.STARTED, started__lt=stale))
+                .update(state=MenuPublicationStep.STARTED, started=now))
+            record = self.get(menu_id=menu_id, step=step)
+            if not claimed:
+                if record.state == MenuPublicationStep.DONE:
+                    return False
+                raise PublicationStepBusy
+        try:
+            func(record)
+        except Exception:
+            self.filter(pk=record.pk).update(state=MenuPublicationStep.FAILED)
+            raise
+        record.state = MenuPublicationStep.DONE
+        record.finished = timezone.now()
+        record.save(update_fields=['state', 'finished'])
+        return True
+
+
+class MenuPublicationStep(models.Model):
+    """
+    Model recording a step of the publication of a menu (such as notifying users), the menu and
+    step together work as an idempotency key so no step is done twice.
+
+    Attributes:
+
+    **menu**
+        A Foreign key to the published menu.
+    **step**
+        A Char field with the name of the step.
+    **state**
+        A Char field with the state of the step: started, failed or done.
+    **started**
+        A Date/Time field with the time the last attempt of the step started.
+    **finished**
+        A Date/Time field with the time the step was done, empty until then.
+    **progress**
+        A Positive Int field with how far the step got, meaning is up to the step (e.g: the
+        primary key of the last user notified), so a failed step can be resumed.
+    """
+    STARTED = 'started'
+    FAILED = 'failed'
+    DONE = 'done'
+    STATES = (
+        (STARTED, 'Iniciado'),
+        (FAILED, 'Fallido'),
+        (DONE, 'Terminado'),
+    )
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE, related_name='publication_steps')
+    step = models.CharField(max_length=50)
+    state = models.CharField(max_length=10, choices=STATES, default=STARTED)
+    started = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+    progress = models.PositiveIntegerField(default=0)
+
+    objects = MenuPublicationStepManager()
+
+    class Meta:
+        unique_together = (('menu', 'step'),)
+
+    def save_progress(self, progress):
+        """
+        Records how far the step got, see MenuPublicationStepManager.run_once.
+        """
+        self.progress = progress
+        self.save(update_fields=['progress'])
+
+
+class OrderAggregateManager(models.Manager):
+    """
+    Manager for the order aggregates, keeps them up to date with the orders.
+    """
+    def add(self, menu_id, item_id, size, amount=1):
+        """
+        Adds the given amount to the number of orders of an item and size, which never goes
+        below zero. Should be called within the same transaction as the orders being counted.
+
+        Arguments:
+
+        **menu_id**
+            Primary key of the Menu of the item.
+        **item_id**
+            Primary key of the chosen MenuItem.
+        **size**
+            Size choice of the orders.
+        **amount**
+            How much to add (or subtract, if negative), 1 by default.
+        """
+        aggregate = self.filter(item_id=item_id, size=size)
+        if aggregate.update(count=Greatest(F('count') + amount, 0)):
+            return
+        if amount <= 0:
+            # There are no orders of the item and size to subtract from
+            return
+        try:
+            with transaction.atomic():
+                self.create(menu_id=menu_id, item_id=item_id, size=size, count=amount)
+        except IntegrityError:
+            # Somebody else created the aggregate in the meantime
+            aggregate.update(count=F('count') + amount)
+
+    def rebuild(self, menu_ids=None):
+        """
+        Builds the aggregates again from the orders, of all the menus or only of the given ones,
+        in a single transaction. Returns the number of aggregates built.
+
+        Arguments:
+
+        **menu_ids**
+            Primary keys of the menus whose aggregates are rebuilt, all of them if None.
+        """
+        orders = Order.objects.order_by().values('menu_id', 'item_choice_id', 'size')
+        aggregates = self.all()
+        if menu_ids is not None:
+            orders = orders.filter(menu__in=menu_ids)
+            aggregates = aggregates.filter(menu__in=menu_ids)
+        with transaction.atomic():
+            aggregates.delete()
+            return len(self.bulk_create([
+                OrderAggregate(
+                    menu_id=row['menu_id'],
+                    item_id=row['item_choice_id'],
+                    size=row['size'],
+                    count=row['count'])
+                for row in orders.annotate(count=Count('pk')).iterator()
+            ]))
+
+
+class OrderAggregate(models.Model):
+    """
+    Model holding the number of orders of each item of a menu and size, kept up to date as orders
+    are saved (see Order.save and OrderAggregate.objects.add) so counting orders never goes
+    through the Order table. Together with the service date of the menu it gives the daily
+    order counts.
+
+    Attributes:
+
+    **menu**
+        A Foreign key to the menu of the item.
+    **item**
+        A Foreign key to the chosen menu item.
+    **size**
+        A Small Int field with the size choice, as in Order.
+    **count**
+        An Integer field with the number of orders of the item and size.
+    """
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE, related_name='order_aggregates')
+    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='order_aggregates')
+    size = models.SmallIntegerField(choices=Order.MEAL_SIZES)
+    count = models.IntegerField(default=0)
+
+    objects = OrderAggregateManager()
 
     class Meta:
-        ordering = ['-created']
\ No newline at end of file
+        unique_together = (('item', 'size'),)
@@ -0,0 +1,128 @@
+import base64
+import json
+from django.db.models import Q
+
+
+class CursorPage:
+    """
+    A page of results from a CursorPaginator, it can be iterated as a list of objects and knows
+    the cursors of the pages next to it (None if there's no such page).
+
+    Attributes:
+
+    **object_list**
+        List of the objects of this page.
+    **next_cursor**
+        Cursor of the next page, with older objects.
+    **previous_cursor**
+        Cursor of the previous page, with newer objects.
+    """
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginator that splits a queryset in pages by the values of some of its fields (keyset
+    pagination), newest first, instead of using OFFSET and COUNT(*). Fetching any page costs the
+    same, as long as there's an index on the fields, and pages are addressed by opaque cursors
+    instead of numbers.
+
+    Arguments:
+
+    **queryset**
+        The queryset to paginate.
+    **per_page**
+        Number of objects per page.
+    **fields**
+        Names of the fields that give the order of the pages, descending, the last one must be
+        unique. By default ('created', 'unique_id').
+    """
+    def __init__(self, queryset, per_page, fields=('created', 'unique_id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.fields = fields
+
+    def encode_cursor(self, direction, obj):
+        values = [str(getattr(obj, name)) for name in self.fields]
+        data = json.dumps([direction] + values).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the direction and field values of a cursor, or (None, None) if it's not valid.
+        """
+        try:
+            direction, *values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if direction not in ('next', 'previous') or len(values) != len(self.fields):
+                return None, None
+            opts = self.queryset.model._meta
+            return direction, [
+                opts.get_field(name).to_python(value) for name, value in zip(self.fields, values)
+            ]
+        except Exception:
+            return None, None
+
+    def keyset_filter(self, values, lookup):
+        """
+        Returns a filter for the rows that come after the given values in lexicographic order,
+        comparing with the given lookup ('lt' or 'gt').
+        """
+        condition = Q()
+        for idx in reversed(range(len(self.fields))):
+            equal = {name: value for name, value in zip(self.fields[:idx], values[:idx])}
+            condition = (
+                Q(**equal, **{'%s__%s' % (self.fields[idx], lookup): values[idx]}) | condition)
+        return condition
+
+    def page(self, cursor=None):
+        """
+        Returns the CursorPage for the given cursor, the first page if no cursor (or an invalid
+        one) is given.
+
+        Arguments:
+
+        **cursor**
+            A cursor from a previous CursorPage.
+        """
+        direction, values = self.decode_cursor(cursor) if cursor else (None, None)
+        if direction == 'previous':
+            rows = list(
+                self.queryset.filter(self.keyset_filter(values, 'gt'))
+                .order_by(*self.fields)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset
+            if values is not None:
+                queryset = queryset.filter(self.keyset_filter(values, 'lt'))
+            rows = list(
+                queryset.order_by(*['-%s' % name for name in self.fields])[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = values is not None
+        return CursorPage(
+            rows,
+            self.encode_cursor('next', rows[-1]) if rows and has_next else None,
+            self.encode_cursor('previous', rows[0]) if rows and has_previous else None)
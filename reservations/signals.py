@@ -0,0 +1,19 @@
+from collections import Counter
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from .models import Order, OrderAggregate, User
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_orders_from_aggregates(sender, instance, **kwargs):
+    """
+    Takes the orders of a user that is being deleted (which are deleted along with it) out of
+    their OrderAggregate, with one update per item and size, within the transaction that deletes
+    them. Orders deleted along with their item or menu don't need it, since their aggregates
+    are deleted too.
+    """
+    counts = Counter(
+        Order.objects.filter(user=instance).order_by()
+        .values_list('menu_id', 'item_choice_id', 'size'))
+    for (menu_id, item_id, size), amount in counts.items():
+        OrderAggregate.objects.add(menu_id, item_id, size, -amount)
@@ -0,0 +1,150 @@
+import logging
+from functools import partial
+from itertools import islice
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from kombu.exceptions import OperationalError
+from . import intake
+from .models import User, Menu, MenuPublicationStep
+from .utils import send_notification_mails, send_slack_message
+
+# Key used to avoid scheduling more than one drain of the order queue at a time.
+DRAIN_SCHEDULED_KEY = 'nora:intake:drain-scheduled'
+
+# Times the broker is tried again when queueing the publication of a menu, before giving up.
+PUBLISH_MAX_RETRIES = 1
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def drain_order_queue():
+    """
+    Celery task that saves every order in the order queue, in batches of
+    NORA_ORDER_QUEUE_BATCH_SIZE orders. If a batch can't be saved, its orders are put back on
+    the queue and another drain is scheduled, so they don't wait for the next order.
+    """
+    # Orders queued from now on will schedule another drain.
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    try:
+        while intake.drain_order_queue(settings.NORA_ORDER_QUEUE_BATCH_SIZE):
+            pass
+    except Exception:
+        schedule_order_queue_drain()
+        raise
+
+
+def schedule_order_queue_drain():
+    """
+    Utility function that schedules a drain_order_queue task to be run in
+    NORA_ORDER_QUEUE_DRAIN_DELAY seconds, unless one is already scheduled. This way all the orders
+    queued in the meantime are saved together.
+    """
+    delay = settings.NORA_ORDER_QUEUE_DRAIN_DELAY
+    if cache.add(DRAIN_SCHEDULED_KEY, True, delay + 60):
+        drain_order_queue.apply_async(countdown=delay)
+
+
+@shared_task
+def send_notification_chunk(template_id, menu_id, recipients):
+    """
+    Celery task that sends a notification mail about a menu to a chunk of recipients, see
+    utils.send_notification_mails.
+    """
+    send_notification_mails(template_id, menu_id, recipients)
+
+
+def queue_notification_chunks(menu_id, after=0, on_chunk=None):
+    """
+    Utility function that hands every user with an email, in order of primary key, to
+    send_notification_chunk tasks in chunks of NORA_NOTIFICATION_CHUNK_SIZE. Addresses are
+    streamed from the database, so memory use doesn't depend on the number of users.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the menu being notified.
+    **after**
+        Primary key of the last user already notified, users up to it are skipped.
+    **on_chunk**
+        Callable called with the primary key of the last user of each chunk once it's queued.
+    """
+    chunk_size = settings.NORA_NOTIFICATION_CHUNK_SIZE
+    users = (
+        User.objects.exclude(email='').filter(pk__gt=after).order_by('pk')
+        .values_list('pk', 'email').iterator(chunk_size=chunk_size))
+    chunk = list(islice(users, chunk_size))
+    while chunk:
+        send_notification_chunk.delay('new_menu', str(menu_id), [email for _, email in chunk])
+        if on_chunk is not None:
+            on_chunk(chunk[-1][0])
+        chunk = list(islice(users, chunk_size))
+
+
+def notify_menu_mail(menu, step):
+    """
+    Publication step that notifies users of the menu by mail. The last user of each queued chunk
+    is recorded as the progress of the step, so when it's resumed only the users after it are
+    notified. Only a chunk queued right before the worker dies, before its progress is saved,
+    can be sent twice.
+    """
+    queue_notification_chunks(menu.pk, step.progress, step.save_progress)
+
+
+def notify_menu_slack(menu, step):
+    """
+    Publication step that notifies the menu in the Slack channel.
+    """
+    send_slack_message(None, menu)
+
+
+# Steps that can be run when publishing a menu, by name, in the order they are run.
+PUBLICATION_STEPS = {
+    'notify_mail': notify_menu_mail,
+    'notify_slack': notify_menu_slack,
+}
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60, acks_late=True)
+def publish_menu(self, menu_id, steps):
+    """
+    Celery task that runs the given steps (see PUBLICATION_STEPS) of the publication of a menu.
+    Each step is done once per menu (see MenuPublicationStepManager.run_once), so the task can be
+    retried or run again without notifying anyone twice: steps already done are skipped and
+    failed ones are resumed from their progress. The task is retried when a step fails or is
+    being run by another worker, and it's only acknowledged once it ends, so it's run again if
+    its worker dies.
+    """
+    menu = Menu.objects.filter(pk=menu_id).first()
+    if menu is None:
+        return
+    try:
+        for step in PUBLICATION_STEPS:
+            if step in steps:
+                MenuPublicationStep.objects.run_once(
+                    menu.pk, step, partial(PUBLICATION_STEPS[step], menu))
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+
+def queue_menu_publication(menu_id, steps):
+    """
+    Utility function that queues a publish_menu task for the given steps of the publication of
+    a menu. The broker is only tried PUBLISH_MAX_RETRIES more times, so the request publishing
+    the menu doesn't hang when it's down; the failure is then logged and the notifications of
+    the menu aren't sent.
+
+    Arguments:
+
+    **menu_id**
+        Primary key of the published menu.
+    **steps**
+        Names of the steps to run, see PUBLICATION_STEPS.
+    """
+    try:
+        with publish_menu.app.connection_for_write() as conn:
+            conn.ensure_connection(max_retries=PUBLISH_MAX_RETRIES, interval_start=0)
+            publish_menu.apply_async((str(menu_id), steps), connection=conn, retry=False)
+    except (OperationalError, OSError):
+        logger.exception('Could not queue the publication of the menu %s', menu_id)
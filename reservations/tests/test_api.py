@@ -0,0 +1,351 @@
+import datetime
+import json
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from .. import models
+from ..caches import bump_menu_version
+
+
+class TodaysMenuApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_no_menu(self):
+        """
+        Tests that while today's menu isn't published the API returns null, and that the menu
+        is returned once it's published.
+        """
+        response = self.client.get(reverse('api_todays_menu'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json(), {'menu': None})
+        etag = response['ETag']
+        menu = models.Menu.objects.create(menu_title='Dummy menu')
+        models.MenuItem.objects.create(item_text='dummy_1', menu=menu)
+        cache.clear()
+        response = self.client.get(reverse('api_todays_menu'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['menu']['id'], str(menu.pk))
+        self.assertEquals(
+            [item['text'] for item in response.json()['menu']['items']], ['dummy_1'])
+
+    def test_conditional_get(self):
+        """
+        Tests that a request with the ETag (or the modification time) of the last response gets
+        a 304 without any query, and that editing the menu's items gives it a new ETag.
+        """
+        menu = models.Menu.objects.create(menu_title='Dummy menu')
+        item = models.MenuItem.objects.create(item_text='dummy_1', menu=menu)
+        response = self.client.get(reverse('api_todays_menu'))
+        self.assertEquals(response['Cache-Control'], 'private, no-cache')
+        self.assertIn('Cookie', response['Vary'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('api_todays_menu'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.content, b'')
+        response = self.client.get(
+            reverse('api_todays_menu'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEquals(response.status_code, 304)
+        models.MenuItem.objects.sync_for_menu(menu, [(item.pk, 'dummy_2')])
+        bump_menu_version(menu.pk)
+        response = self.client.get(
+            reverse('api_todays_menu'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['menu']['items'], [{'id': item.pk, 'text': 'dummy_2'}])
+
+
+class OpenMenusApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_open_menus(self):
+        """
+        Tests that only the menus that can be ordered from right now are listed, soonest to close
+        first, and that a menu closing gives the list a new ETag.
+        """
+        now = timezone.now()
+        late_menu = models.Menu.objects.create(
+            menu_title='Late menu', orders_close_at=now + datetime.timedelta(hours=2))
+        models.MenuItem.objects.create(item_text='dummy_1', menu=late_menu)
+        early_menu = models.Menu.objects.create(
+            menu_title='Early menu',
+            service_date=timezone.localdate() + datetime.timedelta(days=1),
+            orders_open_at=now - datetime.timedelta(hours=1),
+            orders_close_at=now + datetime.timedelta(hours=1))
+        models.Menu.objects.create(
+            menu_title='Closed menu',
+            service_date=timezone.localdate() - datetime.timedelta(days=1),
+            orders_open_at=now - datetime.timedelta(hours=2),
+            orders_close_at=now - datetime.timedelta(hours=1))
+        response = self.client.get(reverse('api_open_menus'))
+        self.assertEquals(response.status_code, 200)
+        menus = response.json()['menus']
+        self.assertEquals([menu['id'] for menu in menus], [str(early_menu.pk), str(late_menu.pk)])
+        self.assertEquals(menus[1]['items'][0]['text'], 'dummy_1')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        response = self.client.get(reverse('api_open_menus'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        models.Menu.objects.filter(pk=early_menu.pk).update(orders_close_at=now)
+        response = self.client.get(reverse('api_open_menus'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([menu['id'] for menu in response.json()['menus']], [str(late_menu.pk)])
+
+
+class MenuApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(MenuApiTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        models.MenuItem.objects.create(item_text='dummy_2', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        models.Order.objects.create(
+            item_choice=dummy_choice, user=client_user, size=models.Order.LARGE)
+        cls.dummy_menu = dummy_menu
+        cls.dummy_choice = dummy_choice
+
+    def test_not_found(self):
+        """
+        Tests that a menu that doesn't exist returns 404.
+        """
+        response = self.client.get(
+            reverse('api_menu', kwargs={'unique_id': '00000000-0000-0000-0000-000000000000'}))
+        self.assertEquals(response.status_code, 404)
+
+    def test_counts_only_for_chefs(self):
+        """
+        Tests that only chefs get the number of orders of each item.
+        """
+        url = reverse('api_menu', kwargs={'unique_id': self.dummy_menu.unique_id})
+        self.client.login(username='client_user', password='12345')
+        data = self.client.get(url).json()
+        self.assertEquals(data['title'], 'Dummy menu')
+        self.assertNotIn('counts', data['items'][0])
+        self.client.login(username='chef_user', password='12345')
+        data = self.client.get(url).json()
+        self.assertEquals(
+            [(item['text'], item['count'], item['counts']) for item in data['items']],
+            [('dummy_1', 1, {'Normal': 0, 'Large': 1}), ('dummy_2', 0, {'Normal': 0, 'Large': 0})])
+
+    def test_new_order_changes_etag(self):
+        """
+        Tests that a chef revalidating a menu gets a 304 with a single query of its own, and a
+        new response once an order is placed.
+        """
+        url = reverse('api_menu', kwargs={'unique_id': self.dummy_menu.unique_id})
+        self.client.login(username='chef_user', password='12345')
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(3):
+            # Session, user and the order watermark
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        other_user = models.User.objects.create(username='other_user')
+        models.Order.objects.create(item_choice=self.dummy_choice, user=other_user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['items'][0]['count'], 2)
+
+    def test_only_safe_methods(self):
+        """
+        Tests that the API is read-only.
+        """
+        response = self.client.post(
+            reverse('api_menu', kwargs={'unique_id': self.dummy_menu.unique_id}))
+        self.assertEquals(response.status_code, 405)
+
+
+class UserOrdersApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    @classmethod
+    def setUpClass(cls):
+        super(UserOrdersApiTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        other_user = models.User.objects.create(username='other_user')
+        other_user.set_password('12345')
+        other_user.save()
+        models.Order.objects.create(item_choice=dummy_choice, user=client_user, comments='Sin sal')
+        cls.client_user = client_user
+
+    def test_requires_login(self):
+        """
+        Tests that anonymous users get a 401 error instead of a redirection.
+        """
+        response = self.client.get(
+            reverse('api_user_orders', kwargs={'user_id': self.client_user.pk}))
+        self.assertEquals(response.status_code, 401)
+
+    def test_block_other_clients(self):
+        """
+        Tests that a client can't see the orders of other users, but a chef can.
+        """
+        url = reverse('api_user_orders', kwargs={'user_id': self.client_user.pk})
+        self.client.login(username='other_user', password='12345')
+        self.assertEquals(self.client.get(url).status_code, 403)
+        self.client.login(username='chef_user', password='12345')
+        self.assertEquals(self.client.get(url).status_code, 200)
+
+    def test_own_orders(self):
+        """
+        Tests that a client gets its orders, and a 304 when they didn't change.
+        """
+        url = reverse('api_user_orders', kwargs={'user_id': self.client_user.pk})
+        self.client.login(username='client_user', password='12345')
+        response = self.client.get(url)
+        self.assertEquals(
+            [(order['item'], order['size'], order['comments'])
+             for order in response.json()['orders']],
+            [('dummy_1', 'Normal', 'Sin sal')])
+        self.assertIsNone(response.json()['next_cursor'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+
+class PlaceOrdersApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(PlaceOrdersApiTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        cls.choices = [
+            models.MenuItem.objects.create(item_text='dummy_%d' % idx, menu=dummy_menu)
+            for idx in range(2)
+        ]
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        lead_user = models.User.objects.create(username='lead_user')
+        lead_user.set_password('12345')
+        lead_user.save()
+        lead_user.user_permissions.add(Permission.objects.get(codename='place_team_orders'))
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        cls.team = [
+            models.User.objects.create(username='team_user_%d' % idx) for idx in range(3)]
+        cls.dummy_menu = dummy_menu
+        cls.chef_user = chef_user
+        cls.lead_user = lead_user
+
+    def place(self, data):
+        return self.client.post(
+            reverse('api_place_orders'), json.dumps(data), content_type='application/json')
+
+    def test_single_order(self):
+        """
+        Tests that a client can place its own order, only once.
+        """
+        self.client.login(username='client_user', password='12345')
+        data = {
+            'menu': str(self.dummy_menu.pk),
+            'orders': [{'item_choice': self.choices[0].pk, 'size': models.Order.LARGE}],
+        }
+        response = self.place(data)
+        self.assertEquals(response.status_code, 200)
+        result, = response.json()['orders']
+        self.assertEquals(result['status'], 'accepted')
+        order = models.Order.objects.get(pk=result['id'])
+        self.assertEquals((order.user.username, order.size), ('client_user', models.Order.LARGE))
+        response = self.place(data)
+        self.assertEquals(
+            response.json()['orders'], [{'status': 'rejected', 'reason': 'duplicate'}])
+
+    def test_team_batch(self):
+        """
+        Tests that a team lead places the orders of a team with a single request, with a number
+        of queries that depends on the items and sizes chosen but not on the number of orders,
+        and that every order gets its own result.
+        """
+        self.client.login(username='lead_user', password='12345')
+        orders = [
+            {'user': user.pk, 'item_choice': self.choices[idx % 2].pk, 'size': 0}
+            for idx, user in enumerate(self.team)
+        ]
+        orders += [
+            {'item_choice': self.choices[0].pk, 'size': models.Order.NORMAL},
+            {'user': self.team[0].pk, 'item_choice': self.choices[1].pk,
+             'size': models.Order.NORMAL},
+            {'user': self.chef_user.pk, 'item_choice': self.choices[0].pk,
+             'size': models.Order.NORMAL},
+            {'item_choice': 0, 'size': models.Order.NORMAL},
+        ]
+        # Prime the cached menu state
+        self.place({'menu': str(self.dummy_menu.pk), 'orders': [{}]})
+        with self.assertNumQueries(21):
+            response = self.place({'menu': str(self.dummy_menu.pk), 'orders': orders})
+        results = response.json()['orders']
+        self.assertEquals(
+            [result['status'] for result in results],
+            ['accepted'] * 4 + ['rejected'] * 3)
+        self.assertEquals(
+            [result.get('reason') for result in results[4:]],
+            ['duplicate', 'invalid_user', 'invalid'])
+        self.assertIn('item_choice', results[6]['errors'])
+        self.assertEquals(
+            models.Order.objects.filter(menu=self.dummy_menu).count(), 4)
+        self.assertEquals(
+            list(models.MenuItem.objects.with_total_count().filter(menu=self.dummy_menu)
+                 .order_by('pk').values_list('total_count', flat=True)),
+            [3, 1])
+
+    def test_others_need_permission(self):
+        """
+        Tests that a client without the place_team_orders permission can't order for others.
+        """
+        self.client.login(username='client_user', password='12345')
+        response = self.place({
+            'menu': str(self.dummy_menu.pk),
+            'orders': [{'user': self.team[0].pk, 'item_choice': self.choices[0].pk, 'size': 0}],
+        })
+        self.assertEquals(
+            response.json()['orders'], [{'status': 'rejected', 'reason': 'forbidden'}])
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_bad_requests(self):
+        """
+        Tests that invalid bodies, unknown menus and closed menus are rejected as a whole.
+        """
+        self.client.login(username='client_user', password='12345')
+        self.assertEquals(self.place({'orders': []}).status_code, 400)
+        self.assertEquals(
+            self.place({'menu': str(self.dummy_menu.pk), 'orders': []}).status_code, 400)
+        self.assertEquals(
+            self.place({'menu': '00000000-0000-0000-0000-000000000000', 'orders': [{}]})
+            .status_code, 404)
+        models.Menu.objects.filter(pk=self.dummy_menu.pk).update(orders_close_at=timezone.now())
+        self.assertEquals(
+            self.place({'menu': str(self.dummy_menu.pk), 'orders': [{}]}).status_code, 409)
+        self.client.logout()
+        self.assertEquals(
+            self.place({'menu': str(self.dummy_menu.pk), 'orders': [{}]}).status_code, 401)
@@ -0,0 +1,159 @@
+import datetime
+import uuid
+from unittest import mock
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from .. import models, caches
+
+
+class MenuPageCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(MenuPageCacheTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        models.MenuItem.objects.create(item_text='dummy_2', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        cls.dummy_menu = dummy_menu
+
+    def get_menu(self):
+        return self.client.get(reverse('menu', kwargs={'unique_id': self.dummy_menu.unique_id}))
+
+    def test_menu_page_is_cached(self):
+        """
+        Tests that once the menu page was seen, the menu and its items aren't queried again.
+        """
+        response = self.get_menu()
+        self.assertContains(response, 'dummy_2')
+        with self.assertNumQueries(0):
+            response = self.get_menu()
+        self.assertContains(response, 'dummy_2')
+        self.assertEquals(response.context['menu'], self.dummy_menu)
+
+    def test_bump_menu_version(self):
+        """
+        Tests that bumping the version of a menu discards its cached data.
+        """
+        state = caches.get_menu_state(self.dummy_menu.pk)
+        self.assertEquals([text for _, text in state['items']], ['dummy_1', 'dummy_2'])
+        models.MenuItem.objects.create(item_text='dummy_3', menu=self.dummy_menu)
+        self.assertEquals(len(caches.get_menu_state(self.dummy_menu.pk)['items']), 2)
+        caches.bump_menu_version(self.dummy_menu.pk)
+        self.assertEquals(len(caches.get_menu_state(self.dummy_menu.pk)['items']), 3)
+
+    def test_unknown_menu_keeps_no_version(self):
+        """
+        Tests that looking for a menu that doesn't exist doesn't leave its version in the cache.
+        """
+        unknown_id = uuid.uuid4()
+        response = self.client.get(reverse('menu', kwargs={'unique_id': unknown_id}))
+        self.assertEquals(response.status_code, 404)
+        self.assertIsNone(cache.get(caches.menu_version_key(unknown_id)))
+
+    def test_local_cache_is_reported(self):
+        """
+        Tests that deploying with a cache private to each process is reported.
+        """
+        warnings = [
+            warning.id
+            for warning in run_checks(tags=['caches'], include_deployment_checks=True)]
+        self.assertIn('reservations.W001', warnings)
+
+    def test_edit_refreshes_menu_page(self):
+        """
+        Tests that a menu edited by a chef is shown with its changes right away.
+        """
+        self.get_menu()
+        self.client.login(username='chef_user', password='12345')
+        self.client.post(
+            reverse('edit_menu', kwargs={'unique_id': self.dummy_menu.unique_id}),
+            {
+                'menu_title': 'Dummy menu edited',
+                'form-0-item_text': 'Menu 1 edited',
+                'form-0-id': '',
+                'form-TOTAL_FORMS': '1',
+                'form-MIN_NUM_FORMS': '1',
+                'form-INITIAL_FORMS': '0',
+                'form-MAX_NUM_FORMS': '1000'
+            }
+        )
+        response = self.get_menu()
+        self.assertContains(response, 'Dummy menu edited')
+        self.assertContains(response, 'Menu 1 edited')
+        self.assertNotContains(response, 'dummy_2')
+
+
+class TodaysMenuCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(TodaysMenuCacheTests, cls).setUpClass()
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+
+    def test_todays_menu_is_cached(self):
+        """
+        Tests that once looked up, today's menu (or the lack of it) isn't queried again.
+        """
+        self.assertIsNone(caches.get_todays_menu())
+        with self.assertNumQueries(0):
+            self.assertIsNone(caches.get_todays_menu())
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(2):
+            # The page's watermark and the previous menus
+            self.client.get(reverse('home'))
+
+    @mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func())
+    @mock.patch('reservations.tasks.publish_menu.delay')
+    def test_publishing_forgets_todays_menu(self, *_):
+        """
+        Tests that a menu published by a chef is today's menu right away.
+        """
+        self.assertIsNone(caches.get_todays_menu())
+        self.client.login(username='chef_user', password='12345')
+        self.client.post(reverse('new_menu'), {
+            'menu_title': 'Test menu',
+            'form-0-item_text': 'Menu 1',
+            'form-0-id': '',
+            'form-TOTAL_FORMS': '1',
+            'form-MIN_NUM_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000'
+        })
+        self.assertEquals(caches.get_todays_menu().menu_title, 'Test menu')
+
+    def test_todays_menu_rolls_over(self):
+        """
+        Tests that today's menu stops being cached as such once the local date changes.
+        """
+        menu = models.Menu.objects.create(menu_title='Today menu')
+        self.assertEquals(caches.get_todays_menu(), menu)
+        tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            self.assertIsNone(caches.get_todays_menu())
+        self.assertEquals(caches.get_todays_menu(), menu)
+
+    def test_deleted_menu_is_forgotten(self):
+        """
+        Tests that a deleted menu isn't returned as today's menu.
+        """
+        menu = models.Menu.objects.create(menu_title='Today menu')
+        self.assertEquals(caches.get_todays_menu(), menu)
+        menu.delete()
+        caches.bump_menu_version(menu.pk)
+        self.assertIsNone(caches.get_todays_menu())
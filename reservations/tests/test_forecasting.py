@@ -0,0 +1,100 @@
+import datetime
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+from django.utils import timezone
+from .. import models, forecasting
+
+
+class DemandModelTests(TestCase):
+
+    def test_build(self):
+        """
+        The estimate of a dish on a weekday is its mean number of orders by size on the menus of
+        that weekday, or on every menu if it was never offered on that weekday.
+        """
+        offers = [(0, 'Cazuela'), (0, 'cazuela '), (0, 'Porotos'), (2, 'Cazuela')]
+        orders = [
+            (0, 'Cazuela', models.Order.NORMAL, 4),
+            (0, 'cazuela ', models.Order.NORMAL, 2),
+            (0, 'cazuela ', models.Order.LARGE, 1),
+            (2, 'Cazuela', models.Order.LARGE, 6),
+        ]
+        model = forecasting.DemandModel.build(offers, orders)
+        self.assertEquals(model.forecast('CAZUELA', 0), [3.0, 0.5])
+        self.assertEquals(model.forecast('Cazuela', 2), [0.0, 6.0])
+        # Never offered on Tuesday, all of its menus are used
+        self.assertEquals(model.forecast('Cazuela', 1), [2.0, 7 / 3])
+        self.assertEquals(model.forecast('Porotos', 0), [0.0, 0.0])
+        self.assertIsNone(model.forecast('Charquicán', 0))
+        self.assertEquals(model.top_dishes(0, 1), ['Cazuela'])
+
+    def test_build_without_history(self):
+        """
+        A model built without any menus has no estimates.
+        """
+        model = forecasting.DemandModel.build([], [])
+        self.assertIsNone(model.forecast('Cazuela', 0))
+        self.assertEquals(model.top_dishes(0, 10), [])
+
+
+class ForecastDemandTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(ForecastDemandTests, cls).setUpClass()
+        now = timezone.now()
+        today = timezone.localdate()
+        for weeks in (1, 2):
+            menu = models.Menu.objects.create(
+                menu_title='Past menu', service_date=today - datetime.timedelta(weeks=weeks),
+                orders_close_at=now - datetime.timedelta(weeks=weeks))
+            choice = models.MenuItem.objects.create(item_text='Cazuela', menu=menu)
+            models.MenuItem.objects.create(item_text='Porotos', menu=menu)
+            for idx in range(weeks * 2):
+                user = models.User.objects.create(username='user_%d_%d' % (weeks, idx))
+                models.Order.objects.create(item_choice=choice, user=user)
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=now + datetime.timedelta(hours=1))
+        models.MenuItem.objects.create(item_text='Cazuela', menu=dummy_menu)
+        models.MenuItem.objects.create(item_text='Pastel de choclo', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        cls.dummy_menu = dummy_menu
+
+    def test_forecast_from_history(self):
+        """
+        The forecast of a dish comes from the orders of the closed menus of the same weekday,
+        and the model is cached until the next menu closes.
+        """
+        forecasts = forecasting.forecast_demand(['Cazuela', 'Nuevo'], timezone.localdate())
+        self.assertEquals(
+            forecasts, [{'item_text': 'Cazuela', 'sizes': [('Normal', 3.0), ('Large', 0.0)],
+                         'total': 3.0}])
+        with self.assertNumQueries(0):
+            forecasting.forecast_demand(['Cazuela'], timezone.localdate())
+        self.assertEquals(forecasting.next_close(), self.dummy_menu.orders_close_at)
+
+    def test_menu_pages_show_forecast(self):
+        """
+        The edit menu page shows the forecast of the menu's dishes, the new menu page the one
+        of the most ordered dishes.
+        """
+        self.client.login(username='chef_user', password='12345')
+        response = self.client.get(
+            reverse('edit_menu', kwargs={'unique_id': self.dummy_menu.unique_id}))
+        self.assertEquals(
+            [forecast['item_text'] for forecast in response.context['demand_forecast']],
+            ['Cazuela'])
+        self.assertContains(response, 'Demanda estimada')
+        models.Menu.objects.filter(pk=self.dummy_menu.pk).update(
+            service_date=timezone.localdate() + datetime.timedelta(days=1))
+        response = self.client.get(reverse('new_menu'))
+        self.assertEquals(
+            [forecast['item_text'] for forecast in response.context['demand_forecast']],
+            ['Cazuela', 'Porotos'])
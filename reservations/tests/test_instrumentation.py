@@ -0,0 +1,137 @@
+import re
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from .. import instrumentation, models
+
+
+class HistogramTests(TestCase):
+
+    def test_observe(self):
+        """
+        Tests that buckets are cumulative, as Prometheus expects.
+        """
+        histogram = instrumentation.Histogram((1, 5, 10))
+        for value in (0, 3, 7, 20):
+            histogram.observe(value)
+        self.assertEquals(histogram.counts, [1, 2, 3])
+        self.assertEquals((histogram.count, histogram.sum), (4, 30))
+
+    def test_render(self):
+        """
+        Tests the Prometheus text format, with label values escaped.
+        """
+        registry = instrumentation.MetricsRegistry()
+        registry.observe((('view', 'a"b'), ('method', 'GET')), {'nora_request_sql_queries': 3})
+        text = registry.render()
+        self.assertIn('# TYPE nora_request_sql_queries histogram', text)
+        self.assertIn('nora_request_sql_queries_bucket{view="a\\"b",method="GET",le="2"} 0', text)
+        self.assertIn('nora_request_sql_queries_bucket{view="a\\"b",method="GET",le="5"} 1', text)
+        self.assertIn(
+            'nora_request_sql_queries_bucket{view="a\\"b",method="GET",le="+Inf"} 1', text)
+        self.assertIn('nora_request_sql_queries_sum{view="a\\"b",method="GET"} 3', text)
+
+
+class InstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(InstrumentationMiddlewareTests, cls).setUpClass()
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        admin_user = models.User.objects.create(username='admin_user', is_superuser=True)
+        admin_user.set_password('12345')
+        admin_user.save()
+
+    def test_server_timing(self):
+        """
+        Tests that every response tells the time taken, along with the number and time of its
+        queries and the time spent rendering templates.
+        """
+        response = self.client.get(reverse('home'))
+        match = re.match(
+            r'total;dur=([\d.]+), sql;dur=([\d.]+);desc="(\d+) queries", template;dur=([\d.]+)$',
+            response['Server-Timing'])
+        self.assertIsNotNone(match)
+        total, sql_time, queries, template_time = match.groups()
+        self.assertEquals(queries, '3')
+        self.assertGreater(float(template_time), 0)
+        self.assertLessEqual(float(sql_time) + float(template_time), float(total) + 0.1)
+
+    def test_histograms_by_view(self):
+        """
+        Tests that requests are recorded by view name, unmatched URLs apart.
+        """
+        histograms = instrumentation.registry.histograms['nora_request_duration_seconds']
+        labels = (('view', 'home'), ('method', 'GET'))
+        before = histograms[labels].count if labels in histograms else 0
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        self.assertEquals(histograms[labels].count, before + 2)
+        self.client.get('/not-a-page')
+        self.assertIn(
+            (('view', instrumentation.UNRESOLVED_VIEW), ('method', 'GET')), histograms)
+
+    def test_streaming_is_recorded_when_closed(self):
+        """
+        Tests that the queries run while a streaming response is sent are recorded, once the
+        response is closed.
+        """
+        menu = models.Menu.objects.create(menu_title='Dummy menu')
+        item = models.MenuItem.objects.create(item_text='dummy_1', menu=menu)
+        models.Order.objects.create(
+            item_choice=item, user=models.User.objects.create(username='client_user'))
+        histograms = instrumentation.registry.histograms['nora_request_sql_queries']
+        labels = (('view', 'export_menu_orders'), ('method', 'GET'))
+        before = (
+            (histograms[labels].count, histograms[labels].sum) if labels in histograms else (0, 0))
+        self.client.login(username='chef_user', password='12345')
+        response = self.client.get(
+            reverse('export_menu_orders', kwargs={'unique_id': menu.unique_id}))
+        self.assertEquals(histograms[labels].count if labels in histograms else 0, before[0])
+        content = b''.join(response.streaming_content)
+        self.assertIn(b'dummy_1', content)
+        self.assertEquals(histograms[labels].count, before[0] + 1)
+        self.assertGreater(histograms[labels].sum - before[1], 0)
+
+    def test_unknown_method_is_grouped(self):
+        """
+        Tests that methods made up by the client are recorded under the same label.
+        """
+        self.client.generic('MADEUP', reverse('home'))
+        histograms = instrumentation.registry.histograms['nora_request_duration_seconds']
+        self.assertIn((('view', 'home'), ('method', instrumentation.OTHER_METHOD)), histograms)
+        self.assertNotIn((('view', 'home'), ('method', 'MADEUP')), histograms)
+
+    def test_metrics_only_for_superusers(self):
+        """
+        Tests that the metrics can't be seen by anonymous users or chefs, only by superusers.
+        """
+        self.client.get(reverse('home'))
+        self.assertEquals(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.login(username='chef_user', password='12345')
+        self.assertEquals(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.login(username='admin_user', password='12345')
+        response = self.client.get(reverse('metrics'))
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertContains(
+            response, 'nora_request_duration_seconds_count{view="home",method="GET"}')
+
+    @override_settings(NORA_METRICS_TOKEN='secret-token')
+    def test_metrics_token(self):
+        """
+        Tests that the metrics can be scraped with the token of the NORA_METRICS_TOKEN setting.
+        """
+        self.assertEquals(
+            self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code,
+            403)
+        self.assertEquals(
+            self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret-token').status_code,
+            200)
@@ -0,0 +1,221 @@
+import datetime
+import re
+import uuid
+from unittest import mock
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .. import models, caches, intake, tasks
+from .test_views import get_messages_as_list
+
+
+@override_settings(NORA_ORDER_INTAKE='queue', NORA_ORDER_QUEUE_URL='memory://')
+@mock.patch('reservations.tasks.drain_order_queue.apply_async')
+class OrderQueueTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        with intake.get_connection() as conn, conn.SimpleQueue(intake.ORDER_QUEUE_NAME) as queue:
+            queue.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(OrderQueueTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        other_choice = models.MenuItem.objects.create(item_text='dummy_2', menu=dummy_menu)
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        other_user = models.User.objects.create(username='other_user')
+        other_user.set_password('12345')
+        other_user.save()
+        cls.dummy_menu = dummy_menu
+        cls.dummy_choice = dummy_choice
+        cls.other_choice = other_choice
+        cls.client_user = client_user
+        cls.other_user = other_user
+
+    def post_order(self, username, choice):
+        self.client.login(username=username, password='12345')
+        return self.client.post(
+            reverse('new_order', kwargs={'unique_id': self.dummy_menu.unique_id}),
+            {'item_choice': choice.pk, 'size': models.Order.NORMAL})
+
+    def test_order_is_queued(self, apply_async):
+        """
+        Tests that an order posted in queue mode is accepted right away, without being saved,
+        and that a drain of the queue is scheduled.
+        """
+        response = self.post_order('client_user', self.dummy_choice)
+        self.assertEquals(response.status_code, 302)
+        messages = get_messages_as_list(response)
+        self.assertTrue(
+            str(messages[0]).startswith("Orden recibida exitosamente, será procesada en breve!"))
+        self.assertFalse(models.Order.objects.exists())
+        self.assertEquals(apply_async.call_count, 1)
+
+    def test_status_is_linked(self, apply_async):
+        """
+        Tests that the message of a queued order links to its status, which is pending until the
+        queue is drained and accepted after that.
+        """
+        response = self.post_order('client_user', self.dummy_choice)
+        status_url = re.search(r'href="([^"]+)"', str(get_messages_as_list(response)[0])).group(1)
+        self.assertEquals(self.client.get(status_url).json()['status'], intake.PENDING)
+        intake.drain_order_queue(10)
+        response = self.client.get(status_url)
+        self.assertEquals(response.json()['status'], intake.ACCEPTED)
+        order = models.Order.objects.get(user=self.client_user)
+        self.assertEquals(response.json()['ticket'], str(order.pk))
+
+    def test_failed_drain_is_rescheduled(self, apply_async):
+        """
+        Tests that when a batch of orders can't be saved, its orders are put back on the queue
+        and another drain is scheduled.
+        """
+        self.post_order('client_user', self.dummy_choice)
+        apply_async.reset_mock()
+        with mock.patch('reservations.intake.save_orders', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                tasks.drain_order_queue()
+        self.assertEquals(apply_async.call_count, 1)
+        tasks.drain_order_queue()
+        self.assertTrue(models.Order.objects.filter(user=self.client_user).exists())
+
+    def test_drain_saves_orders(self, apply_async):
+        """
+        Tests that draining the queue saves all the queued orders and their counts, and that the
+        status of the orders is then accepted.
+        """
+        self.post_order('client_user', self.dummy_choice)
+        self.post_order('other_user', self.dummy_choice)
+        self.assertEquals(intake.drain_order_queue(10), 2)
+        self.assertEquals(intake.drain_order_queue(10), 0)
+        self.assertEquals(models.Order.objects.filter(menu=self.dummy_menu).count(), 2)
+        choice = models.MenuItem.objects.with_total_count().get(pk=self.dummy_choice.pk)
+        self.assertEquals(choice.total_count, 2)
+        order = models.Order.objects.get(user=self.client_user)
+        self.client.login(username='client_user', password='12345')
+        response = self.client.get(reverse('order_status', kwargs={'ticket': order.pk}))
+        self.assertEquals(response.json()['status'], intake.ACCEPTED)
+        self.client.login(username='other_user', password='12345')
+        response = self.client.get(reverse('order_status', kwargs={'ticket': order.pk}))
+        self.assertEquals(response.status_code, 404)
+
+    def test_duplicate_is_rejected(self, apply_async):
+        """
+        Tests that a second order from the same user is rejected right away, before and after the
+        first one is saved.
+        """
+        self.post_order('client_user', self.dummy_choice)
+        response = self.post_order('client_user', self.other_choice)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[-1]), 'Usted ya tiene una orden para este menú!')
+        intake.drain_order_queue(10)
+        cache.clear()
+        response = self.post_order('client_user', self.other_choice)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[-1]), 'Usted ya tiene una orden para este menú!')
+        self.assertEquals(models.Order.objects.filter(user=self.client_user).count(), 1)
+
+    def test_out_of_time_is_rejected(self, apply_async):
+        """
+        Tests that an order posted after the ordering time is rejected right away.
+        """
+        models.Menu.objects.filter(pk=self.dummy_menu.pk).update(orders_close_at=timezone.now())
+        caches.bump_menu_version(self.dummy_menu.pk)
+        response = self.post_order('client_user', self.dummy_choice)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[0]), 'Ya pasó el tiempo para ordernar de este menú')
+        self.assertEquals(intake.drain_order_queue(10), 0)
+
+    def test_duplicate_in_queue_is_rejected(self, apply_async):
+        """
+        Tests that an order that reaches the queue for a user that already has an order (e.g: one
+        placed directly) is rejected when saving, and its status says so.
+        """
+        ticket = intake.enqueue_order(
+            self.client_user, self.dummy_menu, self.dummy_choice, models.Order.NORMAL)
+        models.Order.objects.create(item_choice=self.other_choice, user=self.client_user)
+        intake.drain_order_queue(10)
+        status = intake.get_order_status(ticket)
+        self.assertEquals(status['status'], intake.REJECTED)
+        self.assertEquals(status['reason'], 'duplicate')
+        self.assertEquals(models.Order.objects.filter(user=self.client_user).count(), 1)
+
+
+class OrderQueueCacheCheckTests(TestCase):
+    @override_settings(NORA_ORDER_INTAKE='queue')
+    def test_queue_needs_shared_cache(self):
+        """
+        Tests that queueing orders with a cache private to each process is reported as an error.
+        """
+        errors = [error.id for error in run_checks(tags=['caches'])]
+        self.assertIn('reservations.E001', errors)
+
+    @override_settings(
+        NORA_ORDER_INTAKE='queue',
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                            'LOCATION': 'nora_cache'}})
+    def test_queue_with_shared_cache(self):
+        """
+        Tests that queueing orders with a shared cache passes the check.
+        """
+        errors = [error.id for error in run_checks(tags=['caches'])]
+        self.assertNotIn('reservations.E001', errors)
+
+
+class StaleItemTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        self.dummy_choice = models.MenuItem.objects.create(
+            item_text='dummy_1', menu=self.dummy_menu)
+        self.other_choice = models.MenuItem.objects.create(
+            item_text='dummy_2', menu=self.dummy_menu)
+        self.users = [
+            models.User.objects.create(username='user_%d' % idx) for idx in range(2)]
+
+    def test_item_deleted_while_saving(self):
+        """
+        Tests that when an item is deleted while a batch is being saved, its orders are rejected
+        as invalid, the others are saved and the menu gets a new version.
+        """
+        payloads = [
+            {
+                'ticket': str(uuid.uuid4()),
+                'user': user.pk,
+                'menu': str(self.dummy_menu.pk),
+                'item': item.pk,
+                'size': models.Order.NORMAL,
+                'comments': '',
+            }
+            for user, item in zip(self.users, (self.dummy_choice, self.other_choice))
+        ]
+        version = caches.get_menu_version(self.dummy_menu.pk)
+        atomic = transaction.atomic
+        deleted = []
+
+        def delete_then_atomic(*args, **kwargs):
+            # The item is deleted right before the orders are saved
+            if not deleted:
+                deleted.append(True)
+                models.MenuItem.objects.filter(pk=self.dummy_choice.pk).delete()
+            return atomic(*args, **kwargs)
+        with mock.patch('django.db.transaction.atomic', side_effect=delete_then_atomic):
+            statuses = intake.save_orders(payloads)
+        self.assertEquals(
+            [statuses[uuid.UUID(payload['ticket'])].get('reason') for payload in payloads],
+            ['invalid_item', None])
+        self.assertEquals(
+            list(models.Order.objects.values_list('user', flat=True)), [self.users[1].pk])
+        self.assertEquals(
+            list(models.OrderAggregate.objects.values_list('item', 'count')),
+            [(self.other_choice.pk, 1)])
+        self.assertNotEquals(caches.get_menu_version(self.dummy_menu.pk), version)
@@ -0,0 +1,59 @@
+from wsgiref.util import setup_testing_defaults
+from django.test import TestCase
+from .. import loadtest, models
+
+
+class SummaryTests(TestCase):
+
+    def test_percentile(self):
+        """
+        Tests the nearest-rank percentiles.
+        """
+        values = list(range(1, 101))
+        self.assertEquals(loadtest.percentile(values, 50), 50)
+        self.assertEquals(loadtest.percentile(values, 99), 99)
+        self.assertEquals(loadtest.percentile([3, 1, 2], 95), 3)
+        self.assertEquals(loadtest.percentile([7], 50), 7)
+
+    def test_summarize(self):
+        """
+        Tests that requests are summed up overall and by step, in the order the steps were
+        first seen.
+        """
+        records = [
+            {'step': 'menu', 'ok': True, 'latency': 0.010, 'queries': 4},
+            {'step': 'order', 'ok': True, 'latency': 0.020, 'queries': 6},
+            {'step': 'order', 'ok': False, 'latency': 0.040, 'queries': None},
+            {'step': 'menu', 'ok': True, 'latency': 0.030, 'queries': 2},
+        ]
+        summary = loadtest.summarize(records, 2)
+        self.assertEquals(list(summary['steps']), ['menu', 'order'])
+        self.assertEquals(summary['overall']['throughput'], 2)
+        self.assertEquals(summary['overall']['error_rate'], 0.25)
+        self.assertEquals(summary['steps']['order']['errors'], 1)
+        self.assertEquals(summary['steps']['order']['queries'], {'mean': 6, 'max': 6})
+        self.assertEquals(
+            summary['steps']['menu']['latency_ms'],
+            {'mean': 20, 'p50': 10, 'p95': 30, 'p99': 30, 'max': 30})
+
+
+class CountQueriesTests(TestCase):
+
+    def test_query_count_header(self):
+        """
+        Tests that the wrapped application tells the number of queries of each request.
+        """
+        def application(environ, start_response):
+            models.User.objects.count()
+            models.Menu.objects.count()
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        environ = {}
+        setup_testing_defaults(environ)
+        headers = []
+        body = loadtest.count_queries(application)(
+            environ, lambda status, response_headers, exc_info=None: headers.extend(
+                response_headers))
+        self.assertEquals(body, [b'ok'])
+        self.assertIn((loadtest.QUERY_COUNT_HEADER, '2'), headers)
@@ -1,25 +1,250 @@
 import datetime
-from django.test import TestCase
+import io
+from unittest import mock
+from django.db import transaction, IntegrityError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from .. import models
 
 
 class MenuTests(TestCase):
 
-    def test_published_today_with_past_menu(self):
+    def test_one_menu_per_service_date(self):
         """
-        A menu that was published in the past must return False to published_today
+        A second menu for the same service date must be rejected by the database, and only the
+        first one is today's menu.
         """
-        past_time = timezone.localtime() + datetime.timedelta(days=-5)
-        past_menu = models.Menu()
-        past_menu.created = past_time
-        self.assertIs(past_menu.published_today(), False)
+        today_menu = models.Menu.objects.create(menu_title='Today menu')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.Menu.objects.create(menu_title='Another menu')
+        self.assertEquals(list(models.Menu.todays_menu.all()), [today_menu])
 
-    def test_published_today_with_today_menu(self):
+    @override_settings(NORA_ORDER_HOUR_LIMIT=11)
+    def test_default_ordering_window(self):
         """
-        A menu that was published today must return True to published_today
+        A menu saved without an ordering window can be ordered from its service date until the
+        hour limit of that day.
         """
-        cur_time = timezone.localtime()
-        today_menu = models.Menu()
-        today_menu.created = cur_time
-        self.assertIs(today_menu.published_today(), True)
+        service_date = timezone.localdate() + datetime.timedelta(days=3)
+        menu = models.Menu.objects.create(menu_title='Future menu', service_date=service_date)
+        self.assertEquals(timezone.localtime(menu.orders_open_at).date(), service_date)
+        self.assertEquals(timezone.localtime(menu.orders_open_at).time(), datetime.time())
+        self.assertEquals(timezone.localtime(menu.orders_close_at).date(), service_date)
+        self.assertEquals(timezone.localtime(menu.orders_close_at).time(), datetime.time(11))
+        self.assertIs(menu.is_open(), False)
+
+    def test_is_open(self):
+        """
+        Only the menus whose ordering window includes the current time are open, and listed by
+        open_now.
+        """
+        now = timezone.now()
+        open_menu = models.Menu.objects.create(
+            menu_title='Open menu',
+            orders_open_at=now - datetime.timedelta(hours=1),
+            orders_close_at=now + datetime.timedelta(hours=1))
+        closed_menu = models.Menu.objects.create(
+            menu_title='Closed menu',
+            service_date=timezone.localdate() - datetime.timedelta(days=1),
+            orders_open_at=now - datetime.timedelta(hours=2),
+            orders_close_at=now - datetime.timedelta(hours=1))
+        upcoming_menu = models.Menu.objects.create(
+            menu_title='Not yet open menu',
+            service_date=timezone.localdate() + datetime.timedelta(days=1),
+            orders_open_at=now + datetime.timedelta(hours=1),
+            orders_close_at=now + datetime.timedelta(hours=2))
+        self.assertIs(open_menu.is_open(), True)
+        self.assertIs(closed_menu.is_open(), False)
+        self.assertIs(upcoming_menu.is_open(), False)
+        self.assertEquals(list(models.Menu.objects.open_now()), [open_menu])
+
+
+class OrderPlacementTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(OrderPlacementTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        client_user = models.User.objects.create(username='client_user')
+        cls.dummy_menu = dummy_menu
+        cls.dummy_choice = dummy_choice
+        cls.client_user = client_user
+
+    def test_save_fills_menu(self):
+        """
+        An order saved without a menu gets the menu of its item choice.
+        """
+        order = models.Order.objects.create(item_choice=self.dummy_choice, user=self.client_user)
+        self.assertEqual(order.menu_id, self.dummy_menu.pk)
+        self.assertTrue(models.Order.objects.filter(menu=self.dummy_menu, user=self.client_user))
+
+    def get_choice(self):
+        return models.MenuItem.objects.select_related('menu').get(pk=self.dummy_choice.pk)
+
+    def test_place_fills_menu_and_count(self):
+        """
+        Placing an order associates it with the item choice's menu and adds one to the count.
+        """
+        order = models.Order.objects.place(self.client_user, self.get_choice(), comments='Hi')
+        self.assertEqual(order.menu, self.dummy_menu)
+        self.assertEqual(order.size, models.Order.NORMAL)
+        self.assertEqual(models.MenuItem.objects.get(pk=self.dummy_choice.pk).count, 1)
+
+    def test_place_twice_fails(self):
+        """
+        A second order for the same user and menu is rejected by the database and doesn't add
+        to the count.
+        """
+        models.Order.objects.place(self.client_user, self.get_choice())
+        with self.assertRaises(models.OrderAlreadyFound):
+            models.Order.objects.place(self.client_user, self.get_choice())
+        self.assertEqual(models.Order.objects.filter(user=self.client_user).count(), 1)
+        self.assertEqual(models.MenuItem.objects.get(pk=self.dummy_choice.pk).count, 1)
+
+    def test_place_other_integrity_error_propagates(self):
+        """
+        An integrity error other than a previous order of the user (e.g: the item being deleted
+        meanwhile) isn't reported as an order already found.
+        """
+        with mock.patch.object(
+                models.MenuItem.objects, 'add_to_count', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                models.Order.objects.place(self.client_user, self.get_choice())
+        self.assertFalse(models.Order.objects.filter(user=self.client_user).exists())
+
+    def test_place_out_of_time_fails(self):
+        """
+        An order issued after the ordering time is rejected without touching the database.
+        """
+        choice = self.get_choice()
+        choice.menu.orders_close_at = timezone.now()
+        with self.assertNumQueries(0), self.assertRaises(models.OutOfDateError):
+            models.Order.objects.place(self.client_user, choice)
+
+    def test_place_query_budget(self):
+        """
+        Placing an order only takes the insert, the count update and the aggregate update (plus
+        the savepoint statements of its transaction), once the aggregate of the item and size
+        exists.
+        """
+        other_user = models.User.objects.create(username='other_user')
+        models.Order.objects.place(other_user, self.get_choice())
+        choice = self.get_choice()
+        with self.assertNumQueries(5):
+            models.Order.objects.place(self.client_user, choice)
+
+
+class MenuItemCountTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(MenuItemCountTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        cls.dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+
+    def get_total_count(self):
+        return models.MenuItem.objects.with_total_count().get(pk=self.dummy_choice.pk).total_count
+
+    def test_add_to_count(self):
+        """
+        Without striping, the count is added to the menu item itself.
+        """
+        models.MenuItem.objects.add_to_count(self.dummy_choice.pk)
+        models.MenuItem.objects.add_to_count(self.dummy_choice.pk, 2)
+        self.assertEqual(models.MenuItem.objects.get(pk=self.dummy_choice.pk).count, 3)
+        self.assertEqual(self.get_total_count(), 3)
+        self.assertFalse(models.MenuItemCountShard.objects.exists())
+
+    @override_settings(NORA_COUNTER_SHARDS=4)
+    def test_striped_add_to_count(self):
+        """
+        With striping, the count is spread across the item's shards and the total adds them up,
+        along with whatever was already counted on the item itself.
+        """
+        models.MenuItem.objects.filter(pk=self.dummy_choice.pk).update(count=5)
+        for _ in range(20):
+            models.MenuItem.objects.add_to_count(self.dummy_choice.pk)
+        self.assertEqual(models.MenuItem.objects.get(pk=self.dummy_choice.pk).count, 5)
+        shards = models.MenuItemCountShard.objects.filter(item=self.dummy_choice)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(self.get_total_count(), 25)
+
+
+class OrderAggregateTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(OrderAggregateTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        cls.dummy_menu = dummy_menu
+        cls.first_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        cls.second_choice = models.MenuItem.objects.create(item_text='dummy_2', menu=dummy_menu)
+
+    def make_orders(self, choice, size, start, end):
+        for idx in range(start, end):
+            user = models.User.objects.create(username='aggregate_user_%d' % idx)
+            models.Order.objects.create(item_choice=choice, user=user, size=size)
+
+    def get_counts(self):
+        return set(models.OrderAggregate.objects.values_list('item_id', 'size', 'count'))
+
+    def test_orders_are_aggregated(self):
+        """
+        Saving new orders adds them to the aggregate of their item and size, saving them again
+        doesn't.
+        """
+        self.make_orders(self.first_choice, models.Order.NORMAL, 0, 3)
+        self.make_orders(self.first_choice, models.Order.LARGE, 3, 4)
+        self.make_orders(self.second_choice, models.Order.NORMAL, 4, 6)
+        models.Order.objects.first().save()
+        self.assertEquals(self.get_counts(), {
+            (self.first_choice.pk, models.Order.NORMAL, 3),
+            (self.first_choice.pk, models.Order.LARGE, 1),
+            (self.second_choice.pk, models.Order.NORMAL, 2),
+        })
+
+    def test_deleted_user_is_subtracted(self):
+        """
+        Deleting a user takes its orders, deleted along with it, out of the aggregates.
+        """
+        self.make_orders(self.first_choice, models.Order.NORMAL, 0, 3)
+        self.make_orders(self.first_choice, models.Order.LARGE, 3, 4)
+        models.User.objects.filter(username__in=['aggregate_user_0', 'aggregate_user_3']).delete()
+        self.assertEquals(self.get_counts(), {
+            (self.first_choice.pk, models.Order.NORMAL, 2),
+            (self.first_choice.pk, models.Order.LARGE, 0),
+        })
+
+    def test_subtract_never_goes_negative(self):
+        """
+        Subtracting from an item and size without orders doesn't make a negative count.
+        """
+        self.make_orders(self.first_choice, models.Order.NORMAL, 0, 1)
+        models.OrderAggregate.objects.add(
+            self.dummy_menu.pk, self.first_choice.pk, models.Order.NORMAL, -2)
+        models.OrderAggregate.objects.add(
+            self.dummy_menu.pk, self.second_choice.pk, models.Order.NORMAL, -1)
+        self.assertEquals(self.get_counts(), {(self.first_choice.pk, models.Order.NORMAL, 0)})
+
+    def test_rebuild(self):
+        """
+        Rebuilding the aggregates counts the orders again, only for the given menus if any.
+        """
+        self.make_orders(self.first_choice, models.Order.NORMAL, 0, 3)
+        self.make_orders(self.second_choice, models.Order.LARGE, 3, 4)
+        models.OrderAggregate.objects.update(count=0)
+        other_menu = models.Menu.objects.create(
+            menu_title='Other menu', service_date=timezone.localdate() - datetime.timedelta(days=1))
+        self.assertEquals(models.OrderAggregate.objects.rebuild([other_menu.pk]), 0)
+        self.assertEquals(models.OrderAggregate.objects.filter(count__gt=0).count(), 0)
+        out = io.StringIO()
+        call_command('rebuild_order_aggregates', stdout=out)
+        self.assertEquals(out.getvalue().strip(), 'Built 2 order aggregates.')
+        self.assertEquals(self.get_counts(), {
+            (self.first_choice.pk, models.Order.NORMAL, 3),
+            (self.second_choice.pk, models.Order.LARGE, 1),
+        })
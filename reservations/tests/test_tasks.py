@@ -0,0 +1,140 @@
+import datetime
+from unittest import mock
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from .. import models, tasks
+
+
+@override_settings(
+    CELERY_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    NORA_NOTIFICATION_CHUNK_SIZE=2)
+class MenuNotificationTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(MenuNotificationTests, cls).setUpClass()
+        cls.dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        for idx in range(5):
+            models.User.objects.create(username='user_%d' % idx, email='user_%d@test.com' % idx)
+        models.User.objects.create(username='no_mail_user')
+
+    @mock.patch('reservations.tasks.send_notification_chunk.delay')
+    def test_recipients_are_chunked(self, delay):
+        """
+        Tests that every user with an email is handed to a chunk task, in chunks of the given
+        size, and users without email are skipped.
+        """
+        tasks.queue_notification_chunks(self.dummy_menu.pk)
+        self.assertEquals(delay.call_count, 3)
+        recipients = [email for call in delay.call_args_list for email in call[0][2]]
+        self.assertEquals(recipients, ['user_%d@test.com' % idx for idx in range(5)])
+        self.assertEquals(delay.call_args_list[0][0][:2], ('new_menu', str(self.dummy_menu.pk)))
+
+    def test_chunk_sends_one_mail_per_recipient(self):
+        """
+        Tests that a chunk task sends a mail to each recipient, with the link to the menu.
+        """
+        tasks.send_notification_chunk(
+            'new_menu', str(self.dummy_menu.pk), ['a@test.com', 'b@test.com'])
+        self.assertEquals(len(mail.outbox), 2)
+        self.assertEquals(mail.outbox[0].to, ['a@test.com'])
+        self.assertEquals(mail.outbox[0].subject, "Nuevo menú del dia de hoy")
+        self.assertIn(str(self.dummy_menu.pk), mail.outbox[0].body)
+
+
+class PublishMenuTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(PublishMenuTests, cls).setUpClass()
+        cls.dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+
+    @mock.patch('reservations.tasks.send_slack_message')
+    @mock.patch('reservations.tasks.queue_notification_chunks')
+    def test_steps_run_once(self, queue_chunks, send_slack):
+        """
+        Tests that publishing a menu runs the given steps, and that publishing it again doesn't
+        notify anyone twice.
+        """
+        tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail', 'notify_slack'])
+        tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail', 'notify_slack'])
+        self.assertEquals(queue_chunks.call_count, 1)
+        self.assertEquals(send_slack.call_count, 1)
+        steps = models.MenuPublicationStep.objects.filter(menu=self.dummy_menu)
+        self.assertEquals(
+            sorted(steps.values_list('step', flat=True)), ['notify_mail', 'notify_slack'])
+        self.assertFalse(steps.exclude(state=models.MenuPublicationStep.DONE).exists())
+
+    @mock.patch('reservations.tasks.send_slack_message')
+    @mock.patch('reservations.tasks.queue_notification_chunks')
+    def test_failed_step_is_retried(self, queue_chunks, send_slack):
+        """
+        Tests that a step that fails is recorded as failed, so running the publication again
+        runs it, while the steps that succeeded aren't run again.
+        """
+        send_slack.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail', 'notify_slack'])
+        step = models.MenuPublicationStep.objects.get(menu=self.dummy_menu, step='notify_slack')
+        self.assertEquals(step.state, models.MenuPublicationStep.FAILED)
+        send_slack.side_effect = None
+        tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail', 'notify_slack'])
+        self.assertEquals(queue_chunks.call_count, 1)
+        self.assertEquals(send_slack.call_count, 2)
+
+    @override_settings(NORA_NOTIFICATION_CHUNK_SIZE=2)
+    @mock.patch('reservations.tasks.send_notification_chunk.delay')
+    def test_failed_mails_are_resumed(self, delay):
+        """
+        Tests that when notifying by mail fails midway, running the publication again only
+        notifies the users that weren't notified yet.
+        """
+        for idx in range(5):
+            models.User.objects.create(username='user_%d' % idx, email='user_%d@test.com' % idx)
+        delay.side_effect = [None, ConnectionError]
+        with self.assertRaises(ConnectionError):
+            tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail'])
+        delay.side_effect = None
+        tasks.publish_menu(str(self.dummy_menu.pk), ['notify_mail'])
+        recipients = [email for call in delay.call_args_list for email in call[0][2]]
+        self.assertEquals(
+            recipients,
+            ['user_0@test.com', 'user_1@test.com', 'user_2@test.com', 'user_3@test.com',
+             'user_2@test.com', 'user_3@test.com', 'user_4@test.com'])
+
+    @mock.patch('reservations.tasks.send_slack_message')
+    def test_abandoned_step_is_resumed(self, send_slack):
+        """
+        Tests that a step being run by another worker isn't run again, unless it was started
+        longer than NORA_PUBLICATION_STEP_TIMEOUT ago.
+        """
+        step = models.MenuPublicationStep.objects.create(menu=self.dummy_menu, step='notify_slack')
+        with self.assertRaises(models.PublicationStepBusy):
+            tasks.publish_menu(str(self.dummy_menu.pk), ['notify_slack'])
+        self.assertEquals(send_slack.call_count, 0)
+        models.MenuPublicationStep.objects.filter(pk=step.pk).update(
+            started=timezone.now() - datetime.timedelta(hours=1))
+        tasks.publish_menu(str(self.dummy_menu.pk), ['notify_slack'])
+        self.assertEquals(send_slack.call_count, 1)
+        step.refresh_from_db()
+        self.assertEquals(step.state, models.MenuPublicationStep.DONE)
+
+
+class QueueMenuPublicationTests(TestCase):
+
+    @mock.patch('reservations.tasks.publish_menu.app.connection_for_write')
+    def test_unreachable_broker_is_logged(self, connection_for_write):
+        """
+        Tests that when the broker can't be reached the publication isn't queued, and the failure
+        is logged instead of raised.
+        """
+        conn = connection_for_write.return_value.__enter__.return_value
+        conn.ensure_connection.side_effect = OperationalError('Connection refused')
+        with mock.patch('reservations.tasks.publish_menu.apply_async') as apply_async:
+            with self.assertLogs('reservations.tasks', 'ERROR'):
+                tasks.queue_menu_publication('menu-id', ['notify_mail'])
+        self.assertEquals(apply_async.call_count, 0)
+        conn.ensure_connection.assert_called_once_with(
+            max_retries=tasks.PUBLISH_MAX_RETRIES, interval_start=0)
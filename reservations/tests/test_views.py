@@ -1,9 +1,16 @@
+import csv
 import datetime
-from django.test import TestCase, Client
+import json
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.messages.storage.cookie import CookieStorage
 from django.utils import timezone
+from django.core.cache import cache
 from .. import models
+from ..caches import bump_menu_version, get_menu_page
 
 
 def get_messages_as_list(response):
@@ -106,6 +113,109 @@ class MenuTests(TestCase):
         self.assertEquals(response.context['order'].first(), dummy_order)
 
 
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(ConditionalPageTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        cls.dummy_menu = dummy_menu
+        cls.dummy_choice = dummy_choice
+        cls.chef_user = chef_user
+        cls.client_user = client_user
+
+    def test_anonymous_menu_is_public(self):
+        """
+        Tests that the menu page of anonymous users can be kept by shared caches, and that
+        revalidating it gets a 304 without rendering anything or querying the database.
+        """
+        url = reverse('menu', kwargs={'unique_id': self.dummy_menu.unique_id})
+        response = self.client.get(url)
+        self.assertEquals(response['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Cookie', response['Vary'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response.templates, [])
+        self.assertEquals(response['Cache-Control'], 'public, max-age=60')
+
+    def test_client_menu_follows_order_and_window(self):
+        """
+        Tests that the menu page of a client is private, and that it changes once the client
+        orders and once the menu closes.
+        """
+        url = reverse('menu', kwargs={'unique_id': self.dummy_menu.unique_id})
+        self.client.login(username='client_user', password='12345')
+        response = self.client.get(url)
+        self.assertEquals(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        models.Order.objects.create(item_choice=self.dummy_choice, user=self.client_user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+        later = timezone.now() + datetime.timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, '¡Ya pasó el tiempo para pedir de este menú!')
+
+    def test_pending_messages_render_page(self):
+        """
+        Tests that a request with pending messages gets the whole page, without validators.
+        """
+        url = reverse('home')
+        self.client.login(username='client_user', password='12345')
+        etag = self.client.get(url)['ETag']
+        # Not allowed, redirected with an error message
+        self.client.get(reverse('user_orders', kwargs={'user_id': self.chef_user.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEquals(response['Cache-Control'], 'private, no-cache')
+
+    def test_home_changes_with_menus(self):
+        """
+        Tests that the home page is revalidated with a 304 until a menu is added.
+        """
+        self.client.login(username='chef_user', password='12345')
+        response = self.client.get(reverse('home'))
+        etag = response['ETag']
+        self.assertEquals(
+            self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        models.Menu.objects.create(
+            menu_title='Past menu', service_date=timezone.localdate() - datetime.timedelta(days=1))
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['menus'][0].menu_title, 'Past menu')
+
+    def test_user_orders_changes_with_orders(self):
+        """
+        Tests that the orders page of a user is revalidated with a 304 until the user orders.
+        """
+        url = reverse('user_orders', kwargs={'user_id': self.client_user.pk})
+        self.client.login(username='client_user', password='12345')
+        etag = self.client.get(url)['ETag']
+        self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        models.Order.objects.create(item_choice=self.dummy_choice, user=self.client_user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.context['orders']), 1)
+
+
 class ViewMenuOrderTests(TestCase):
     def setUp(self):
         self.client = Client()
@@ -189,6 +299,215 @@ class ViewMenuOrderTests(TestCase):
         self.assertEquals(response.context['menu'], ViewMenuOrderTests.dummy_menu)
         self.assertEquals(response.context['orders'].object_list[0], dummy_order)
 
+    def make_orders(self, start, end):
+        for idx in range(start, end):
+            user = models.User.objects.create(username='orders_user_%d' % idx)
+            models.Order.objects.create(item_choice=ViewMenuOrderTests.dummy_choice, user=user)
+
+    def get_orders_page(self, cursor=None):
+        return self.client.get(
+            reverse('menu_orders', kwargs={'unique_id': ViewMenuOrderTests.dummy_menu.unique_id}),
+            {'cursor': cursor} if cursor else {})
+
+    def test_constant_queries(self):
+        """
+        Tests that the number of queries doesn't depend on the number of orders shown.
+        """
+        self.client.login(username='chef_user', password='12345')
+        self.make_orders(0, 2)
+        self.get_orders_page()
+        with self.assertNumQueries(6):
+            self.get_orders_page()
+        self.make_orders(2, 12)
+        with self.assertNumQueries(6):
+            response = self.get_orders_page()
+        self.assertEquals(len(response.context['orders']), 10)
+        self.assertEquals(
+            response.context['size_counts'],
+            [(models.Order.NORMAL, 'Normal', 12), (models.Order.LARGE, 'Large', 0)])
+        with self.assertNumQueries(6):
+            response = self.get_orders_page(response.context['orders'].next_cursor)
+        self.assertEquals(len(response.context['orders']), 2)
+
+    @override_settings(NORA_ORDER_VALUE_ROWS=True)
+    def test_value_rows(self):
+        """
+        Tests that with value rows, orders are listed as plain rows with everything the template
+        shows.
+        """
+        dummy_order = models.Order.objects.create(
+            item_choice=ViewMenuOrderTests.dummy_choice,
+            user=ViewMenuOrderTests.client_user,
+            size=models.Order.LARGE)
+        self.client.login(username='chef_user', password='12345')
+        response = self.get_orders_page()
+        row = response.context['orders'].object_list[0]
+        self.assertEquals(row.unique_id, dummy_order.unique_id)
+        self.assertEquals(row.username, 'client_user')
+        self.assertEquals(row.item_text, 'dummy_1')
+        self.assertEquals(row.size_display, 'Large')
+        self.assertContains(response, 'client_user')
+
+
+class OrderReportTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    @classmethod
+    def setUpClass(cls):
+        super(OrderReportTests, cls).setUpClass()
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        old_menu = models.Menu.objects.create(
+            menu_title='Old menu', service_date=timezone.localdate() - datetime.timedelta(days=40))
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu', service_date=yesterday)
+        old_choice = models.MenuItem.objects.create(item_text='old_1', menu=old_menu)
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        other_user = models.User.objects.create(username='other_user')
+        models.Order.objects.create(item_choice=old_choice, user=client_user)
+        models.Order.objects.create(item_choice=dummy_choice, user=client_user)
+        models.Order.objects.create(
+            item_choice=dummy_choice, user=other_user, size=models.Order.LARGE)
+        cls.dummy_menu = dummy_menu
+        cls.yesterday = yesterday
+
+    def test_block_client_user(self):
+        """
+        Tests that a client user can't see the order report.
+        """
+        self.client.login(username='client_user', password='12345')
+        response = self.client.get(reverse('order_report'))
+        self.assertEquals(response.status_code, 302)
+
+    def test_report_last_days(self):
+        """
+        Tests that by default the report has the order counts of the last 30 days, taken from
+        the aggregates alone.
+        """
+        self.client.login(username='chef_user', password='12345')
+        self.client.get(reverse('order_report'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_report'))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'FROM "reservations_order"' in query['sql']])
+        self.assertEquals(response.json()['rows'], [
+            {
+                'date': self.yesterday.isoformat(), 'menu': str(self.dummy_menu.pk),
+                'menu_title': 'Dummy menu', 'item': 'dummy_1', 'size': size, 'count': 1
+            }
+            for size in ('Normal', 'Large')
+        ])
+
+    def test_report_days(self):
+        """
+        Tests that the days of the report can be chosen, and invalid dates are rejected.
+        """
+        self.client.login(username='chef_user', password='12345')
+        start = timezone.localdate() - datetime.timedelta(days=50)
+        response = self.client.get(
+            reverse('order_report'), {'from': start.isoformat(), 'to': start.isoformat()})
+        self.assertEquals(response.json()['rows'], [])
+        response = self.client.get(reverse('order_report'), {'from': start.isoformat()})
+        self.assertEquals(len(response.json()['rows']), 3)
+        response = self.client.get(reverse('order_report'), {'from': '2018-02-30'})
+        self.assertEquals(response.status_code, 400)
+
+
+class ExportMenuOrdersTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+
+    @classmethod
+    def setUpClass(cls):
+        super(ExportMenuOrdersTests, cls).setUpClass()
+        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
+        dummy_choice = models.MenuItem.objects.create(item_text='dummy_1', menu=dummy_menu)
+        chef_user = models.User.objects.create(username='chef_user')
+        chef_user.set_password('12345')
+        chef_user.is_chef = True
+        chef_user.save()
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+        other_user = models.User.objects.create(username='other_user')
+        models.Order.objects.create(
+            item_choice=dummy_choice, user=client_user, comments='Sin sal, gracias')
+        models.Order.objects.create(
+            item_choice=dummy_choice, user=other_user, size=models.Order.LARGE)
+        cls.dummy_menu = dummy_menu
+
+    def export(self, **params):
+        return self.client.get(
+            reverse('export_menu_orders', kwargs={'unique_id': self.dummy_menu.unique_id}),
+            params)
+
+    def test_block_client_user(self):
+        """
+        Tests that a client user can't export a menu's orders.
+        """
+        self.client.login(username='client_user', password='12345')
+        response = self.export()
+        self.assertEquals(response.status_code, 302)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[0]), "Usted debe ser chef para poder ver esta página!")
+
+    def test_export_csv(self):
+        """
+        Tests that a chef gets every order of the menu streamed as CSV, oldest first.
+        """
+        self.client.login(username='chef_user', password='12345')
+        response = self.export()
+        self.assertTrue(response.streaming)
+        self.assertEquals(response['Content-Type'], 'text/csv')
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEquals(lines[0], ['user', 'item', 'size', 'comments', 'created'])
+        self.assertEquals(lines[1][:4], ['client_user', 'dummy_1', 'Normal', 'Sin sal, gracias'])
+        self.assertEquals(lines[2][:4], ['other_user', 'dummy_1', 'Large', ''])
+        self.assertEquals(len(lines), 3)
+
+    def test_export_csv_formulas(self):
+        """
+        Tests that comments and usernames that spreadsheets would run as formulas are exported
+        as text, while the NDJSON export keeps them as written.
+        """
+        formula_user = models.User.objects.create(username='@formula_user')
+        models.Order.objects.create(
+            item_choice=self.dummy_menu.menuitem_set.get(), user=formula_user,
+            comments='=HYPERLINK("http://example.com")')
+        self.client.login(username='chef_user', password='12345')
+        response = self.export()
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEquals(lines[3][0], "'@formula_user")
+        self.assertEquals(lines[3][3], '\'=HYPERLINK("http://example.com")')
+        response = self.export(format='ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEquals(json.loads(lines[2])['comments'], '=HYPERLINK("http://example.com")')
+
+    def test_export_ndjson(self):
+        """
+        Tests that a chef gets every order of the menu streamed as one JSON object per line.
+        """
+        self.client.login(username='chef_user', password='12345')
+        response = self.export(format='ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        orders = [json.loads(line) for line in lines]
+        self.assertEquals([order['user'] for order in orders], ['client_user', 'other_user'])
+        self.assertEquals(orders[1]['size'], 'Large')
+
+    def test_unknown_format(self):
+        """
+        Tests that asking for an unknown format is a bad request.
+        """
+        self.client.login(username='chef_user', password='12345')
+        self.assertEquals(self.export(format='xml').status_code, 400)
+
 
 class ViewClientOrdersTests(TestCase):
     def setUp(self):
@@ -366,6 +685,61 @@ class CreateMenuViewTests(TestCase):
         cur_menu = models.Menu.objects.filter(menu_title='Test menu')
         self.assertTrue(cur_menu)
 
+    @mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func())
+    @mock.patch('reservations.class_views.menu_create_view.queue_menu_publication')
+    def test_publication_is_only_queued_for_notifications(self, queue_publication, _):
+        """
+        Tests that a menu published without notifications doesn't queue any task, while its page
+        is still rendered ahead of the first visit, and that notifications are queued when asked.
+        """
+        self.client.login(username='chef_user', password='12345')
+        data = {
+            'menu_title': 'Test menu',
+            'form-0-item_text': 'Menu 1',
+            'form-0-id': '',
+            'form-TOTAL_FORMS': '1',
+            'form-MIN_NUM_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000'
+        }
+        self.client.post(reverse('new_menu'), data)
+        self.assertEquals(queue_publication.call_count, 0)
+        menu = models.Menu.objects.get(menu_title='Test menu')
+        with self.assertNumQueries(0):
+            get_menu_page(menu.pk)
+        menu.delete()
+        self.client.post(reverse('new_menu'), dict(data, notify_slack='on'))
+        menu = models.Menu.objects.get(menu_title='Test menu')
+        queue_publication.assert_called_once_with(str(menu.pk), ['notify_slack'])
+
+    def test_menu_items_inserted_at_once(self):
+        """
+        Tests that the items of a new menu are all added with a single insert.
+        """
+        self.client.login(username='chef_user', password='12345')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('new_menu'), {
+                'menu_title': 'Test menu',
+                'form-0-item_text': 'Menu 1',
+                'form-0-id': '',
+                'form-1-id': '',
+                'form-1-item_text': 'Menu 2',
+                'form-2-id': '',
+                'form-2-item_text': 'Menu 3',
+                'form-TOTAL_FORMS': '3',
+                'form-MIN_NUM_FORMS': '1',
+                'form-INITIAL_FORMS': '0',
+                'form-MAX_NUM_FORMS': '1000'
+            })
+        item_inserts = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('INSERT INTO "reservations_menuitem"')]
+        self.assertEquals(len(item_inserts), 1)
+        cur_menu = models.Menu.objects.get(menu_title='Test menu')
+        self.assertEquals(
+            list(cur_menu.menuitem_set.order_by('pk').values_list('item_text', flat=True)),
+            ['Menu 1', 'Menu 2', 'Menu 3'])
+
     def test_chef_user_cannot_publish_twice(self):
         """
         Tests that a chef client after having created a menu for the day, cannot create another one
@@ -467,6 +841,20 @@ class EditMenuViewTests(TestCase):
         ))
         self.assertEquals(response.status_code, 404)
 
+    def test_failed_edit_is_logged(self):
+        """
+        Tests that an edit that can't be saved (e.g: the menu doesn't exist) is logged and the
+        chef gets a 500 HTTP error code.
+        """
+        invalid_uuid = '5bfa3016-ded3-424c-9140-5b0554d962a6'
+        self.client.login(username='chef_user', password='12345')
+        with self.assertLogs('reservations.class_views.menu_edit_view', 'ERROR') as logs:
+            response = self.client.post(
+                reverse('edit_menu', kwargs={'unique_id': invalid_uuid}),
+                self.edit_menu_data([]))
+        self.assertEquals(response.status_code, 500)
+        self.assertIn(invalid_uuid, logs.output[0])
+
     def test_chef_can_edit_menu(self):
         """
         Tests that a chef client that tries to edit an existing menu, indeed, manages to modify
@@ -495,15 +883,90 @@ class EditMenuViewTests(TestCase):
         cur_menu = models.Menu.objects.filter(menu_title='Dummy menu edited')
         self.assertTrue(cur_menu)
 
+    def edit_menu_data(self, items, deleted=()):
+        """
+        Returns the POST data to edit the dummy menu with the given (id, item_text) pairs,
+        marking the ones in deleted to be deleted.
+        """
+        data = {
+            'menu_title': 'Dummy menu',
+            'form-TOTAL_FORMS': str(len(items)),
+            'form-MIN_NUM_FORMS': '1',
+            'form-INITIAL_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000'
+        }
+        for idx, (pk, text) in enumerate(items):
+            data['form-%s-id' % idx] = pk or ''
+            data['form-%s-item_text' % idx] = text
+            if pk in deleted:
+                data['form-%s-DELETE' % idx] = 'on'
+        return data
+
+    def test_edit_menu_by_item_id(self):
+        """
+        Tests that editing a menu matches the items by their id: the orders of an item that's
+        moved and renamed are kept, and deleting an item deletes only its orders.
+        """
+        menu = models.Menu.objects.create(
+            menu_title='Dummy menu',
+            service_date=timezone.localdate() - datetime.timedelta(days=1))
+        first = models.MenuItem.objects.create(item_text='first', menu=menu)
+        second = models.MenuItem.objects.create(item_text='second', menu=menu)
+        third = models.MenuItem.objects.create(item_text='third', menu=menu)
+        kept_order = models.Order.objects.create(user=self.client_user, item_choice=second)
+        models.Order.objects.create(user=self.chef_user, item_choice=first)
+        self.client.login(username='chef_user', password='12345')
+        response = self.client.post(
+            reverse('edit_menu', kwargs={'unique_id': menu.unique_id}),
+            self.edit_menu_data(
+                [(third.pk, 'third'), (second.pk, 'second edited'), (first.pk, 'first'),
+                 (None, 'fourth')],
+                deleted=(first.pk,)))
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(
+            list(menu.menuitem_set.order_by('pk').values_list('pk', 'item_text')),
+            [(second.pk, 'second edited'), (third.pk, 'third'),
+             (third.pk + 1, 'fourth')])
+        self.assertEquals(
+            list(models.Order.objects.filter(menu=menu).values_list('pk', flat=True)),
+            [kept_order.pk])
+
+    def test_edit_menu_constant_queries(self):
+        """
+        Tests that the number of queries to edit a menu doesn't depend on its number of items.
+        """
+        self.client.login(username='chef_user', password='12345')
+        query_counts = []
+        for size in (2, 10):
+            menu = models.Menu.objects.create(
+                menu_title='Dummy menu',
+                service_date=timezone.localdate() - datetime.timedelta(days=size))
+            items = models.MenuItem.objects.bulk_create_for_menu(
+                menu, ['item %s' % idx for idx in range(size)])
+            pks = list(menu.menuitem_set.order_by('pk').values_list('pk', flat=True))
+            data = self.edit_menu_data(
+                [(pks[0], 'renamed'), (pks[1], 'deleted'), (None, 'new 1'), (None, 'new 2')] +
+                [(pk, item.item_text) for pk, item in zip(pks[2:], items[2:])],
+                deleted=(pks[1],))
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    reverse('edit_menu', kwargs={'unique_id': menu.unique_id}), data)
+            self.assertEquals(response.status_code, 302)
+            self.assertEquals(menu.menuitem_set.count(), size + 1)
+            query_counts.append(len(queries))
+        self.assertEquals(query_counts[0], query_counts[1])
+
 class CreateOrderViewTests(TestCase):
     def setUp(self):
         self.client = Client()
+        cache.clear()
 
     @classmethod
     def setUpClass(cls):
         super(CreateOrderViewTests, cls).setUpClass()
-        dummy_menu = models.Menu.objects.create(menu_title='Dummy menu')
-        models.MenuItem.objects.create(
+        dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        dummy_choice = models.MenuItem.objects.create(
             item_text='dummy_1',
             menu=dummy_menu
         )
@@ -511,6 +974,13 @@ class CreateOrderViewTests(TestCase):
             item_text='dummy_2',
             menu=dummy_menu
         )
+        other_menu = models.Menu.objects.create(
+            menu_title='Other menu',
+            service_date=timezone.localdate() - datetime.timedelta(days=1))
+        other_choice = models.MenuItem.objects.create(
+            item_text='other_1',
+            menu=other_menu
+        )
         chef_user = models.User.objects.create(username='chef_user')
         chef_user.set_password('12345')
         chef_user.is_chef = True
@@ -522,6 +992,8 @@ class CreateOrderViewTests(TestCase):
         cls.chef_user = chef_user
         cls.client_user = client_user
         cls.dummy_menu = dummy_menu
+        cls.dummy_choice = dummy_choice
+        cls.other_choice = other_choice
 
     def test_anonymous_user_order_redirect(self):
         """
@@ -565,3 +1037,190 @@ class CreateOrderViewTests(TestCase):
         messages = get_messages_as_list(response)
         self.assertEquals(str(messages[0]), 'El menú al que trató de acceder no existe!')
 
+    def test_client_can_order(self):
+        """
+        Tests that a client posting a valid order gets it added and is redirected with a success
+        message.
+        """
+        self.client.login(username='client_user', password='12345')
+        response = self.client.post(
+            reverse('new_order', kwargs={'unique_id': CreateOrderViewTests.dummy_menu.unique_id}),
+            {'item_choice': CreateOrderViewTests.dummy_choice.pk, 'size': models.Order.LARGE}
+        )
+        self.assertEquals(response.status_code, 302)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[0]), "Orden añadida exitosamente!")
+        order = models.Order.objects.get(user=CreateOrderViewTests.client_user)
+        self.assertEquals(order.menu, CreateOrderViewTests.dummy_menu)
+        self.assertEquals(order.size, models.Order.LARGE)
+
+    def test_client_cannot_order_twice(self):
+        """
+        Tests that a second order from the same client for the same menu is rejected with an
+        error message.
+        """
+        self.client.login(username='client_user', password='12345')
+        url = reverse('new_order', kwargs={'unique_id': CreateOrderViewTests.dummy_menu.unique_id})
+        self.client.post(url, {'item_choice': CreateOrderViewTests.dummy_choice.pk, 'size': 0})
+        response = self.client.post(
+            url, {'item_choice': CreateOrderViewTests.dummy_choice.pk, 'size': 0})
+        self.assertEquals(response.status_code, 302)
+        messages = get_messages_as_list(response)
+        self.assertEquals(str(messages[-1]), 'Usted ya tiene una orden para este menú!')
+        self.assertEquals(
+            models.Order.objects.filter(user=CreateOrderViewTests.client_user).count(), 1)
+
+    def test_choice_from_other_menu_is_invalid(self):
+        """
+        Tests that an item choice that doesn't belong to the menu results in form errors and no
+        order being added.
+        """
+        self.client.login(username='client_user', password='12345')
+        response = self.client.post(
+            reverse('new_order', kwargs={'unique_id': CreateOrderViewTests.dummy_menu.unique_id}),
+            {'item_choice': CreateOrderViewTests.other_choice.pk, 'size': 0}
+        )
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('item_choice', response.context['form'].errors)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_menu_items_taken_from_cache(self):
+        """
+        Tests that once the menu's items are cached, showing the order form and validating the
+        item choice doesn't query the menu or its items.
+        """
+        self.client.login(username='client_user', password='12345')
+        url = reverse('new_order', kwargs={'unique_id': CreateOrderViewTests.dummy_menu.unique_id})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            self.assertContains(response, 'dummy_2')
+            self.client.post(url, {'item_choice': CreateOrderViewTests.dummy_choice.pk, 'size': 0})
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and (
+                'FROM "reservations_menuitem"' in query['sql'] or
+                'FROM "reservations_menu"' in query['sql'])
+        ])
+        self.assertTrue(
+            models.Order.objects.filter(user=CreateOrderViewTests.client_user).exists())
+
+    def test_menu_edit_invalidates_cached_items(self):
+        """
+        Tests that an item added to the menu after its items were cached can be ordered.
+        """
+        self.client.login(username='client_user', password='12345')
+        url = reverse('new_order', kwargs={'unique_id': CreateOrderViewTests.dummy_menu.unique_id})
+        self.client.get(url)
+        new_choice = models.MenuItem.objects.create(
+            item_text='dummy_3', menu=CreateOrderViewTests.dummy_menu)
+        bump_menu_version(CreateOrderViewTests.dummy_menu.pk)
+        response = self.client.post(url, {'item_choice': new_choice.pk, 'size': 0})
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(
+            models.Order.objects.get(user=CreateOrderViewTests.client_user).item_choice,
+            new_choice)
+
+
+class StaleItemChoiceTests(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+        self.dummy_menu = models.Menu.objects.create(
+            menu_title='Dummy menu', orders_close_at=timezone.now() + datetime.timedelta(hours=1))
+        self.dummy_choice = models.MenuItem.objects.create(
+            item_text='dummy_1', menu=self.dummy_menu)
+        self.other_choice = models.MenuItem.objects.create(
+            item_text='dummy_2', menu=self.dummy_menu)
+        client_user = models.User.objects.create(username='client_user')
+        client_user.set_password('12345')
+        client_user.save()
+
+    def test_deleted_item_is_rejected(self):
+        """
+        Tests that ordering an item that was deleted after the menu's items were cached shows the
+        form again with an error and the up to date items, instead of failing.
+        """
+        self.client.login(username='client_user', password='12345')
+        new_order_url = reverse('new_order', kwargs={'unique_id': self.dummy_menu.unique_id})
+        self.client.get(new_order_url)
+        models.MenuItem.objects.filter(pk=self.dummy_choice.pk).delete()
+        response = self.client.post(
+            new_order_url, {'item_choice': self.dummy_choice.pk, 'size': models.Order.NORMAL})
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.context['form'].has_error('item_choice', 'invalid_choice'))
+        self.assertEquals(
+            [pk for pk, _ in response.context['form'].fields['item_choice'].choices],
+            ['', self.other_choice.pk])
+        self.assertFalse(models.Order.objects.exists())
+
+
+class HomeViewTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    @classmethod
+    def setUpClass(cls):
+        super(HomeViewTests, cls).setUpClass()
+        for idx in range(25):
+            past_menu = models.Menu.objects.create(
+                menu_title='Past menu %d' % idx,
+                service_date=timezone.localdate() - datetime.timedelta(days=idx + 1))
+            models.Menu.objects.filter(pk=past_menu.pk).update(
+                created=timezone.now() - datetime.timedelta(days=idx + 1))
+        cls.today_menu = models.Menu.objects.create(menu_title='Today menu')
+
+    def test_today_menu_not_in_previous_menus(self):
+        """
+        Tests that today's menu is shown as such and not among the previous menus.
+        """
+        response = self.client.get(reverse('home'))
+        self.assertEquals(list(response.context['today_menu']), [HomeViewTests.today_menu])
+        self.assertNotIn(HomeViewTests.today_menu, response.context['menus'])
+
+    def test_cursor_pagination(self):
+        """
+        Tests that following the next cursors goes through every previous menu, newest first,
+        and that the previous cursor goes back to the same page.
+        """
+        seen = []
+        cursor = None
+        pages = []
+        while True:
+            response = self.client.get(reverse('home'), {'cursor': cursor} if cursor else {})
+            page = response.context['page_obj']
+            pages.append(page)
+            seen.extend(menu.menu_title for menu in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEquals(seen, ['Past menu %d' % idx for idx in range(25)])
+        self.assertEquals(len(pages), 3)
+        self.assertFalse(pages[0].has_previous())
+        response = self.client.get(reverse('home'), {'cursor': pages[2].previous_cursor})
+        self.assertEquals(
+            [menu.pk for menu in response.context['page_obj']],
+            [menu.pk for menu in pages[1]])
+
+    def test_same_queries_on_every_page(self):
+        """
+        Tests that any page takes the same number of queries, as no count or offset is needed,
+        and today's menu comes from the cache.
+        """
+        response = self.client.get(reverse('home'))
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('home'), {'cursor': cursor})
+        # The page's watermark and the menus of the page
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'), {'cursor': response.context['page_obj'].next_cursor})
+
+    def test_invalid_cursor(self):
+        """
+        Tests that an invalid cursor shows the first page.
+        """
+        response = self.client.get(reverse('home'), {'cursor': 'not a cursor'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['menus'][0].menu_title, 'Past menu 0')
@@ -1,7 +1,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
 
-from . import views
+from . import api, views
 from .class_views import OrderCreateView, HomeView, MenuCreateView, MenuEditView
 
 urlpatterns = [
@@ -17,6 +17,22 @@ urlpatterns = [
     path('new_menu', MenuCreateView.as_view(), name='new_menu'),
     path('new_order/<uuid:unique_id>', OrderCreateView.as_view(), name='new_order'),
     path('menu_orders/<uuid:unique_id>', views.view_menu_orders, name='menu_orders'),
-    path('view_orders/<int:user_id>', views.view_user_orders, name='user_orders')
+    path(
+        'menu_orders/<uuid:unique_id>/export',
+        views.export_menu_orders,
+        name='export_menu_orders'),
+    path(
+        'menu_orders/<uuid:unique_id>/events',
+        views.menu_order_events,
+        name='menu_order_events'),
+    path('reports/orders', views.order_report, name='order_report'),
+    path('view_orders/<int:user_id>', views.view_user_orders, name='user_orders'),
+    path('order_status/<uuid:ticket>', views.order_status, name='order_status'),
+    path('api/v1/menus/today', api.todays_menu, name='api_todays_menu'),
+    path('api/v1/menus/open', api.open_menus, name='api_open_menus'),
+    path('api/v1/menus/<uuid:unique_id>', api.menu_detail, name='api_menu'),
+    path('api/v1/users/<int:user_id>/orders', api.user_orders, name='api_user_orders'),
+    path('api/v1/orders', api.place_orders, name='api_place_orders'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
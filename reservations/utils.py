@@ -6,40 +6,113 @@ from django_slack import slack_message
 from django.contrib.sites.models import Site
 from django.conf import settings
 
-def still_in_ordering_time():
+def local_datetime(day, time):
 
     """
-    Utility function that returns True if it's still an ordering time (before 11 AM CLT), False
-    otherwise.
+    Utility function that returns the aware datetime of the given local (as given by the
+    TIME_ZONE setting) day and time. A time skipped by a daylight saving change is taken as the
+    one of standard time.
+
+    Arguments:
+
+    **day**
+        A date.
+    **time**
+        A time of the day.
     """
-    return (timezone.localtime().time() < datetime.time(settings.NORA_ORDER_HOUR_LIMIT))
+    return timezone.make_aware(datetime.datetime.combine(day, time), is_dst=False)
 
 
-def send_notification_mails(users, menu, request):
+def default_ordering_window(service_date):
 
     """
-    Utility function to notify users of a new menu, Uses celery to send mails asynchronously,
-    returning inmediately once the order is sent.
+    Utility function that returns the default times between which a menu served on the given
+    date can be ordered from, as a pair of aware datetimes: from the start of the day until the
+    hour given by the NORA_ORDER_HOUR_LIMIT setting (11 AM CLT by default).
 
     Arguments:
 
-    **users**
-        Queryset of users to send the notification mail to.
+    **service_date**
+        The date the menu is served.
+    """
+    return (
+        local_datetime(service_date, datetime.time()),
+        local_datetime(service_date, datetime.time(settings.NORA_ORDER_HOUR_LIMIT)))
+
+
+def seconds_until(moment):
 
-    **menu**
-        A Menu model object which will be used to form the mail's message
     """
-    # NOTE: get_current() from Sites model caches after the first call!
-    message = """ Esta es una notificación automatica del sistema de almuerzos Nora, para avisarte
+    Utility function that returns the number of seconds left until the given aware datetime, at
+    least 1 so it can be used as a cache timeout.
+
+    Arguments:
+
+    **moment**
+        An aware datetime.
+    """
+    return max(int((moment - timezone.now()).total_seconds()), 1)
+
+
+# Messages that can be sent as notifications, by template id. The body is formatted with the
+# URL of the menu being notified.
+NOTIFICATION_TEMPLATES = {
+    'new_menu': {
+        'subject': "Nuevo menú del dia de hoy",
+        'body': """ Esta es una notificación automatica del sistema de almuerzos Nora, para avisarte
     que un nuevo menú se encuentra disponible!, para más información por favor revisa el siguiente
-    link: """
-    message += 'https://' + Site.objects.get_current().domain + reverse('menu', kwargs={'unique_id': menu.unique_id})
-    subject = "Nuevo menú del dia de hoy"
-    from_mail = "no-reply-reservations@reservations.com"
-    emails = ()
-    for user in users:
-        emails = ((subject, message, from_mail, [user.email]),) + emails
-    results = mail.send_mass_mail(emails)
+    link: {url}""",
+    },
+}
+
+NOTIFICATION_FROM_MAIL = "no-reply-reservations@reservations.com"
+
+
+def build_notification(template_id, menu_id):
+
+    """
+    Utility function that returns the subject and body of a notification about a menu.
+
+    Arguments:
+
+    **template_id**
+        Key of the notification in NOTIFICATION_TEMPLATES.
+
+    **menu_id**
+        Primary key of the menu, used to form the link to it.
+    """
+    # NOTE: get_current() from Sites model caches after the first call!
+    template = NOTIFICATION_TEMPLATES[template_id]
+    url = 'https://' + Site.objects.get_current().domain + reverse(
+        'menu', kwargs={'unique_id': menu_id})
+    return template['subject'], template['body'].format(url=url)
+
+
+def send_notification_mails(template_id, menu_id, recipients):
+
+    """
+    Utility function that sends a notification mail to each of the given recipients, using a
+    single connection to the mail server for all of them. Mails are sent with the
+    CELERY_EMAIL_BACKEND (as this is meant to run within a Celery worker already).
+
+    Arguments:
+
+    **template_id**
+        Key of the notification in NOTIFICATION_TEMPLATES.
+
+    **menu_id**
+        Primary key of the menu being notified.
+
+    **recipients**
+        List of email addresses to send the notification to.
+    """
+    subject, body = build_notification(template_id, menu_id)
+    connection = mail.get_connection(backend=getattr(
+        settings, 'CELERY_EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'))
+    connection.send_messages([
+        mail.EmailMessage(subject, body, NOTIFICATION_FROM_MAIL, [email], connection=connection)
+        for email in recipients
+    ])
 
 
 def send_slack_message(request, menu):
@@ -1,20 +1,88 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .models import Menu, MenuItem, Order, User
-from .utils import still_in_ordering_time
+import csv
+import datetime
+import itertools
+import json
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from .models import Menu, MenuItem, Order, OrderAggregate, User
 from .forms import SignUpForm
-from .decorators import chef_required, login_required_message
+from .decorators import chef_required, conditional_page, login_required_message
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse,
+    StreamingHttpResponse)
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+from . import intake
+from .caches import get_menu_page, get_menu_state, get_menu_version
+from .api import user_orders_watermark
+from .pagination import CursorPaginator
+from .events import order_event_stream
+from .instrumentation import registry
 
 
+def order_list(queryset):
+    """
+    Utility function that prepares a queryset of orders for listing, so that everything shown
+    for each order is fetched in the same query. If the NORA_ORDER_VALUE_ROWS setting is True,
+    the orders are fetched as lightweight rows of values (see OrderQuerySet.as_rows) instead of
+    model objects.
+    """
+    if settings.NORA_ORDER_VALUE_ROWS:
+        return queryset.as_rows()
+    return queryset.select_related('user', 'item_choice', 'menu')
+
+
+def public_max_age(request):
+    return settings.NORA_PUBLIC_CACHE_MAX_AGE
+
+
+def menu_watermark(request, unique_id):
+    """
+    Returns the ETag and the last modification time of the menu page as seen by the user, see
+    decorators.conditional_page. For anonymous users and chefs they only depend on the version of
+    the menu, taken from the cache. For clients they also depend on whether the menu can still
+    be ordered from and on the client's order for it (a single query), and the last modification
+    time includes the opening and closing of the menu when they already happened.
+    """
+    try:
+        cur_menu = get_menu_state(unique_id)['menu']
+    except Menu.DoesNotExist:
+        return None
+    parts = ['menu', cur_menu.pk, get_menu_version(unique_id)]
+    times = [cur_menu.modified]
+    if request.user.is_authenticated:
+        parts += [request.user.pk, int(request.user.is_chef)]
+        if not request.user.is_chef:
+            order_created = (
+                Order.objects.filter(user=request.user, menu=unique_id)
+                .values_list('created', flat=True).first())
+            parts += [int(cur_menu.is_open()), order_created and order_created.timestamp()]
+            now = timezone.now()
+            times += [
+                time for time in (order_created, cur_menu.orders_open_at, cur_menu.orders_close_at)
+                if time and time <= now
+            ]
+    return '-'.join(str(part) for part in parts), max(times)
+
+
+@conditional_page(menu_watermark, public_max_age=public_max_age)
 def menu(request, unique_id):
     """
     Simple view for visualizing a single menu, returns 404 if the menu does not exist,
     otherwise it gets the Menu info, it's items and if the user is a client, any order
     associated with this menu (to see if he can order or not).
     Doesn't require authentication to visualize (But cannot do much other than see the items).
+    The part of the page that's the same for every user is rendered once per version of the menu
+    and cached (see caches.get_menu_page), only the user's order is looked up on every request.
+    Unchanged pages are answered with a 304 (see menu_watermark), and the page for anonymous
+    users can be kept by shared caches for NORA_PUBLIC_CACHE_MAX_AGE seconds.
 
     Arguments:
 
@@ -23,17 +91,19 @@ def menu(request, unique_id):
     **unique_id**
         The UUID recovered from the URL that is used to retrieve the menu.
     """
-    cur_menu = get_object_or_404(Menu, pk=unique_id)
-    menu_items = MenuItem.objects.filter(menu__exact=cur_menu)
+    try:
+        cur_menu, menu_items_html = get_menu_page(unique_id)
+    except Menu.DoesNotExist:
+        raise Http404
     context = {
         'menu': cur_menu,
-        'menu_items': menu_items
+        'menu_items_html': menu_items_html
     }
     if request.user.is_authenticated and not request.user.is_chef:
         try:
-            if still_in_ordering_time():
+            if cur_menu.is_open():
                 context['in_order_time'] = True
-            cur_order = Order.objects.filter(user__exact=request.user, item_choice__menu=cur_menu)
+            cur_order = Order.objects.filter(user__exact=request.user, menu=cur_menu)
             if cur_order:
                 context['order'] = cur_order
         except Order.DoesNotExist:
@@ -65,6 +135,8 @@ def view_menu_orders(request, unique_id):
     """
     Simple view for visualizing a specific menu's associated orders, it throws 404 if the menu is
     not found. This view can only be seen by an authenticated chef user.
+    The number of orders by item and by size are taken from the order aggregates, orders are
+    paginated by cursor, taken from the 'cursor' GET parameter.
 
     Arguments:
 
@@ -74,28 +146,200 @@ def view_menu_orders(request, unique_id):
         The UUID recovered from the URL that is used to retrieve the menu.
     """
     cur_menu = get_object_or_404(Menu, pk=unique_id)
-    menu_items = MenuItem.objects.filter(menu__exact=cur_menu)
+    menu_items = MenuItem.objects.filter(menu__exact=cur_menu).annotate(
+        total_count=Coalesce(Sum('order_aggregates__count'), 0))
     context = {
         'menu': cur_menu,
         'menu_items': menu_items
     }
-    all_orders = Order.objects.filter(item_choice__menu=cur_menu)
-    cur_page = request.GET.get('page', 1)
-    paginator = Paginator(all_orders, 10)
-    try:
-        cur_orders = paginator.page(cur_page)
-    except PageNotAnInteger:
-        cur_orders = paginator.page(1)
-    except EmptyPage:
-        cur_orders = paginator.page(paginator.num_pages)
-    context['orders'] = cur_orders
+    size_counts = dict(
+        OrderAggregate.objects.filter(menu=cur_menu).order_by().values_list('size')
+        .annotate(count=Sum('count')))
+    context['size_counts'] = [
+        (size, display, size_counts.get(size, 0)) for size, display in Order.MEAL_SIZES]
+    paginator = CursorPaginator(order_list(Order.objects.filter(menu=cur_menu)), 10)
+    context['orders'] = paginator.page(request.GET.get('cursor'))
+    context['value_rows'] = settings.NORA_ORDER_VALUE_ROWS
     return render(request, 'reservations/menu_orders.html', context)
 
+
+@login_required_message
+@chef_required(message="Usted debe ser chef para poder ver esta página!")
+def menu_order_events(request, unique_id):
+    """
+    View that streams the changes to the order counts of a menu (by item and by size) as
+    Server-Sent Events while orders are placed, so the menu's orders page can keep its counts up
+    to date without being reloaded. The events come from the event bus (see events), each stream
+    lasts NORA_EVENT_STREAM_TIMEOUT seconds and browsers reconnect by themselves afterwards.
+    It throws 404 if the menu is not found. This view can only be seen by an authenticated chef
+    user.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    **unique_id**
+        The UUID recovered from the URL that is used to retrieve the menu.
+    """
+    if not Menu.objects.filter(pk=unique_id).exists():
+        raise Http404
+    response = StreamingHttpResponse(
+        order_event_stream(unique_id, settings.NORA_EVENT_STREAM_TIMEOUT),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep proxies (e.g. nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+class Echo:
+    """
+    File-like object that just returns what is written to it, used to stream CSV rows.
+    """
+    def write(self, value):
+        return value
+
+
+# Columns of the order export, as (column name, row field) pairs.
+EXPORT_COLUMNS = (
+    ('user', 'username'),
+    ('item', 'item_text'),
+    ('size', 'size_display'),
+    ('comments', 'comments'),
+    ('created', 'created'),
+)
+
+# Number of orders fetched from the database at a time when exporting.
+EXPORT_CHUNK_SIZE = 2000
+
+# First characters that make spreadsheets take a CSV cell as a formula.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+    """
+    Utility function that returns a value to be written to an exported CSV, with a quote before
+    the text that spreadsheets would take as a formula (e.g: a comment like "=HYPERLINK(...)"),
+    so it's shown as written instead of run when the file is opened.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
 @login_required_message
+@chef_required(message="Usted debe ser chef para poder ver esta página!")
+def export_menu_orders(request, unique_id):
+    """
+    View that streams every order of a menu, oldest first, as CSV (by default) or NDJSON
+    (one JSON object per line) when the 'format' GET parameter is 'ndjson'. Orders are fetched
+    from the database in chunks and written as they come, so memory use doesn't depend on the
+    number of orders. It throws 404 if the menu is not found and can only be used by an
+    authenticated chef user.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    **unique_id**
+        The UUID recovered from the URL that is used to retrieve the menu.
+    """
+    cur_menu = get_object_or_404(Menu, pk=unique_id)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest('Formato desconocido')
+    rows = (
+        Order.objects.filter(menu=cur_menu).order_by('created', 'unique_id').as_rows()
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        lines = itertools.chain(
+            [[column for column, _ in EXPORT_COLUMNS]],
+            ([csv_cell(getattr(row, field)) for _, field in EXPORT_COLUMNS] for row in rows))
+        content = (writer.writerow(line) for line in lines)
+        content_type = 'text/csv'
+    else:
+        content = (
+            json.dumps({
+                column: str(getattr(row, field)) if field == 'created' else getattr(row, field)
+                for column, field in EXPORT_COLUMNS
+            }) + '\n' for row in rows)
+        content_type = 'application/x-ndjson'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="ordenes-%s.%s"' % (
+        cur_menu.pk, export_format)
+    return response
+
+
+# Number of days covered by the order report when no start date is given.
+REPORT_DEFAULT_DAYS = 30
+
+
+@login_required_message
+@chef_required(message="Usted debe ser chef para poder ver esta página!")
+def order_report(request):
+    """
+    View that returns, as JSON, the number of orders of each item and size by day (the service
+    date of the menu), read from the order aggregates. The days are taken from the 'from' and
+    'to' GET parameters (YYYY-MM-DD), by default the last 30 days up to today. This view can
+    only be used by an authenticated chef user.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    """
+    today = timezone.localdate()
+    try:
+        end = parse_date(request.GET.get('to') or today.isoformat())
+        start = parse_date(
+            request.GET.get('from') or (end - datetime.timedelta(days=REPORT_DEFAULT_DAYS - 1))
+            .isoformat())
+    except (ValueError, TypeError):
+        end = start = None
+    if start is None or end is None:
+        return HttpResponseBadRequest('Fecha inválida')
+    rows = (
+        OrderAggregate.objects.filter(menu__service_date__range=(start, end))
+        .order_by('menu__service_date', 'item_id', 'size')
+        .values_list('menu__service_date', 'menu_id', 'menu__menu_title', 'item__item_text',
+                     'size', 'count'))
+    sizes = dict(Order.MEAL_SIZES)
+    return JsonResponse({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'rows': [
+            {
+                'date': service_date.isoformat(),
+                'menu': str(menu_id),
+                'menu_title': menu_title,
+                'item': item_text,
+                'size': sizes[size],
+                'count': count,
+            }
+            for service_date, menu_id, menu_title, item_text, size, count in rows
+        ],
+    })
+
+
+def user_orders_page_watermark(request, user_id):
+    """
+    Returns the ETag and the last modification time of the orders page of a user as seen by the
+    viewer (see api.user_orders_watermark), or None if the viewer can't see it.
+    """
+    if not request.user.is_chef and request.user.pk != user_id:
+        return None
+    etag, last_modified = user_orders_watermark(request, user_id)
+    return 'page-%s-%s' % (etag, request.user.pk), last_modified
+
+
+@login_required_message
+@conditional_page(user_orders_page_watermark)
 def view_user_orders(request, user_id):
     """
     Simple view for visualizing an user specific orders, it throws 404 if the user doesn't exist,
     or redirects with an error if the user doesn't have authorization to see the orders.
+    Orders are paginated by cursor, taken from the 'cursor' GET parameter. Unchanged pages are
+    answered with a 304 (see user_orders_page_watermark).
 
     Arguments:
 
@@ -106,16 +350,55 @@ def view_user_orders(request, user_id):
     if(not request.user.is_chef and cur_user != request.user):
         messages.error(request, 'Usted no esta autorizado para entrar a esta página!')
         return redirect('home')
-    all_orders = Order.objects.filter(user__exact=cur_user)
-    cur_page = request.GET.get('page', 1)
-    paginator = Paginator(all_orders, 10)
-    try:
-        cur_orders = paginator.page(cur_page)
-    except PageNotAnInteger:
-        cur_orders = paginator.page(1)
-    except EmptyPage:
-        cur_orders = paginator.page(paginator.num_pages)
+    paginator = CursorPaginator(order_list(Order.objects.filter(user__exact=cur_user)), 10)
+    cur_orders = paginator.page(request.GET.get('cursor'))
     return render(
         request, 'reservations/view_orders.html',
-     {'orders': cur_orders, 'req_user': cur_user}
-     )
+     {
+         'orders': cur_orders,
+         'req_user': cur_user,
+         'value_rows': settings.NORA_ORDER_VALUE_ROWS
+     })
+
+
+@login_required_message
+def order_status(request, ticket):
+    """
+    Simple view that returns, as JSON, the status of an order taken through the order queue
+    (see the intake module): pending, accepted or rejected (along with the reason). It throws 404
+    if the ticket is unknown or the order is from a different user.
+
+    Arguments:
+
+    **ticket**
+        The UUID recovered from the URL, given when the order was queued.
+    """
+    status = intake.get_order_status(ticket)
+    if status is None or status['user'] != request.user.pk:
+        raise Http404
+    return JsonResponse({
+        'ticket': str(ticket),
+        'status': status['status'],
+        'reason': status.get('reason'),
+    })
+
+
+@never_cache
+def metrics(request):
+    """
+    View that returns the request metrics of this process (see instrumentation) in the
+    Prometheus text format. Only superusers, or requests with the token of the
+    NORA_METRICS_TOKEN setting as a bearer token in their Authorization header (e.g: from the
+    Prometheus server), can see them, anyone else gets a 403 error.
+
+    Arguments:
+
+    **request**
+        The request object which was sent to this view
+    """
+    token = settings.NORA_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (request.user.is_authenticated and request.user.is_superuser) and not (
+            token and constant_time_compare(authorization, 'Bearer %s' % token)):
+        return HttpResponseForbidden('Usted no esta autorizado para ver las métricas.')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')